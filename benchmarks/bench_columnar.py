@@ -0,0 +1,57 @@
+"""Compare memory use and equality checks of dict and columnar tables.
+
+    python benchmarks/bench_columnar.py
+
+The flat fixture has 100000 records and the nested one 20000 records of
+depth 5, with 5 values per repeated field.
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bigquerytest.columnar import ColumnarRecords
+from generators import flat_schema, nested_schema, generate_definition
+from bigquerytest.table import table_from_definition_string
+
+
+def measure(function):
+    tracemalloc.start()
+    try:
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main():
+    fixtures = [
+        ('flat 10 columns', flat_schema(10), 100000, 1),
+        ('nested depth 5', nested_schema(5), 20000, 5),
+    ]
+    print('%-20s %8s %12s %12s %10s %10s' % (
+        'fixture', 'records', 'dict MB', 'columnar MB', 'dict eq', 'column eq'))
+    for name, schema, num_rows, repeats in fixtures:
+        definition = generate_definition(schema, num_rows, repeats)
+        table = table_from_definition_string(definition, schema)
+        records = table.data
+        copy = table_from_definition_string(definition, schema).data
+
+        _, dict_size = measure(lambda: table_from_definition_string(definition, schema).data)
+        _, columnar_size = measure(
+            lambda: table_from_definition_string(definition, schema).to_columnar())
+        columnar = ColumnarRecords.from_records(records, table.schema)
+        other = ColumnarRecords.from_records(copy, table.schema)
+
+        dict_eq = min(timeit.repeat(lambda: records == copy, number=1, repeat=3))
+        column_eq = min(timeit.repeat(lambda: columnar == other, number=1, repeat=3))
+        print('%-20s %8d %12.1f %12.1f %9.4fs %9.4fs' % (
+            name, len(records), dict_size / 1e6, columnar_size / 1e6, dict_eq, column_eq))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark table_from_definition_string on large generated fixtures.
+
+    python benchmarks/bench_parse.py
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bigquerytest.table import (
+    PRIMITIVE_CONVERTERS,
+    SUPPORTED_TYPES,
+    BigQueryTestTable,
+    narrow_fields_to_columns,
+    parse_column_header,
+    schema_leaves,
+    table_from_definition_string,
+)
+from generators import flat_schema, nested_schema, generate_definition
+
+
+def legacy_parse_row(row, columns, offsets):
+    parsed_row = {}
+
+    header = ''
+    for column, offset in zip(columns, offsets):
+        header += ' ' * (offset - len(header)) + column
+
+    for i, (column, start) in enumerate(zip(columns, offsets)):
+
+        if start >= len(row):
+            break
+
+        if i == len(offsets) - 1:
+            value = row[start:len(row)]
+        else:
+            value = row[start:offsets[i + 1]]
+            if len(row) > offsets[i + 1] and value[-1] != ' ':
+                raise ValueError('Values do not line up with columns: \n%s\n%s' % (header, row))
+
+        if value[0] == ' ' and value.strip():
+            raise ValueError('Values do not line up with columns: \n%s\n%s' % (header, row))
+
+        value = value.strip()
+        if value:
+            parsed_row[column] = value
+
+    return parsed_row
+
+
+def legacy_is_new_record(schema, parsed_row):
+    return all([parsed_row.get(f.long_name)
+                for f in schema_leaves(schema)
+                if f.type != 'record'
+                and not f.is_repeated_branch])
+
+
+def legacy_update_record_for_field(field, parsed_row, record):
+    if field.type not in SUPPORTED_TYPES:
+        raise ValueError('Field type not supported: %s' % field.type)
+
+    value = None
+    append = True
+    if field.long_name in parsed_row:
+        if field.type in PRIMITIVE_CONVERTERS:
+            value = PRIMITIVE_CONVERTERS[field.type](parsed_row[field.long_name])
+
+    if field.type == 'record':
+        if field.repeated:
+            if legacy_is_new_record(field.subfields, parsed_row) or not record.get(field.name):
+                value = {}
+            else:
+                value = record[field.name][-1]
+                append = False
+        else:
+            value = record.get(field.name, {})
+        for f in field.subfields:
+            legacy_update_record_for_field(f, parsed_row, value)
+
+    if value:
+        if field.repeated:
+            if append:
+                record[field.name] = record.get(field.name, []) + [value]
+            else:
+                record[field.name][-1] = value
+        else:
+            record[field.name] = value
+
+
+def legacy_table_from_definition_string(table_definition, schema):
+    columns = None
+    records = []
+    record = None
+    for row in table_definition.strip('\n').splitlines():
+        if row.strip().startswith('#') or not row.strip():
+            continue
+        if columns is None:
+            columns, offsets = parse_column_header(row)
+            schema = narrow_fields_to_columns(schema, columns)
+        else:
+            parsed_row = legacy_parse_row(row, columns, offsets)
+            if legacy_is_new_record(schema, parsed_row):
+                if record is not None:
+                    records.append(record)
+                record = {}
+            for field in schema:
+                legacy_update_record_for_field(field, parsed_row, record)
+    if record:
+        records.append(record)
+    return BigQueryTestTable(records, schema)
+
+
+def main():
+    fixtures = [
+        ('flat 10 columns', flat_schema(10), 100000, 1),
+        ('flat 50 columns', flat_schema(50), 20000, 1),
+        ('nested depth 5', nested_schema(5), 20000, 5),
+        ('nested depth 5, long arrays', nested_schema(5), 10, 2000),
+    ]
+    print('%-28s %8s %10s %12s %12s' % ('fixture', 'rows', 'bytes', 'legacy', 'compiled'))
+    for name, schema, num_rows, repeats in fixtures:
+        definition = generate_definition(schema, num_rows, repeats)
+        expected = legacy_table_from_definition_string(definition, schema).data
+        assert table_from_definition_string(definition, schema).data == expected
+
+        legacy = min(timeit.repeat(
+            lambda: legacy_table_from_definition_string(definition, schema),
+            number=1, repeat=3))
+        compiled = min(timeit.repeat(
+            lambda: table_from_definition_string(definition, schema),
+            number=1, repeat=3))
+        print('%-28s %8d %10d %11.4fs %11.4fs' % (
+            name, num_rows * repeats, len(definition), legacy, compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark _replace_tables_in_query on large generated queries.
+
+    python benchmarks/bench_rewrite.py
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bigquerytest.rewrite import TABLE_REGEX, TableRewriter
+
+
+def generate_query(num_tables, num_selects, seed=0):
+    rng = random.Random(seed)
+    tables = ['project-%d.dataset_%d.table_%d' % (i % 3, i % 5, i)
+              for i in range(num_tables)]
+    selects = []
+    for i in range(num_selects):
+        table = rng.choice(tables)
+        selects.append(
+            "SELECT t.id, t.name AS `name_%d`, 'from %s' AS label\n"
+            "-- join against %s\n"
+            "FROM `%s` AS t JOIN `%s` AS u ON t.id = u.id\n"
+            "WHERE t.value > %d" % (i, table, table, table, rng.choice(tables), i))
+    return tables, '\nUNION ALL\n'.join(selects)
+
+
+def legacy_replace(mock_tables, sql, project):
+    replacements = {}
+    for table_name, mock_table_id in mock_tables.items():
+        match = TABLE_REGEX.match(table_name)
+        project_, dataset, table = match.groups()
+        for match in TABLE_REGEX.finditer(sql):
+            sql_project, sql_dataset, sql_table = match.groups()
+            if sql_project is None:
+                sql_project = project
+            start, end = match.span()
+            if (sql_project == project_ and sql_dataset == dataset and
+                    sql_table == table):
+                replacements[sql[start:end]] = mock_table_id
+    for string, replacement in replacements.items():
+        sql = sql.replace(string, replacement)
+    return sql
+
+
+def main():
+    print('%8s %8s %10s %12s %12s' % ('tables', 'selects', 'sql bytes', 'legacy', 'single pass'))
+    for num_tables, num_selects in [(5, 100), (20, 1000), (50, 3000)]:
+        tables, sql = generate_query(num_tables, num_selects)
+        mock_tables = {t: '`p.d.mock_%d`' % i for i, t in enumerate(tables)}
+
+        legacy = min(timeit.repeat(
+            lambda: legacy_replace(mock_tables, sql, 'p'), number=1, repeat=3))
+        single_pass = min(timeit.repeat(
+            lambda: TableRewriter(mock_tables, 'p').rewrite(sql), number=1, repeat=3))
+
+        print('%8d %8d %10d %11.4fs %11.4fs' % (
+            num_tables, num_selects, len(sql), legacy, single_pass))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Time and peak memory of the table parse, flatten and compare paths.
+
+    python benchmarks/bench_table.py --save baseline.json
+    python benchmarks/bench_table.py --compare baseline.json
+
+Exits with status 1 when a stage is slower or uses more memory than the
+baseline by more than --threshold.
+"""
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bigquerytest.table import (
+    api_response_from_records,
+    flatten_table,
+    get_column_widths,
+    table_from_api_response,
+    table_from_definition_string,
+    table_prettyprint,
+)
+from bigquerytest.testcase import BigQueryTestCase
+from generators import flat_schema, nested_schema, struct_schema, generate_definition
+
+
+FIXTURES = [
+    # name, schema, rows, repeats per row
+    ('wide', flat_schema(200), 2000, 1),
+    ('deep', struct_schema(8), 10000, 1),
+    ('repeated', nested_schema(3), 100, 200),
+    ('long', flat_schema(5), 50000, 1),
+]
+
+
+class Comparer(BigQueryTestCase):
+    definition_cache = None
+
+    def __init__(self):
+        super(Comparer, self).__init__(methodName='__class__')
+
+
+def stages(definition, schema):
+    table = table_from_definition_string(definition, schema)
+    response = api_response_from_records(table.data, table.schema)
+    flat = flatten_table(table.data, table.schema)
+    widths = get_column_widths(flat)
+    comparer = Comparer()
+    return [
+        ('parse', lambda: table_from_definition_string(definition, schema)),
+        ('api_response', lambda: table_from_api_response(response, table.schema).data),
+        ('flatten', lambda: flatten_table(table.data, table.schema)),
+        ('column_widths', lambda: get_column_widths(flat)),
+        ('prettyprint', lambda: table_prettyprint(flat, widths)),
+        ('assert_equal', lambda: comparer.assert_tables_equal(table, definition)),
+    ]
+
+
+def measure(function, repeat):
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+
+def run(scale, repeat, only=None):
+    results = {}
+    for name, schema, rows, repeats in FIXTURES:
+        definition = generate_definition(schema, max(int(rows * scale), 1), repeats)
+        for stage, function in stages(definition, schema):
+            key = '%s/%s' % (name, stage)
+            if only and not any(o in key for o in only):
+                continue
+            results[key] = measure(function, repeat)
+            print_result(key, results[key])
+    return results
+
+
+def print_result(key, result, baseline=None):
+    peak = result['peak_bytes']
+    line = '%-26s %10.4fs %10s' % (
+        key, result['seconds'], '-' if peak is None else '%.1fMB' % (peak / 1e6))
+    if baseline is not None:
+        line += '  %+7.1f%% time' % change(result['seconds'], baseline['seconds'])
+        if peak is not None and baseline.get('peak_bytes'):
+            line += '  %+7.1f%% memory' % change(peak, baseline['peak_bytes'])
+    print(line)
+
+
+def change(value, baseline):
+    return 100.0 * (value - baseline) / baseline if baseline else 0.0
+
+
+def regressions(results, baseline, threshold):
+    found = []
+    for key, result in sorted(results.items()):
+        before = baseline.get(key)
+        if before is None:
+            continue
+        for metric in ['seconds', 'peak_bytes']:
+            if result.get(metric) is None or not before.get(metric):
+                continue
+            if result[metric] > before[metric] * (1 + threshold):
+                found.append((key, metric, before[metric], result[metric]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of rows of every fixture')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='report the fastest of this many runs')
+    parser.add_argument('--only', action='append',
+                        help='only run stages whose fixture/stage name contains this')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare against this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown before failing')
+    args = parser.parse_args(argv)
+
+    print('%-26s %11s %10s' % ('stage', 'time', 'peak'))
+    results = run(args.scale, args.repeat, args.only)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'scale': args.scale,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != args.scale:
+        print('warning: baseline was run with --scale %s' % baseline.get('scale'))
+    print('\ncompared to %s:' % args.compare)
+    for key, result in sorted(results.items()):
+        print_result(key, result, baseline['results'].get(key))
+
+    found = regressions(results, baseline['results'], args.threshold)
+    for key, metric, before, after in found:
+        print('REGRESSION %s %s: %s -> %s' % (key, metric, before, after))
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Synthetic schemas and table definitions for the benchmarks."""
+import random
+
+from bigquerytest.table import BigQueryTestSchemaField, schema_leaves
+
+
+def field(long_name, type, repeated=False, subfields=None, repeated_branch=False):
+    return BigQueryTestSchemaField(
+        long_name.split('.')[-1], type, long_name, subfields, not repeated,
+        repeated, repeated_branch or repeated)
+
+
+def flat_schema(num_columns):
+    return [field('c%d' % i, 'integer' if i % 2 else 'string')
+            for i in range(num_columns)]
+
+
+def struct_schema(depth):
+    # depth levels of records, each with a value and the next level
+    def level(prefix, d):
+        subfields = [field(prefix + '.v', 'string')]
+        if d > 1:
+            subfields.append(level(prefix + '.n', d - 1))
+        return field(prefix, 'record', subfields=subfields)
+    return [field('id', 'integer'), level('s', depth)]
+
+
+def nested_schema(depth):
+    # id, then depth levels of repeated records with a value and the next level
+    def level(prefix, d):
+        subfields = [field(prefix + '.v', 'integer', repeated_branch=True)]
+        if d > 1:
+            subfields.append(level(prefix + '.n', d - 1))
+        return field(prefix, 'record', True, subfields)
+    return [field('id', 'integer'), level('r', depth)]
+
+
+def generate_definition(schema, num_rows, repeats=1, seed=0):
+    rng = random.Random(seed)
+    columns = [f.long_name for f in schema_leaves(schema)]
+    width = max([len(c) for c in columns] + [5]) + 2
+    lines = [''.join(c.ljust(width) for c in columns).rstrip()]
+    for i in range(num_rows):
+        for j in range(repeats):
+            values = []
+            for f in schema_leaves(schema):
+                if j and not f.is_repeated_branch:
+                    values.append('')
+                elif f.type == 'integer':
+                    values.append(str(rng.randint(1, 1000)))
+                else:
+                    values.append('s%d' % rng.randint(0, 1000))
+            lines.append(''.join(v.ljust(width) for v in values).rstrip())
+    return '\n'.join(lines)
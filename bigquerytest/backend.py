@@ -0,0 +1,242 @@
+from __future__ import absolute_import
+import json
+import logging
+import threading
+from io import BytesIO
+import httplib2
+from google.cloud import bigquery
+from google.cloud.exceptions import Conflict
+
+from .clients import endpoint_connection
+from .literals import create_table_statement
+from .metrics import Counters
+from .results import QueryResultReader, dry_run_from_job_resource
+from .table import json_default, schema_from_bigquery_schema
+
+
+# BigQuery rejects standard SQL queries longer than 1MB
+MAX_SCRIPT_LENGTH = 1000000
+
+
+class BigQueryBackend(object):
+
+    remote = True
+
+    # datasets known to exist, shared by all backends of this process
+    _datasets = set()
+    _datasets_lock = threading.Lock()
+
+    def __init__(self, project, dataset, waiter, api_endpoint=None, client_pool=None,
+                 fetch_bytes_billed=False):
+        self.project = project
+        self.dataset = dataset
+        self.waiter = waiter
+        self.api_endpoint = api_endpoint
+        self.client_pool = client_pool
+        self.fetch_bytes_billed = fetch_bytes_billed
+        self.counters = Counters()
+        self._client = None
+        self._log = logging.getLogger('bigquerytest')
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._make_client(self.project)
+        return self._client
+
+    def _make_client(self, project):
+        if self.client_pool is not None:
+            return self.client_pool.client(project, self.api_endpoint)
+
+        if self.api_endpoint is None:
+            return bigquery.Client(project=project)
+
+        # talk to a stand-in server without credentials
+        client = bigquery.Client(project=project, http=httplib2.Http())
+        client._connection = endpoint_connection(self.api_endpoint, client._connection.http)
+        return client
+
+    def ensure_dataset(self):
+        key = (self.project, self.dataset, self.api_endpoint)
+        with self._datasets_lock:
+            if key in self._datasets:
+                return
+            dataset = self.client.dataset(self.dataset)
+            if not dataset.exists():
+                self._log.info('Creating dataset: %s', self.dataset)
+                try:
+                    dataset.create()
+                except Conflict:
+                    pass
+            self._datasets.add(key)
+
+    def load_schema(self, project, dataset, table_name):
+        table = self._make_client(project).dataset(dataset).table(table_name)
+        table.reload()
+        return schema_from_bigquery_schema(table.schema)
+
+    def create_table(self, name, table, block=True, on_created=None):
+        bq_schema = table.get_bigquery_schema()
+        bq_table = self._table(name, bq_schema)
+        if bq_table.exists():
+            self._log.info('Table already exists, not creating: %s', name)
+            if on_created is not None:
+                on_created()
+            return None
+
+        bq_table.create()
+        self._log.debug('Creating table: %s', name)
+        self.waiter.wait(bq_table.exists, 'create')
+
+        data = '\n'.join([json.dumps(row, default=json_default) for row in table.data]).encode('utf-8')
+        self.counters.add('bytes_uploaded', len(data))
+        op = bq_table.upload_from_file(
+            BytesIO(data), 'NEWLINE_DELIMITED_JSON', size=len(data))
+
+        def upload_done():
+            if op.state != 'DONE':
+                op.reload()
+            return op.state == 'DONE'
+
+        def finish_upload():
+            self.waiter.wait(upload_done, 'upload')
+            if on_created is not None:
+                on_created()
+
+        self._log.debug('Uploading data to table: %s', name)
+        if block:
+            finish_upload()
+            return None
+        return self.waiter.submit(finish_upload)
+
+    def create_tables(self, tables, max_script_bytes=None):
+        # small tables are created by batched DDL scripts, one query job per
+        # script, and the rest by a load job each
+        scripts = []
+        script = []
+        script_length = 0
+        pending = []
+        for name, table, on_created in tables:
+            statement = None
+            if max_script_bytes:
+                try:
+                    statement = create_table_statement(
+                        '%s.%s.%s' % (self.project, self.dataset, name), table,
+                        max_script_bytes)
+                except ValueError:
+                    # not expressible as a literal, uploaded by a load job
+                    pass
+            if statement is None:
+                pending.append((name, self.waiter.submit(
+                    self.create_table, name, table, True, on_created)))
+                continue
+
+            if script and script_length + len(statement) + 2 > MAX_SCRIPT_LENGTH:
+                scripts.append(script)
+                script, script_length = [], 0
+            script.append((name, statement, on_created))
+            script_length += len(statement) + 2
+        if script:
+            scripts.append(script)
+
+        for script in scripts:
+            result = self.waiter.submit(self._run_script, script)
+            pending += [(name, result) for name, _, _ in script]
+        return pending
+
+    def _run_script(self, script):
+        self._log.debug('Creating %d tables in one script', len(script))
+        sql = ';\n'.join(s for _, s, _ in script)
+        self.counters.add('bytes_uploaded', len(sql.encode('utf-8')))
+        query = self.client.run_sync_query(sql)
+        query.use_legacy_sql = False
+        query.run()
+        QueryResultReader(self.client, query.project, query.name,
+                          waiter=self.waiter).first_page()
+        for _, _, on_created in script:
+            if on_created is not None:
+                on_created()
+
+    def delete_table(self, name, block=True):
+        table = self._table(name)
+        table.delete()
+        self._log.debug('Deleting table: %s', name)
+        if block:
+            self.waiter.wait(lambda: not table.exists(), 'delete')
+
+    def delete_tables(self, names):
+        # one DROP TABLE script per batch instead of a delete and an
+        # existence poll per table
+        scripts = [[]]
+        script_length = 0
+        for name in names:
+            statement = 'DROP TABLE IF EXISTS `%s.%s.%s`' % (self.project, self.dataset, name)
+            if scripts[-1] and script_length + len(statement) + 2 > MAX_SCRIPT_LENGTH:
+                scripts.append([])
+                script_length = 0
+            scripts[-1].append(statement)
+            script_length += len(statement) + 2
+
+        for script in scripts:
+            if not script:
+                continue
+            self._log.debug('Deleting %d tables in one script', len(script))
+            query = self.client.run_sync_query(';\n'.join(script))
+            query.use_legacy_sql = False
+            query.run()
+            QueryResultReader(self.client, query.project, query.name,
+                              waiter=self.waiter).first_page()
+
+    def list_tables(self):
+        return [t.name for t in self.client.dataset(self.dataset).list_tables()]
+
+    def list_table_creation_times(self):
+        # seconds since the epoch, or None when the listing doesn't say
+        times = {}
+        for table in self.client.dataset(self.dataset).list_tables():
+            created = table._properties.get('creationTime')
+            times[table.name] = float(created) / 1000.0 if created is not None else None
+        return times
+
+    def query(self, sql, use_legacy_sql=False, page_size=None, max_rows=None,
+              max_bytes=None):
+        query = self.client.run_sync_query(sql)
+        query.use_legacy_sql = use_legacy_sql
+        query.run()
+        reader = QueryResultReader(
+            self.client, query.project, query.name, page_size=page_size,
+            max_rows=max_rows, max_bytes=max_bytes, waiter=self.waiter,
+            counters=self.counters)
+        table = reader.read_table()
+        if self.fetch_bytes_billed:
+            self._count_bytes_billed(query.project, query.name)
+        return table
+
+    def dry_run(self, sql, use_legacy_sql=False):
+        # a query job that is validated and planned but never run
+        job = self.client._connection.api_request(
+            method='POST', path='/projects/%s/jobs' % self.project,
+            data={'configuration': {
+                'dryRun': True,
+                'query': {'query': sql, 'useLegacySql': use_legacy_sql},
+            }})
+        self.counters.add('dry_runs')
+        return dry_run_from_job_resource(job)
+
+    def _count_bytes_billed(self, project, job_id):
+        # only the job resource has billing statistics
+        job = self.client._connection.api_request(
+            method='GET', path='/projects/%s/jobs/%s' % (project, job_id))
+        statistics = job.get('statistics', {}).get('query', {})
+        self.counters.add('bytes_billed', int(statistics.get('totalBytesBilled', 0)))
+
+    def snapshot(self):
+        counters = self.counters.snapshot()
+        if self.client_pool is not None:
+            counters['api_calls'] = self.client_pool.request_count()
+        return counters
+
+    def _table(self, table_name, *args, **kwargs):
+        return self.client.dataset(self.dataset).table(
+            table_name, *args, **kwargs)
+
@@ -0,0 +1,166 @@
+from __future__ import absolute_import
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+
+class CleanupManager(object):
+
+    # deletes mock tables on a small pool of background threads, so test
+    # teardown doesn't wait for them. Tables are keyed by (project,
+    # dataset, name), and queued tables of one dataset are dropped together
+    # by one script where the backend can.
+
+    def __init__(self, max_workers=2, batch_size=100, batch_deletes=True):
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.batch_deletes = batch_deletes
+        self.deleted = 0
+        self._errors = []
+        self._queued = OrderedDict()
+        self._in_flight = set()
+        self._draining = 0
+        self._swept = set()
+        self._condition = threading.Condition()
+        self._pool = None
+        self._log = logging.getLogger('bigquerytest')
+
+    def delete(self, backend, key):
+        with self._condition:
+            self._queued[key] = backend
+            if self._draining < self.max_workers:
+                self._draining += 1
+                if self._pool is None:
+                    self._pool = ThreadPool(self.max_workers)
+                self._pool.apply_async(self._drain)
+
+    def reclaim(self, key):
+        # called before a table is created again. A deletion that hasn't
+        # started is cancelled, so the existing table can be used as is;
+        # one that has started is waited for.
+        with self._condition:
+            if self._queued.pop(key, None) is not None:
+                return True
+            while key in self._in_flight:
+                self._condition.wait()
+            return False
+
+    def pending(self):
+        with self._condition:
+            return len(self._queued) + len(self._in_flight)
+
+    def _next_batch(self):
+        dataset = None
+        backend = None
+        keys = []
+        for key, key_backend in self._queued.items():
+            if dataset is None:
+                dataset, backend = key[:2], key_backend
+            if key[:2] == dataset:
+                keys.append(key)
+                if len(keys) >= self.batch_size:
+                    break
+        return backend, keys
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                backend, keys = self._next_batch()
+                if not keys:
+                    self._draining -= 1
+                    self._condition.notify_all()
+                    return
+                for key in keys:
+                    del self._queued[key]
+                self._in_flight.update(keys)
+
+            try:
+                self._delete(backend, [name for _, _, name in keys])
+            except Exception as e:
+                self._log.warning('Failed to delete %d table(s): %s', len(keys), e)
+                with self._condition:
+                    self._errors += [(key, e) for key in keys]
+            else:
+                with self._condition:
+                    self.deleted += len(keys)
+            finally:
+                with self._condition:
+                    self._in_flight.difference_update(keys)
+                    self._condition.notify_all()
+
+    def _delete(self, backend, names):
+        delete_tables = getattr(backend, 'delete_tables', None)
+        if self.batch_deletes and delete_tables is not None and len(names) > 1:
+            delete_tables(names)
+            return
+        # fire and forget, nothing waits for the table to be gone
+        for name in names:
+            backend.delete_table(name, block=False)
+
+    def flush(self, timeout=None):
+        # waits for all queued deletions and returns the ones that failed
+        # since the last flush, as [((project, dataset, name), exception)]
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._queued or self._in_flight or self._draining:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        for key, e in errors:
+            self._log.warning('Table was not deleted: %s.%s.%s (%s)', key[0], key[1], key[2], e)
+        with self._condition:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return errors
+
+    def sweep(self, backend, project, dataset, prefix, min_age, clock=time.time,
+              keep=None):
+        # queues deletion of tables with the mock table prefix that are
+        # older than min_age seconds, left behind by runs that crashed.
+        # Tables for which keep(name) is true are still in use
+        if not min_age or min_age <= 0:
+            raise ValueError('min_age must be positive: %r' % min_age)
+        list_times = getattr(backend, 'list_table_creation_times', None)
+        if list_times is not None:
+            times = list_times()
+        else:
+            times = dict.fromkeys(backend.list_tables())
+
+        now = clock()
+        orphans = []
+        for name, created in sorted(times.items()):
+            if not name.startswith(prefix):
+                continue
+            if created is None or now - created < min_age:
+                continue
+            if keep is not None and keep(name):
+                continue
+            orphans.append(name)
+
+        for name in orphans:
+            self._log.info('Deleting orphaned table: %s', name)
+            self.delete(backend, (project, dataset, name))
+        return orphans
+
+    def sweep_once(self, backend, project, dataset, prefix, min_age, clock=time.time,
+                   keep=None):
+        with self._condition:
+            if (project, dataset, prefix) in self._swept:
+                return []
+            self._swept.add((project, dataset, prefix))
+        return self.sweep(backend, project, dataset, prefix, min_age, clock, keep)
+
+
+default_cleanup_manager = CleanupManager()
+atexit.register(default_cleanup_manager.close)
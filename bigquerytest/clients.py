@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+import atexit
+import threading
+import time
+
+import httplib2
+from google.cloud import bigquery
+from google.cloud.bigquery._http import Connection
+
+from .metrics import count
+from .wait import WaitStats
+
+
+class PooledHttp(object):
+
+    # httplib2.Http is not thread safe, so every thread gets its own
+    # authorized instance, which keeps its connections alive between requests
+
+    def __init__(self, make_http, stats, clock=time.time):
+        self.make_http = make_http
+        self.stats = stats
+        self.clock = clock
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self.make_http()
+            with self._lock:
+                self._instances.append(http)
+        return http
+
+    def __getattr__(self, name):
+        return getattr(self._http(), name)
+
+    def request(self, uri, method='GET', *args, **kwargs):
+        http = self._http()
+        count('api_calls')
+        start = self.clock()
+        try:
+            return http.request(uri, method, *args, **kwargs)
+        finally:
+            self.stats.record(method, self.clock() - start)
+
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+        for http in instances:
+            for connection in list(getattr(http, 'connections', {}).values()):
+                connection.close()
+            getattr(http, 'connections', {}).clear()
+        self._local = threading.local()
+
+
+class ClientPool(object):
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.stats = WaitStats()
+        self.clients_created = 0
+        self.clients_reused = 0
+        self._clients = {}
+        self._https = []
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def client(self, project, api_endpoint=None):
+        key = (project, api_endpoint)
+        with self._lock:
+            if key in self._clients:
+                self.clients_reused += 1
+                return self._clients[key]
+
+            start = self.clock()
+            client = self._create_client(project, api_endpoint)
+            self.stats.record('client', self.clock() - start)
+            self.clients_created += 1
+            self._clients[key] = client
+            return client
+
+    def _create_client(self, project, api_endpoint):
+        if api_endpoint is not None:
+            http = self._pooled_http(httplib2.Http)
+            client = bigquery.Client(project=project, http=http)
+            client._connection = endpoint_connection(api_endpoint, http)
+            return client
+
+        # credentials are only discovered for the first client
+        client = bigquery.Client(project=project, credentials=self._credentials)
+        connection = client._connection
+        if not isinstance(connection, Connection):
+            return client
+
+        credentials = self._credentials = connection.credentials
+        if credentials is None:
+            make_http = httplib2.Http
+        else:
+            make_http = lambda: credentials.authorize(httplib2.Http())
+        connection._http = self._pooled_http(make_http)
+        return client
+
+    def _pooled_http(self, make_http):
+        http = PooledHttp(make_http, self.stats, self.clock)
+        self._https.append(http)
+        return http
+
+    def request_count(self):
+        # every http request is recorded under its method, client
+        # creation under 'client'
+        histograms = dict(self.stats.histograms)
+        return sum(h.count for operation, h in histograms.items() if operation != 'client')
+
+    def close(self):
+        with self._lock:
+            https, self._https = self._https, []
+            self._clients.clear()
+        for http in https:
+            http.close()
+
+    def report(self):
+        return 'clients: %d created, %d reused\n%s' % (
+            self.clients_created, self.clients_reused, self.stats.report())
+
+
+def endpoint_connection(api_endpoint, http):
+    # the library builds urls from the API_BASE_URL class attribute
+    class EndpointConnection(Connection):
+        API_BASE_URL = api_endpoint.rstrip('/')
+
+    return EndpointConnection(http=http)
+
+
+default_client_pool = ClientPool()
+atexit.register(default_client_pool.close)
@@ -0,0 +1,220 @@
+from __future__ import absolute_import
+from array import array
+
+try:
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
+try:
+    INTEGER_TYPECODE = array('q').typecode
+except ValueError:
+    INTEGER_TYPECODE = 'l'
+
+
+def leaf_paths(fields, path=()):
+    paths = []
+    for field in fields:
+        if field.type == 'record':
+            if not field.subfields:
+                return None
+            subpaths = leaf_paths(field.subfields, path + (field,))
+            if subpaths is None:
+                return None
+            paths += subpaths
+        else:
+            paths.append(path + (field,))
+    return paths
+
+
+def is_canonical(record, fields):
+    # only records without nulls, empty arrays or unknown keys can be
+    # encoded, so that decoding them gives back equal records
+    if not isinstance(record, dict):
+        return False
+    fields_by_name = {f.name: f for f in fields}
+    for name, value in record.items():
+        field = fields_by_name.get(name)
+        if field is None or value is None:
+            return False
+        if field.repeated:
+            if not isinstance(value, list) or not value:
+                return False
+            items = value
+        else:
+            items = [value]
+        for item in items:
+            if field.type == 'record':
+                if not is_canonical(item, field.subfields):
+                    return False
+            elif item is None or isinstance(item, (dict, list)):
+                return False
+    return True
+
+
+def compact_values(values, type):
+    # typed arrays where every value fits, a list otherwise
+    if type == 'integer' and all(isinstance(v, integer_types) and not isinstance(v, bool)
+                                 and -2 ** 63 <= v < 2 ** 63 for v in values):
+        return array(INTEGER_TYPECODE, values), False
+    if type == 'float' and all(isinstance(v, float) for v in values):
+        return array('d', values), False
+    if type == 'boolean' and all(isinstance(v, bool) for v in values):
+        return array('b', values), True
+    return values, False
+
+
+class Column(object):
+
+    # a leaf column with Dremel style repetition and definition levels:
+    # the repetition level says at which repeated field in the path a
+    # value starts a new element, the definition level how many fields
+    # of the path are present, and values only exist for fully defined
+    # entries
+
+    __slots__ = ['path', 'long_name', 'repeated_positions', 'repetition',
+                 'definition', 'values', 'booleans']
+
+    def __init__(self, path):
+        self.path = path
+        self.long_name = path[-1].long_name
+        self.repeated_positions = [i for i, f in enumerate(path) if f.repeated]
+        self.repetition = array('B')
+        self.definition = array('B')
+        self.values = []
+        self.booleans = False
+
+    def encode(self, record):
+        self._encode_fields(record, 0, 0, 0)
+
+    def _encode_fields(self, node, i, r, d):
+        field = self.path[i]
+        if field.name not in node:
+            self.repetition.append(r)
+            self.definition.append(d)
+            return
+
+        value = node[field.name]
+        if not field.repeated:
+            self._encode_value(value, i, r, d + 1)
+            return
+
+        level = self.repeated_positions.index(i) + 1
+        for j, item in enumerate(value):
+            self._encode_value(item, i, r if j == 0 else level, d + 1)
+
+    def _encode_value(self, value, i, r, d):
+        if i == len(self.path) - 1:
+            self.repetition.append(r)
+            self.definition.append(d)
+            self.values.append(value)
+        else:
+            self._encode_fields(value, i + 1, r, d)
+
+    def compact(self):
+        self.values, self.booleans = compact_values(self.values, self.path[-1].type)
+
+    def decode(self, record, start, end, value_index):
+        last = len(self.path) - 1
+        indexes = [0] * len(self.path)
+        for e in range(start, end):
+            r = self.repetition[e]
+            d = self.definition[e]
+            p = self.repeated_positions[r - 1] if r else 0
+            node = record
+            for i in range(d):
+                field = self.path[i]
+                if field.repeated:
+                    if r and i == p:
+                        indexes[i] += 1
+                    elif i >= p:
+                        indexes[i] = 0
+                    items = node.setdefault(field.name, [])
+                    if i == last:
+                        items.append(self._value(value_index))
+                        value_index += 1
+                    elif indexes[i] < len(items):
+                        node = items[indexes[i]]
+                    else:
+                        node = {}
+                        items.append(node)
+                elif i == last:
+                    node[field.name] = self._value(value_index)
+                    value_index += 1
+                else:
+                    node = node.setdefault(field.name, {})
+        return value_index
+
+    def _value(self, i):
+        value = self.values[i]
+        return bool(value) if self.booleans else value
+
+    def __eq__(self, other):
+        return (self.long_name == other.long_name and
+                self.repetition == other.repetition and
+                self.definition == other.definition and
+                self.values == other.values)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class ColumnarRecords(object):
+
+    # a re-iterable source of records for BigQueryTestTable, which
+    # stores each leaf column separately and builds records on iteration
+
+    def __init__(self, columns, num_records):
+        self.columns = columns
+        self.num_records = num_records
+
+    @classmethod
+    def from_records(cls, records, schema):
+        paths = leaf_paths(schema)
+        if not paths:
+            return None
+        columns = [Column(path) for path in paths]
+        num_records = 0
+        for record in records:
+            if not is_canonical(record, schema):
+                return None
+            for column in columns:
+                column.encode(record)
+            num_records += 1
+        for column in columns:
+            column.compact()
+        return cls(columns, num_records)
+
+    def column(self, long_name):
+        for column in self.columns:
+            if column.long_name == long_name:
+                return column
+        raise KeyError(long_name)
+
+    def __len__(self):
+        return self.num_records
+
+    def __iter__(self):
+        positions = [(0, 0)] * len(self.columns)
+        for _ in range(self.num_records):
+            record = {}
+            for c, column in enumerate(self.columns):
+                start, value_index = positions[c]
+                end = start + 1
+                repetition = column.repetition
+                while end < len(repetition) and repetition[end]:
+                    end += 1
+                value_index = column.decode(record, start, end, value_index)
+                positions[c] = (end, value_index)
+            yield record
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnarRecords):
+            return NotImplemented
+        return (self.num_records == other.num_records and
+                len(self.columns) == len(other.columns) and
+                all(c1 == c2 for c1, c2 in zip(self.columns, other.columns)))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
@@ -0,0 +1,234 @@
+from __future__ import absolute_import
+import heapq
+from collections import Counter, deque
+try:
+    from itertools import izip_longest as zip_longest
+except ImportError:
+    from itertools import zip_longest
+
+from .table import Null, flatten_table, get_column_widths, table_prettyprint
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+MISSING = object()
+
+
+def render_cell(s):
+    return '%s' % s if s is not None else ''
+
+
+def rows_equal(row1, row2):
+    if row1 is MISSING or row2 is MISSING:
+        return False
+    return row1 == row2 or ([render_cell(s) for s in row1] ==
+                            [render_cell(s) for s in row2])
+
+
+class FlatTableDiff(object):
+
+    def __init__(self, header, window, num_mismatches, truncated):
+        self.header = header
+        self.window = window
+        self.num_mismatches = num_mismatches
+        self.truncated = truncated
+
+    def first_mismatch(self):
+        for entry in self.window:
+            if entry is not None and not rows_equal(entry[1], entry[2]):
+                return entry[0]
+
+    def render(self, min_space=2):
+        empty = [None] * len(self.header)
+        rows1 = [self.header]
+        rows2 = [self.header]
+        gaps = set()
+        missing1 = set()
+        missing2 = set()
+        for entry in self.window:
+            if entry is None:
+                gaps.add(len(rows1))
+                rows1.append(empty)
+                rows2.append(empty)
+                continue
+            _, row1, row2 = entry
+            if row1 is MISSING:
+                missing1.add(len(rows1))
+            if row2 is MISSING:
+                missing2.add(len(rows2))
+            rows1.append(empty if row1 is MISSING else row1)
+            rows2.append(empty if row2 is MISSING else row2)
+
+        column_widths = get_column_widths(rows1 + rows2)
+        pretty = []
+        for rows, missing in (rows1, missing1), (rows2, missing2):
+            lines = table_prettyprint(rows, column_widths, min_space).split('\n')
+            pretty.append('\n'.join([
+                '...' if i in gaps else line
+                for i, line in enumerate(lines) if i not in missing]))
+        return pretty[0], pretty[1]
+
+
+def diff_flat_tables(flat1, flat2, max_mismatches=10, context=3):
+    rows = zip_longest(flat1, flat2, fillvalue=MISSING)
+    header, _ = next(rows)
+
+    window = []
+    before = deque(maxlen=context)
+    num_mismatches = 0
+    after = 0
+    last_in_window = 0
+    stopped = False
+
+    for i, (row1, row2) in enumerate(rows, 1):
+        if not rows_equal(row1, row2):
+            if num_mismatches == max_mismatches:
+                stopped = True
+                break
+            num_mismatches += 1
+            first = before[0][0] if before else i
+            if first > last_in_window + 1:
+                window.append(None)
+            window.extend(before)
+            before.clear()
+            window.append((i, row1, row2))
+            last_in_window = i
+            after = context
+        elif after:
+            window.append((i, row1, row2))
+            last_in_window = i
+            after -= 1
+        elif num_mismatches == max_mismatches:
+            stopped = True
+            break
+        else:
+            before.append((i, row1, row2))
+
+    if not num_mismatches:
+        return None
+
+    if stopped or before:
+        window.append(None)
+
+    return FlatTableDiff(header, window, num_mismatches, stopped)
+
+
+def canonicalize(value):
+    # null and empty repeated fields are the same as missing ones, which is
+    # how records parsed from the API leave them
+    if isinstance(value, dict):
+        items = ((k, canonicalize(v)) for k, v in value.items())
+        return tuple(sorted((k, v) for k, v in items if v is not None and v != ()))
+    if isinstance(value, list):
+        return tuple(canonicalize(v) for v in value)
+    if isinstance(value, Null):
+        return None
+    return value
+
+
+def get_column_value(record, column):
+    value = record
+    for name in column.split('.'):
+        if not isinstance(value, dict):
+            raise ValueError('Key column is inside a repeated field: %s' % column)
+        value = value.get(name)
+    return canonicalize(value)
+
+
+class RecordsDiff(object):
+
+    def __init__(self, only1, only2, num_mismatches):
+        self.only1 = only1
+        self.only2 = only2
+        self.num_mismatches = num_mismatches
+
+    def render(self, schema, max_records=None, min_space=2):
+        records1 = self.only1[:max_records]
+        records2 = self.only2[:max_records]
+        flat1 = flatten_table(records1, schema)
+        flat2 = flatten_table(records2, schema)
+        column_widths = get_column_widths(flat1 + flat2[1:])
+        return (table_prettyprint(flat1, column_widths, min_space),
+                table_prettyprint(flat2, column_widths, min_space))
+
+
+def first_mismatches(items, max_items):
+    # only the mismatches that are shown are put in a stable order
+    if max_items is None:
+        return sorted(items, key=lambda item: repr(item[0]))
+    return heapq.nsmallest(max_items, items, key=lambda item: repr(item[0]))
+
+
+def diff_unordered_records(records1, records2, max_records=None):
+    counts = Counter()
+    representatives = {}
+    for record in records1:
+        c = canonicalize(record)
+        counts[c] += 1
+        representatives.setdefault(c, record)
+    for record in records2:
+        c = canonicalize(record)
+        counts[c] -= 1
+        representatives.setdefault(c, record)
+
+    mismatches1 = [(c, count) for c, count in counts.items() if count > 0]
+    mismatches2 = [(c, -count) for c, count in counts.items() if count < 0]
+    if not mismatches1 and not mismatches2:
+        return None
+
+    num_mismatches = max(sum(count for _, count in mismatches1),
+                         sum(count for _, count in mismatches2))
+    only1 = []
+    only2 = []
+    for c, count in first_mismatches(mismatches1, max_records):
+        only1 += [representatives[c]] * count
+    for c, count in first_mismatches(mismatches2, max_records):
+        only2 += [representatives[c]] * count
+    return RecordsDiff(only1[:max_records], only2[:max_records], num_mismatches)
+
+
+def diff_keyed_records(records1, records2, key_columns, max_records=None):
+    def index(records):
+        indexed = {}
+        for record in records:
+            key = tuple(get_column_value(record, c) for c in key_columns)
+            if key in indexed:
+                raise ValueError('Duplicate key %r for columns %s' % (
+                    key, ', '.join(key_columns)))
+            indexed[key] = record
+        return indexed
+
+    indexed1 = index(records1)
+    indexed2 = index(records2)
+
+    mismatched = [(key, None) for key, record1 in indexed1.items()
+                  if key not in indexed2
+                  or canonicalize(record1) != canonicalize(indexed2[key])]
+    mismatched += [(key, None) for key in indexed2 if key not in indexed1]
+    if not mismatched:
+        return None
+
+    num_mismatches = max(len([key for key, _ in mismatched if key in indexed1]),
+                         len([key for key, _ in mismatched if key in indexed2]))
+    only1 = []
+    only2 = []
+    for key, _ in first_mismatches(mismatched, max_records):
+        if key in indexed1:
+            only1.append(indexed1[key])
+        if key in indexed2:
+            only2.append(indexed2[key])
+    return RecordsDiff(only1, only2, num_mismatches)
+
+
+def tables_equal(table1, table2, ordered=True, key=None):
+    if table1.get_column_names() != table2.get_column_names():
+        return False
+    if key is not None:
+        key_columns = [key] if isinstance(key, string_types) else list(key)
+        return diff_keyed_records(table1.iter_records(), table2.iter_records(), key_columns) is None
+    if not ordered:
+        return diff_unordered_records(table1.iter_records(), table2.iter_records()) is None
+    return diff_flat_tables(table1.iter_flat(), table2.iter_flat(), max_mismatches=1, context=0) is None
@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+import textwrap
+import threading
+from collections import OrderedDict
+
+from .table import BigQueryTestTable, table_from_definition_string
+
+
+class FrozenDict(dict):
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Parsed mock table records are read-only')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Parsed mock table records are read-only')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+class CachedTable(BigQueryTestTable):
+
+    # tables parsed from the same definition share the hash of their
+    # records, as long as neither data nor schema have been replaced. The
+    # records are frozen, so the hash can't go stale
+
+    def __init__(self, entry):
+        super(CachedTable, self).__init__(entry[0], entry[1])
+        self._entry = entry
+
+    def get_hash(self):
+        entry = self._entry
+        if not (self.is_materialized() and self.data is entry[0] and self.schema is entry[1]):
+            return super(CachedTable, self).get_hash()
+        if entry[2] is None:
+            entry[2] = super(CachedTable, self).get_hash()
+        return entry[2]
+
+
+def normalize_definition(table_definition):
+    # indentation and trailing spaces don't change the parsed table, but
+    # tabs are an error that dedenting could hide
+    if '\t' in table_definition:
+        return table_definition
+    lines = textwrap.dedent(table_definition).strip('\n').splitlines()
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+def schema_fingerprint(schema):
+    return tuple(
+        f._replace(subfields=schema_fingerprint(f.subfields) if f.subfields else None)
+        for f in schema)
+
+
+class DefinitionCache(object):
+
+    # parsed tables share frozen records, so every caller gets its own
+    # table and can replace, but not modify, the data
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def table(self, table_definition, schema):
+        definition = normalize_definition(table_definition)
+        key = (definition, schema_fingerprint(schema))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return CachedTable(entry)
+
+        table = table_from_definition_string(definition, schema)
+        entry = [freeze(table.data), table.schema, None]
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += len(definition)
+                self._evict()
+        return CachedTable(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self._bytes > self.max_bytes):
+            (definition, _), _ = self._entries.popitem(last=False)
+            self._bytes -= len(definition)
+
+
+default_definition_cache = DefinitionCache()
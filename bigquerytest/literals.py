@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+import math
+
+from .table import Null
+
+
+SQL_TYPES = {
+    'integer': 'INT64',
+    'float': 'FLOAT64',
+    'string': 'STRING',
+    'boolean': 'BOOL',
+}
+
+STRING_ESCAPES = {
+    '\\': '\\\\',
+    "'": "\\'",
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+}
+
+
+def sql_type(field, repeated=None):
+    if field.type == 'record':
+        t = 'STRUCT<%s>' % ', '.join(
+            '%s %s' % (quote_name(f.name), sql_type(f)) for f in field.subfields)
+    elif field.type in SQL_TYPES:
+        t = SQL_TYPES[field.type]
+    else:
+        raise ValueError('Unsupported data type: %s' % field.type)
+    if field.repeated if repeated is None else repeated:
+        return 'ARRAY<%s>' % t
+    return t
+
+
+def row_type(schema):
+    return 'STRUCT<%s>' % ', '.join(
+        '%s %s' % (quote_name(f.name), sql_type(f)) for f in schema)
+
+
+def quote_name(name):
+    return '`%s`' % name
+
+
+def sql_string(s):
+    return "'%s'" % ''.join(STRING_ESCAPES.get(c, c) for c in s)
+
+
+def sql_literal(value, field, repeated=None):
+    if field.repeated if repeated is None else repeated:
+        if any(v is None or isinstance(v, Null) for v in value or []):
+            # arrays can't hold NULL elements
+            raise ValueError('NULL in repeated field: %s' % field.name)
+        return '[%s]' % ', '.join(sql_literal(v, field, False) for v in value or [])
+    if value is None or isinstance(value, Null):
+        return 'NULL'
+    if field.type == 'record':
+        return struct_literal(value, field.subfields)
+    if field.type == 'string':
+        return sql_string(value)
+    if field.type == 'boolean':
+        return 'TRUE' if value else 'FALSE'
+    if field.type == 'integer':
+        return '%d' % value
+    if field.type == 'float':
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return "CAST('%s' AS FLOAT64)" % value
+        return repr(value)
+    raise ValueError('Unsupported data type: %s' % field.type)
+
+
+def struct_literal(record, schema):
+    return 'STRUCT(%s)' % ', '.join(
+        '%s AS %s' % (sql_literal(record.get(f.name), f), quote_name(f.name))
+        for f in schema)
+
+
+def table_literal(table, max_length=None):
+    # a FROM clause item that evaluates to the table's rows, or None once
+    # it gets longer than max_length
+    prefix = 'UNNEST(ARRAY<%s>[' % row_type(table.schema)
+    length = len(prefix) + len('])')
+    structs = []
+    for record in table.iter_records():
+        struct = struct_literal(record, table.schema)
+        length += len(struct) + (2 if structs else 0)
+        if max_length is not None and length > max_length:
+            return None
+        structs.append(struct)
+    return '%s%s])' % (prefix, ', '.join(structs))
+
+
+def create_table_statement(table_ref, table, max_length=None):
+    # None once the statement gets longer than max_length
+    columns = ', '.join(
+        '%s %s%s' % (quote_name(f.name), sql_type(f),
+                     '' if f.nullable or f.repeated else ' NOT NULL')
+        for f in table.schema)
+    head = 'CREATE TABLE IF NOT EXISTS `%s` (%s) AS SELECT * FROM ' % (table_ref, columns)
+    literal = table_literal(table, None if max_length is None else max_length - len(head))
+    return None if literal is None else head + literal
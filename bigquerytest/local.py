@@ -0,0 +1,1827 @@
+from __future__ import absolute_import
+import json
+import math
+import re
+from collections import namedtuple
+
+from .compare import canonicalize
+from .metrics import Counters
+from .results import DryRunResult, ResultTooLargeError
+from .table import (
+    BigQueryTestSchemaField,
+    BigQueryTestTable,
+    Null,
+    json_default,
+    schema_from_api_resource,
+    schema_from_bigquery_schema,
+)
+
+
+class LocalSqlError(ValueError):
+    pass
+
+
+# tokenizer
+
+Token = namedtuple('Token', 'kind value position')
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+  | (?P<string>[rR]?(?:'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"))
+  | (?P<quoted>`[^`]*`)
+  | (?P<name>[a-zA-Z_][a-zA-Z0-9_]*)
+  | (?P<op><>|!=|<=|>=|\|\||[-+*/%=<>(),.;\[\]])
+''', re.VERBOSE | re.DOTALL)
+
+STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', "'": "'", '"': '"'}
+
+
+def tokenize(sql):
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = TOKEN_REGEX.match(sql, position)
+        if not match:
+            raise LocalSqlError('Syntax error at position %d: %s' % (
+                position, sql[position:position + 20]))
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'string':
+            if text[0] in 'rR':
+                text = text[2:-1]
+            else:
+                text = re.sub(r'\\(.)', lambda m: STRING_ESCAPES.get(m.group(1), m.group(1)),
+                              text[1:-1])
+            tokens.append(Token('string', text, position))
+        elif kind == 'quoted':
+            tokens.append(Token('name', text[1:-1], position))
+        elif kind == 'name':
+            tokens.append(Token('keyword' if text.upper() in KEYWORDS else 'name',
+                                text, position))
+        elif kind == 'number':
+            value = float(text) if any(c in text for c in '.eE') else int(text)
+            tokens.append(Token('number', value, position))
+        elif kind == 'op':
+            tokens.append(Token('op', text, position))
+        position = match.end()
+    tokens.append(Token('end', None, len(sql)))
+    return tokens
+
+
+KEYWORDS = set('''
+    ALL AND AS ASC BETWEEN BY CASE CAST CROSS DESC DISTINCT ELSE END EXCEPT
+    FALSE FROM FULL GROUP HAVING IN INNER IS JOIN LEFT LIKE LIMIT NOT NULL
+    OFFSET ON OR ORDER OUTER RIGHT SELECT STRUCT THEN TRUE UNION UNNEST USING
+    WHEN WHERE WITH ARRAY
+'''.split())
+
+
+# syntax tree
+
+CreateTable = namedtuple('CreateTable', 'path columns query if_not_exists replace')
+DropTable = namedtuple('DropTable', 'path if_exists')
+Query = namedtuple('Query', 'ctes body order_by limit offset')
+Select = namedtuple('Select', 'distinct items from_ where group_by having')
+Union = namedtuple('Union', 'left right')
+SelectItem = namedtuple('SelectItem', 'expr alias')
+Star = namedtuple('Star', 'qualifier excepted')
+TableRef = namedtuple('TableRef', 'path alias')
+UnnestRef = namedtuple('UnnestRef', 'expr alias offset_alias')
+SubqueryRef = namedtuple('SubqueryRef', 'query alias')
+Join = namedtuple('Join', 'kind right condition using')
+OrderItem = namedtuple('OrderItem', 'expr descending')
+
+Literal = namedtuple('Literal', 'value')
+Column = namedtuple('Column', 'path')
+Function = namedtuple('Function', 'name args distinct')
+CountStar = namedtuple('CountStar', '')
+Binary = namedtuple('Binary', 'op left right')
+Unary = namedtuple('Unary', 'op operand')
+IsNull = namedtuple('IsNull', 'operand negated')
+InList = namedtuple('InList', 'operand items negated')
+InArray = namedtuple('InArray', 'operand array negated')
+Between = namedtuple('Between', 'operand low high negated')
+Like = namedtuple('Like', 'operand pattern negated')
+Case = namedtuple('Case', 'operand whens default')
+Cast = namedtuple('Cast', 'operand type safe')
+ArrayLiteral = namedtuple('ArrayLiteral', 'items type')
+StructLiteral = namedtuple('StructLiteral', 'items types')
+Subscript = namedtuple('Subscript', 'operand mode index')
+
+
+class Parser(object):
+
+    def __init__(self, sql):
+        self.tokens = tokenize(sql)
+        self.position = 0
+
+    @property
+    def token(self):
+        return self.tokens[self.position]
+
+    def error(self, message=None):
+        token = self.token
+        raise LocalSqlError('%s at position %d' % (
+            message or 'Unexpected %s' % (token.value if token.kind != 'end' else 'end of query'),
+            token.position))
+
+    def peek_keyword(self, *keywords):
+        token = self.token
+        return token.kind == 'keyword' and token.value.upper() in keywords
+
+    def accept_keyword(self, *keywords):
+        if self.peek_keyword(*keywords):
+            self.position += 1
+            return True
+        return False
+
+    def expect_keyword(self, keyword):
+        if not self.accept_keyword(keyword):
+            self.error('Expected %s' % keyword)
+
+    def peek_op(self, *ops):
+        return self.token.kind == 'op' and self.token.value in ops
+
+    def accept_op(self, *ops):
+        if self.peek_op(*ops):
+            value = self.token.value
+            self.position += 1
+            return value
+        return None
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            self.error('Expected %s' % op)
+
+    def expect_name(self):
+        token = self.token
+        if token.kind != 'name':
+            self.error('Expected a name')
+        self.position += 1
+        return token.value
+
+    def accept_word(self, *words):
+        # for words that are not reserved keywords
+        token = self.token
+        if token.kind == 'name' and token.value.upper() in words:
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        query = self.parse_query()
+        if self.token.kind != 'end':
+            self.error()
+        return query
+
+    def parse_script(self):
+        statements = []
+        while self.token.kind != 'end':
+            statements.append(self.parse_statement())
+            if not self.accept_op(';') and self.token.kind != 'end':
+                self.error()
+        return statements
+
+    def parse_statement(self):
+        if self.accept_word('DROP'):
+            return self.parse_drop_table()
+        if not self.accept_word('CREATE'):
+            return self.parse_query()
+
+        replace = False
+        if self.accept_keyword('OR'):
+            if not self.accept_word('REPLACE'):
+                self.error('Expected REPLACE')
+            replace = True
+        if not self.accept_word('TABLE'):
+            self.error('Only CREATE TABLE is supported')
+        if_not_exists = False
+        if self.accept_word('IF'):
+            self.expect_keyword('NOT')
+            if not self.accept_word('EXISTS'):
+                self.error('Expected EXISTS')
+            if_not_exists = True
+
+        path = self.expect_name().split('.')
+        while self.accept_op('.'):
+            path.extend(self.expect_name().split('.'))
+
+        columns = None
+        if self.accept_op('('):
+            columns = []
+            while True:
+                name = self.expect_name()
+                column_type = self.parse_type()
+                not_null = False
+                if self.accept_keyword('NOT'):
+                    self.expect_keyword('NULL')
+                    not_null = True
+                columns.append((name, column_type, not_null))
+                if not self.accept_op(','):
+                    break
+            self.expect_op(')')
+
+        self.expect_keyword('AS')
+        return CreateTable(path, columns, self.parse_query(), if_not_exists, replace)
+
+    def parse_drop_table(self):
+        if not self.accept_word('TABLE'):
+            self.error('Only DROP TABLE is supported')
+        if_exists = False
+        if self.accept_word('IF'):
+            if not self.accept_word('EXISTS'):
+                self.error('Expected EXISTS')
+            if_exists = True
+
+        path = self.expect_name().split('.')
+        while self.accept_op('.'):
+            path.extend(self.expect_name().split('.'))
+        return DropTable(path, if_exists)
+
+    def parse_query(self):
+        ctes = []
+        if self.accept_keyword('WITH'):
+            while True:
+                name = self.expect_name()
+                self.expect_keyword('AS')
+                self.expect_op('(')
+                ctes.append((name, self.parse_query()))
+                self.expect_op(')')
+                if not self.accept_op(','):
+                    break
+
+        body = self.parse_query_term()
+        while self.accept_keyword('UNION'):
+            if not self.accept_keyword('ALL'):
+                self.error('Only UNION ALL is supported')
+            body = Union(body, self.parse_query_term())
+
+        order_by = []
+        if self.accept_keyword('ORDER'):
+            self.expect_keyword('BY')
+            order_by = self.parse_order_items()
+
+        limit = offset = None
+        if self.accept_keyword('LIMIT'):
+            limit = self.parse_expr()
+            if self.accept_keyword('OFFSET'):
+                offset = self.parse_expr()
+
+        return Query(ctes, body, order_by, limit, offset)
+
+    def parse_query_term(self):
+        if self.accept_op('('):
+            query = self.parse_query()
+            self.expect_op(')')
+            return query
+        return self.parse_select()
+
+    def parse_order_items(self):
+        items = []
+        while True:
+            expr = self.parse_expr()
+            descending = False
+            if self.accept_keyword('DESC'):
+                descending = True
+            else:
+                self.accept_keyword('ASC')
+            items.append(OrderItem(expr, descending))
+            if not self.accept_op(','):
+                return items
+
+    def parse_select(self):
+        self.expect_keyword('SELECT')
+        distinct = self.accept_keyword('DISTINCT')
+        self.accept_keyword('ALL')
+
+        items = [self.parse_select_item()]
+        while self.accept_op(','):
+            items.append(self.parse_select_item())
+
+        from_ = None
+        if self.accept_keyword('FROM'):
+            from_ = self.parse_from()
+
+        where = None
+        if self.accept_keyword('WHERE'):
+            where = self.parse_expr()
+
+        group_by = []
+        if self.accept_keyword('GROUP'):
+            self.expect_keyword('BY')
+            group_by = [self.parse_expr()]
+            while self.accept_op(','):
+                group_by.append(self.parse_expr())
+
+        having = None
+        if self.accept_keyword('HAVING'):
+            having = self.parse_expr()
+
+        return Select(distinct, items, from_, where, group_by, having)
+
+    def parse_select_item(self):
+        if self.accept_op('*'):
+            return Star(None, self.parse_except())
+
+        # qualified star, e.g. t.*
+        start = self.position
+        if self.token.kind == 'name':
+            path = [self.expect_name()]
+            while self.accept_op('.'):
+                if self.accept_op('*'):
+                    return Star(path, self.parse_except())
+                if self.token.kind != 'name':
+                    break
+                path.append(self.expect_name())
+            self.position = start
+
+        expr = self.parse_expr()
+        return SelectItem(expr, self.parse_alias())
+
+    def parse_except(self):
+        excepted = []
+        if self.accept_keyword('EXCEPT'):
+            self.expect_op('(')
+            excepted.append(self.expect_name())
+            while self.accept_op(','):
+                excepted.append(self.expect_name())
+            self.expect_op(')')
+        return excepted
+
+    def parse_alias(self):
+        if self.accept_keyword('AS'):
+            return self.expect_name()
+        if self.token.kind == 'name':
+            return self.expect_name()
+        return None
+
+    def parse_from(self):
+        from_ = [Join('CROSS', self.parse_from_item(), None, None)]
+        while True:
+            if self.accept_op(','):
+                kind = 'CROSS'
+            elif self.accept_keyword('CROSS'):
+                self.expect_keyword('JOIN')
+                kind = 'CROSS'
+            elif self.accept_keyword('INNER'):
+                self.expect_keyword('JOIN')
+                kind = 'INNER'
+            elif self.accept_keyword('JOIN'):
+                kind = 'INNER'
+            elif self.accept_keyword('LEFT'):
+                self.accept_keyword('OUTER')
+                self.expect_keyword('JOIN')
+                kind = 'LEFT'
+            elif self.peek_keyword('RIGHT', 'FULL'):
+                self.error('Only INNER, LEFT and CROSS joins are supported')
+            else:
+                return from_
+
+            right = self.parse_from_item()
+            condition = using = None
+            if kind != 'CROSS':
+                if self.accept_keyword('ON'):
+                    condition = self.parse_expr()
+                elif self.accept_keyword('USING'):
+                    self.expect_op('(')
+                    using = [self.expect_name()]
+                    while self.accept_op(','):
+                        using.append(self.expect_name())
+                    self.expect_op(')')
+                elif not isinstance(right, UnnestRef):
+                    self.error('Expected ON or USING')
+            from_.append(Join(kind, right, condition, using))
+
+    def parse_from_item(self):
+        if self.accept_keyword('UNNEST'):
+            self.expect_op('(')
+            expr = self.parse_expr()
+            self.expect_op(')')
+            alias = self.parse_alias()
+            offset_alias = None
+            if self.accept_keyword('WITH'):
+                self.expect_keyword('OFFSET')
+                offset_alias = self.parse_alias() or 'offset'
+            return UnnestRef(expr, alias, offset_alias)
+
+        if self.accept_op('('):
+            query = self.parse_query()
+            self.expect_op(')')
+            return SubqueryRef(query, self.parse_alias())
+
+        path = []
+        for part in self.expect_name().split('.'):
+            path.append(part)
+        while self.accept_op('.'):
+            path.extend(self.expect_name().split('.'))
+        return TableRef(path, self.parse_alias())
+
+    # expressions, from the loosest to the tightest binding
+
+    def parse_expr(self):
+        left = self.parse_and()
+        while self.accept_keyword('OR'):
+            left = Binary('OR', left, self.parse_and())
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.accept_keyword('AND'):
+            left = Binary('AND', left, self.parse_not())
+        return left
+
+    def parse_not(self):
+        if self.accept_keyword('NOT'):
+            return Unary('NOT', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_additive()
+        while True:
+            op = self.accept_op('=', '!=', '<>', '<', '<=', '>', '>=')
+            if op:
+                left = Binary('!=' if op == '<>' else op, left, self.parse_additive())
+                continue
+
+            if self.accept_keyword('IS'):
+                negated = self.accept_keyword('NOT')
+                self.expect_keyword('NULL')
+                left = IsNull(left, negated)
+                continue
+
+            start = self.position
+            negated = self.accept_keyword('NOT')
+            if self.accept_keyword('IN'):
+                if self.accept_keyword('UNNEST'):
+                    self.expect_op('(')
+                    left = InArray(left, self.parse_expr(), negated)
+                    self.expect_op(')')
+                else:
+                    self.expect_op('(')
+                    items = [self.parse_expr()]
+                    while self.accept_op(','):
+                        items.append(self.parse_expr())
+                    self.expect_op(')')
+                    left = InList(left, items, negated)
+            elif self.accept_keyword('LIKE'):
+                left = Like(left, self.parse_additive(), negated)
+            elif self.accept_keyword('BETWEEN'):
+                low = self.parse_additive()
+                self.expect_keyword('AND')
+                left = Between(left, low, self.parse_additive(), negated)
+            else:
+                self.position = start
+                return left
+
+    def parse_additive(self):
+        left = self.parse_multiplicative()
+        while True:
+            op = self.accept_op('+', '-', '||')
+            if not op:
+                return left
+            left = Binary(op, left, self.parse_multiplicative())
+
+    def parse_multiplicative(self):
+        left = self.parse_unary()
+        while True:
+            op = self.accept_op('*', '/', '%')
+            if not op:
+                return left
+            left = Binary(op, left, self.parse_unary())
+
+    def parse_unary(self):
+        if self.accept_op('-'):
+            return Unary('-', self.parse_unary())
+        if self.accept_op('+'):
+            return self.parse_unary()
+        return self.parse_postfix()
+
+    def parse_postfix(self):
+        expr = self.parse_primary()
+        while True:
+            if self.accept_op('['):
+                mode = self.token.value.upper() if self.token.kind == 'name' else None
+                if mode in ('OFFSET', 'ORDINAL', 'SAFE_OFFSET', 'SAFE_ORDINAL'):
+                    self.position += 1
+                    self.expect_op('(')
+                    index = self.parse_expr()
+                    self.expect_op(')')
+                elif self.peek_keyword('OFFSET'):
+                    self.position += 1
+                    mode = 'OFFSET'
+                    self.expect_op('(')
+                    index = self.parse_expr()
+                    self.expect_op(')')
+                else:
+                    mode = 'OFFSET'
+                    index = self.parse_expr()
+                self.expect_op(']')
+                expr = Subscript(expr, mode, index)
+            elif self.peek_op('.') and self.tokens[self.position + 1].kind == 'name':
+                self.position += 1
+                name = self.expect_name()
+                if isinstance(expr, Column):
+                    expr = Column(expr.path + [name])
+                else:
+                    expr = Function('$FIELD', [expr, Literal(name)], False)
+            else:
+                return expr
+
+    def parse_primary(self):
+        token = self.token
+
+        if token.kind == 'number' or token.kind == 'string':
+            self.position += 1
+            return Literal(token.value)
+
+        if self.accept_keyword('NULL'):
+            return Literal(None)
+        if self.accept_keyword('TRUE'):
+            return Literal(True)
+        if self.accept_keyword('FALSE'):
+            return Literal(False)
+
+        if self.accept_op('('):
+            if self.peek_keyword('SELECT', 'WITH'):
+                self.error('Scalar subqueries are not supported')
+            expr = self.parse_expr()
+            self.expect_op(')')
+            return expr
+
+        if self.accept_keyword('CASE'):
+            operand = None
+            if not self.peek_keyword('WHEN'):
+                operand = self.parse_expr()
+            whens = []
+            while self.accept_keyword('WHEN'):
+                condition = self.parse_expr()
+                self.expect_keyword('THEN')
+                whens.append((condition, self.parse_expr()))
+            default = None
+            if self.accept_keyword('ELSE'):
+                default = self.parse_expr()
+            self.expect_keyword('END')
+            return Case(operand, whens, default)
+
+        if self.accept_keyword('CAST'):
+            return self.parse_cast(False)
+
+        if self.peek_keyword('ARRAY') or self.peek_op('['):
+            element_type = None
+            if self.accept_keyword('ARRAY'):
+                if self.accept_op('<'):
+                    element_type = self.parse_type()
+                    self.expect_op('>')
+            self.expect_op('[')
+            items = []
+            if not self.peek_op(']'):
+                items.append(self.parse_expr())
+                while self.accept_op(','):
+                    items.append(self.parse_expr())
+            self.expect_op(']')
+            return ArrayLiteral(items, element_type)
+
+        if self.accept_keyword('STRUCT'):
+            types = None
+            if self.accept_op('<'):
+                types = self.parse_struct_fields()
+                self.expect_op('>')
+            self.expect_op('(')
+            items = []
+            if not self.peek_op(')'):
+                while True:
+                    expr = self.parse_expr()
+                    alias = self.expect_name() if self.accept_keyword('AS') else None
+                    items.append((expr, alias))
+                    if not self.accept_op(','):
+                        break
+            self.expect_op(')')
+            return StructLiteral(items, types)
+
+        if token.kind == 'name':
+            self.position += 1
+            if self.accept_op('('):
+                name = token.value.upper()
+                if name == 'SAFE_CAST':
+                    return self.parse_cast(True, opened=True)
+                if name == 'COUNT' and self.accept_op('*'):
+                    self.expect_op(')')
+                    return CountStar()
+                distinct = self.accept_keyword('DISTINCT')
+                args = []
+                if not self.peek_op(')'):
+                    args.append(self.parse_expr())
+                    while self.accept_op(','):
+                        args.append(self.parse_expr())
+                self.expect_op(')')
+                return Function(name, args, distinct)
+            return Column(token.value.split('.'))
+
+        self.error()
+
+    def parse_cast(self, safe, opened=False):
+        if not opened:
+            self.expect_op('(')
+        operand = self.parse_expr()
+        self.expect_keyword('AS')
+        type_ = self.parse_type()
+        self.expect_op(')')
+        return Cast(operand, type_, safe)
+
+    def parse_type(self):
+        if self.accept_keyword('ARRAY'):
+            self.expect_op('<')
+            element = self.parse_type()
+            self.expect_op('>')
+            return SqlType(element.kind, element.fields, True)
+        if self.accept_keyword('STRUCT'):
+            self.expect_op('<')
+            fields = self.parse_struct_fields()
+            self.expect_op('>')
+            return SqlType('record', fields, False)
+        name = self.expect_name().upper()
+        if name not in TYPE_NAMES:
+            self.error('Unsupported type %s' % name)
+        return SqlType(TYPE_NAMES[name], None, False)
+
+    def parse_struct_fields(self):
+        fields = []
+        while True:
+            name = self.expect_name()
+            fields.append((name, self.parse_type()))
+            if not self.accept_op(','):
+                return fields
+
+
+def parse(sql):
+    return Parser(sql).parse()
+
+
+def parse_script(sql):
+    return Parser(sql).parse_script()
+
+
+# types
+
+class SqlType(namedtuple('SqlType', 'kind fields repeated')):
+
+    def element(self):
+        return SqlType(self.kind, self.fields, False)
+
+    def array(self):
+        return SqlType(self.kind, self.fields, True)
+
+    def field(self, name):
+        if self.kind != 'record' or self.repeated:
+            return None, None
+        for field_name, field_type in self.fields:
+            if field_name.lower() == name.lower():
+                return field_name, field_type
+        return None, None
+
+
+TYPE_NAMES = {
+    'INT64': 'integer', 'INTEGER': 'integer', 'FLOAT64': 'float',
+    'FLOAT': 'float', 'NUMERIC': 'float', 'STRING': 'string',
+    'BOOL': 'boolean', 'BOOLEAN': 'boolean',
+}
+
+UNKNOWN = SqlType(None, None, False)
+INTEGER = SqlType('integer', None, False)
+FLOAT = SqlType('float', None, False)
+STRING = SqlType('string', None, False)
+BOOLEAN = SqlType('boolean', None, False)
+
+
+def type_from_schema(fields):
+    return SqlType('record', [(f.name, type_from_field(f)) for f in fields], False)
+
+
+def type_from_field(field):
+    if field.type == 'record':
+        return SqlType('record', type_from_schema(field.subfields).fields, field.repeated)
+    return SqlType(field.type, None, field.repeated)
+
+
+def schema_from_type(fields, prefix='', is_repeated_branch=False):
+    schema = []
+    for name, t in fields:
+        repeated_branch = is_repeated_branch or t.repeated
+        schema.append(BigQueryTestSchemaField(
+            name,
+            t.kind or 'string',
+            prefix + name,
+            schema_from_type(t.fields, prefix + name + '.', repeated_branch) if t.kind == 'record' else None,
+            not t.repeated,
+            t.repeated,
+            repeated_branch))
+    return schema
+
+
+def type_of_value(value):
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, int):
+        return INTEGER
+    if isinstance(value, float):
+        return FLOAT
+    if value is None:
+        return UNKNOWN
+    return STRING
+
+
+def common_type(types):
+    known = [t for t in types if t.kind is not None]
+    if not known:
+        return UNKNOWN
+    # integers are coerced to float when mixed with floats
+    if FLOAT in known and all(t in (INTEGER, FLOAT) for t in known):
+        return FLOAT
+    return known[0]
+
+
+def coerce_result(function, t):
+    if t != FLOAT:
+        return function
+    return lambda row: cast_value(function(row), FLOAT, False)
+
+
+# scopes and name resolution
+
+Binding = namedtuple('Binding', 'alias type table_like')
+
+
+class Scope(object):
+
+    def __init__(self, bindings=(), ctes=None):
+        self.bindings = list(bindings)
+        self.ctes = ctes or {}
+
+    def extend(self, bindings):
+        return Scope(self.bindings + list(bindings), self.ctes)
+
+    def find_alias(self, name):
+        for binding in self.bindings:
+            if binding.alias.lower() == name.lower():
+                return binding
+        return None
+
+    def resolve(self, path):
+        binding = self.find_alias(path[0])
+        if binding is not None:
+            alias = binding.alias
+            getter = lambda row: row.get(alias)
+            t = binding.type
+            rest = path[1:]
+        else:
+            for binding in self.bindings:
+                if not binding.table_like:
+                    continue
+                field_name, t = binding.type.field(path[0])
+                if field_name is not None:
+                    getter = make_field_getter(binding.alias, field_name)
+                    rest = path[1:]
+                    break
+            else:
+                raise LocalSqlError('Unrecognized name: %s' % '.'.join(path))
+
+        for name in rest:
+            if t.repeated:
+                raise LocalSqlError('Cannot access field %s on an array: %s' % (
+                    name, '.'.join(path)))
+            field_name, t = t.field(name)
+            if field_name is None:
+                raise LocalSqlError('Unrecognized name: %s' % '.'.join(path))
+            getter = make_path_getter(getter, field_name)
+
+        return getter, t
+
+
+def make_field_getter(alias, field_name):
+    def getter(row):
+        record = row.get(alias)
+        return record.get(field_name) if isinstance(record, dict) else None
+    return getter
+
+
+def make_path_getter(parent, field_name):
+    def getter(row):
+        value = parent(row)
+        return value.get(field_name) if isinstance(value, dict) else None
+    return getter
+
+
+# functions
+
+def sql_compare(op, a, b):
+    if a is None or b is None:
+        return None
+    if op == '=':
+        return a == b
+    if op == '!=':
+        return a != b
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+
+def sql_arithmetic(op, a, b):
+    if a is None or b is None:
+        return None
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    if op == '/':
+        if b == 0:
+            raise LocalSqlError('division by zero: %s / %s' % (a, b))
+        return float(a) / b
+    if op == '%':
+        return int(math.fmod(a, b))
+    return '%s%s' % (a, b)
+
+
+def sql_round(x, digits=0):
+    if x is None:
+        return None
+    # BigQuery rounds halfway cases away from zero
+    factor = 10 ** (digits or 0)
+    return math.copysign(math.floor(abs(x) * factor + 0.5) / factor, x)
+
+
+def cast_value(value, t, safe):
+    if value is None:
+        return None
+    try:
+        if t.kind == 'integer':
+            if isinstance(value, float):
+                return int(sql_round(value))
+            return int(value)
+        if t.kind == 'float':
+            return float(value)
+        if t.kind == 'string':
+            if isinstance(value, bool):
+                return 'true' if value else 'false'
+            return '%s' % value
+        if t.kind == 'boolean':
+            if isinstance(value, str):
+                if value.lower() not in ('true', 'false'):
+                    raise ValueError(value)
+                return value.lower() == 'true'
+            return bool(value)
+    except (TypeError, ValueError):
+        if safe:
+            return None
+        raise LocalSqlError('Bad %s value: %r' % (t.kind, value))
+    return value
+
+
+def coerce_value(value, t):
+    if value is None:
+        return None
+    if t.repeated:
+        return [coerce_value(v, t.element()) for v in value]
+    if t.kind == 'record':
+        if not isinstance(value, dict):
+            raise LocalSqlError('Expected a STRUCT, got %r' % value)
+        return dict((name, coerce_value(value.get(name), field_type))
+                    for name, field_type in t.fields)
+    if t.kind is None:
+        return value
+    return cast_value(value, t, False)
+
+
+def null_safe(f):
+    def wrapped(*args):
+        if any(a is None for a in args):
+            return None
+        return f(*args)
+    return wrapped
+
+
+def sql_coalesce(*args):
+    for a in args:
+        if a is not None:
+            return a
+    return None
+
+
+def sql_greatest(*args):
+    return None if any(a is None for a in args) else max(args)
+
+
+def sql_least(*args):
+    return None if any(a is None for a in args) else min(args)
+
+
+def sql_substr(s, position, length=None):
+    if s is None or position is None:
+        return None
+    start = position - 1 if position > 0 else max(len(s) + position, 0)
+    return s[start:] if length is None else s[start:start + length]
+
+
+SCALAR_FUNCTIONS = {
+    'ARRAY_LENGTH': (lambda a: None if a is None else len(a), lambda types: INTEGER),
+    'COALESCE': (sql_coalesce, common_type),
+    'IFNULL': (sql_coalesce, common_type),
+    'IF': (lambda c, a, b: a if c else b, lambda types: common_type(types[1:])),
+    'NULLIF': (lambda a, b: None if a == b else a, lambda types: types[0]),
+    'LOWER': (null_safe(lambda s: s.lower()), lambda types: STRING),
+    'UPPER': (null_safe(lambda s: s.upper()), lambda types: STRING),
+    'LENGTH': (null_safe(len), lambda types: INTEGER),
+    'TRIM': (null_safe(lambda s: s.strip()), lambda types: STRING),
+    'CONCAT': (null_safe(lambda *args: ''.join(args)), lambda types: STRING),
+    'SUBSTR': (sql_substr, lambda types: STRING),
+    'STARTS_WITH': (null_safe(lambda s, p: s.startswith(p)), lambda types: BOOLEAN),
+    'ENDS_WITH': (null_safe(lambda s, p: s.endswith(p)), lambda types: BOOLEAN),
+    'ABS': (null_safe(abs), lambda types: types[0]),
+    'ROUND': (sql_round, lambda types: FLOAT),
+    'FLOOR': (null_safe(lambda x: float(math.floor(x))), lambda types: FLOAT),
+    'CEIL': (null_safe(lambda x: float(math.ceil(x))), lambda types: FLOAT),
+    'SQRT': (null_safe(math.sqrt), lambda types: FLOAT),
+    'MOD': (null_safe(lambda a, b: int(math.fmod(a, b))), lambda types: INTEGER),
+    'GREATEST': (sql_greatest, common_type),
+    'LEAST': (sql_least, common_type),
+    '$FIELD': (None, None),
+}
+
+
+def agg_count(values):
+    return len([v for v in values if v is not None])
+
+
+def agg_sum(values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def agg_avg(values):
+    values = [v for v in values if v is not None]
+    return float(sum(values)) / len(values) if values else None
+
+
+def agg_min(values):
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+def agg_max(values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def agg_any_value(values):
+    for v in values:
+        if v is not None:
+            return v
+    return None
+
+
+def agg_logical_and(values):
+    values = [v for v in values if v is not None]
+    return all(values) if values else None
+
+
+def agg_logical_or(values):
+    values = [v for v in values if v is not None]
+    return any(values) if values else None
+
+
+def agg_array_agg(values):
+    if any(v is None for v in values):
+        raise LocalSqlError('ARRAY_AGG cannot contain NULL values')
+    return list(values)
+
+
+AGGREGATE_FUNCTIONS = {
+    'COUNT': (agg_count, lambda t: INTEGER),
+    'COUNTIF': (lambda values: len([v for v in values if v]), lambda t: INTEGER),
+    'SUM': (agg_sum, lambda t: t),
+    'AVG': (agg_avg, lambda t: FLOAT),
+    'MIN': (agg_min, lambda t: t),
+    'MAX': (agg_max, lambda t: t),
+    'ANY_VALUE': (agg_any_value, lambda t: t),
+    'ARRAY_AGG': (agg_array_agg, lambda t: t.array()),
+    'LOGICAL_AND': (agg_logical_and, lambda t: BOOLEAN),
+    'LOGICAL_OR': (agg_logical_or, lambda t: BOOLEAN),
+}
+
+
+def contains_aggregate(node):
+    if isinstance(node, CountStar):
+        return True
+    if isinstance(node, Function) and (node.name in AGGREGATE_FUNCTIONS or
+                                       node.name == 'STRING_AGG'):
+        return True
+    if isinstance(node, (Query, Select, Union)):
+        return False
+    if isinstance(node, tuple):
+        return any(contains_aggregate(child) for child in node)
+    if isinstance(node, list):
+        return any(contains_aggregate(child) for child in node)
+    return False
+
+
+def like_regex(pattern):
+    regex = ''.join(
+        '.*' if c == '%' else '.' if c == '_' else re.escape(c)
+        for c in pattern)
+    return re.compile(regex + r'\Z', re.DOTALL)
+
+
+# expression compilation: every expression is compiled once into a closure
+# and its result type, either over a single row or, for aggregate queries,
+# over a group of rows
+
+class Compiler(object):
+
+    def __init__(self, scope, grouped=False, aliases=None):
+        self.scope = scope
+        self.grouped = grouped
+        self.aliases = aliases or {}
+
+    def row_level(self):
+        return Compiler(self.scope, False, self.aliases)
+
+    def compile(self, node):
+        method = getattr(self, 'compile_' + type(node).__name__.lower(), None)
+        if method is None:
+            raise LocalSqlError('Unsupported expression: %s' % type(node).__name__)
+        return method(node)
+
+    def lift(self, function):
+        # in an aggregate query, non-aggregate expressions see the first row
+        # of their group
+        if not self.grouped:
+            return function
+        return lambda group: function(group[0]) if group else None
+
+    def compile_literal(self, node):
+        value = node.value
+        return lambda row: value, type_of_value(value)
+
+    def compile_column(self, node):
+        if len(node.path) == 1 and node.path[0].lower() in self.aliases and \
+                not self._resolvable(node.path):
+            return Compiler(self.scope, self.grouped).compile(
+                self.aliases[node.path[0].lower()])
+        getter, t = self.scope.resolve(node.path)
+        return self.lift(getter), t
+
+    def _resolvable(self, path):
+        try:
+            self.scope.resolve(path)
+            return True
+        except LocalSqlError:
+            return False
+
+    def compile_countstar(self, node):
+        if not self.grouped:
+            raise LocalSqlError('COUNT(*) used outside of an aggregate query')
+        return len, INTEGER
+
+    def compile_function(self, node):
+        if node.name in AGGREGATE_FUNCTIONS:
+            if not self.grouped:
+                raise LocalSqlError('Aggregate function %s not allowed here' % node.name)
+            aggregate, result_type = AGGREGATE_FUNCTIONS[node.name]
+            if not node.args:
+                raise LocalSqlError('%s requires an argument' % node.name)
+            argument, t = self.row_level().compile(node.args[0])
+
+            if node.distinct:
+                def function(group):
+                    values = []
+                    seen = set()
+                    for row in group:
+                        value = argument(row)
+                        key = canonicalize(value)
+                        if key not in seen:
+                            seen.add(key)
+                            values.append(value)
+                    return aggregate(values)
+            else:
+                function = lambda group: aggregate([argument(row) for row in group])
+            return function, result_type(t)
+
+        if node.name == 'STRING_AGG':
+            if not self.grouped:
+                raise LocalSqlError('Aggregate function STRING_AGG not allowed here')
+            argument, _ = self.row_level().compile(node.args[0])
+            separator = node.args[1].value if len(node.args) > 1 else ','
+
+            def string_agg(group):
+                values = [argument(row) for row in group]
+                values = [v for v in values if v is not None]
+                return separator.join(values) if values else None
+            return string_agg, STRING
+
+        compiled = [self.compile(arg) for arg in node.args]
+        functions = [f for f, _ in compiled]
+        types = [t for _, t in compiled]
+
+        if node.name == '$FIELD':
+            name = node.args[1].value
+            field_name, t = types[0].field(name)
+            if field_name is None:
+                raise LocalSqlError('Unrecognized field: %s' % name)
+            operand = functions[0]
+            return (lambda row: (operand(row) or {}).get(field_name)), t
+
+        if node.name not in SCALAR_FUNCTIONS:
+            raise LocalSqlError('Unsupported function: %s' % node.name)
+        scalar, result_type = SCALAR_FUNCTIONS[node.name]
+
+        t = result_type(types)
+        if node.name == 'IF':
+            condition, a, b = functions
+            return coerce_result(lambda row: a(row) if condition(row) else b(row), t), t
+
+        return coerce_result(lambda row: scalar(*[f(row) for f in functions]), t), t
+
+    def compile_binary(self, node):
+        left, left_type = self.compile(node.left)
+        right, right_type = self.compile(node.right)
+        op = node.op
+
+        if op == 'AND':
+            def and_(row):
+                a = left(row)
+                if a is False:
+                    return False
+                b = right(row)
+                if b is False:
+                    return False
+                return None if a is None or b is None else True
+            return and_, BOOLEAN
+
+        if op == 'OR':
+            def or_(row):
+                a = left(row)
+                if a is True:
+                    return True
+                b = right(row)
+                if b is True:
+                    return True
+                return None if a is None or b is None else False
+            return or_, BOOLEAN
+
+        if op in ('=', '!=', '<', '<=', '>', '>='):
+            return (lambda row: sql_compare(op, left(row), right(row))), BOOLEAN
+
+        if op == '||':
+            t = STRING
+        elif op == '/':
+            t = FLOAT
+        elif left_type.kind == 'integer' and right_type.kind == 'integer':
+            t = INTEGER
+        elif left_type.kind is None or right_type.kind is None:
+            t = UNKNOWN
+        else:
+            t = FLOAT
+        return (lambda row: sql_arithmetic(op, left(row), right(row))), t
+
+    def compile_unary(self, node):
+        operand, t = self.compile(node.operand)
+        if node.op == 'NOT':
+            return (lambda row: None if operand(row) is None else not operand(row)), BOOLEAN
+        return (lambda row: None if operand(row) is None else -operand(row)), t
+
+    def compile_isnull(self, node):
+        operand, _ = self.compile(node.operand)
+        if node.negated:
+            return (lambda row: operand(row) is not None), BOOLEAN
+        return (lambda row: operand(row) is None), BOOLEAN
+
+    def compile_inlist(self, node):
+        operand, _ = self.compile(node.operand)
+        items = [self.compile(item)[0] for item in node.items]
+        negated = node.negated
+
+        def in_list(row):
+            value = operand(row)
+            if value is None:
+                return None
+            values = [item(row) for item in items]
+            if value in values:
+                return not negated
+            if None in values:
+                return None
+            return negated
+        return in_list, BOOLEAN
+
+    def compile_inarray(self, node):
+        operand, _ = self.compile(node.operand)
+        array, _ = self.compile(node.array)
+        negated = node.negated
+
+        def in_array(row):
+            value = operand(row)
+            if value is None:
+                return None
+            return (value in (array(row) or [])) != negated
+        return in_array, BOOLEAN
+
+    def compile_between(self, node):
+        operand, _ = self.compile(node.operand)
+        low, _ = self.compile(node.low)
+        high, _ = self.compile(node.high)
+        negated = node.negated
+
+        def between(row):
+            value, a, b = operand(row), low(row), high(row)
+            if value is None or a is None or b is None:
+                return None
+            return (a <= value <= b) != negated
+        return between, BOOLEAN
+
+    def compile_like(self, node):
+        operand, _ = self.compile(node.operand)
+        pattern, _ = self.compile(node.pattern)
+        negated = node.negated
+
+        def like(row):
+            value, p = operand(row), pattern(row)
+            if value is None or p is None:
+                return None
+            return bool(like_regex(p).match(value)) != negated
+        return like, BOOLEAN
+
+    def compile_case(self, node):
+        operand = self.compile(node.operand)[0] if node.operand is not None else None
+        whens = [(self.compile(c)[0], self.compile(r)) for c, r in node.whens]
+        default, default_type = self.compile(node.default) if node.default is not None \
+            else (lambda row: None, UNKNOWN)
+        t = common_type([r[1] for _, r in whens] + [default_type])
+
+        def case(row):
+            value = operand(row) if operand is not None else None
+            for condition, (result, _) in whens:
+                c = condition(row)
+                if operand is not None:
+                    c = value is not None and c == value
+                if c:
+                    return result(row)
+            return default(row)
+        return case, t
+
+    def compile_cast(self, node):
+        operand, _ = self.compile(node.operand)
+        t, safe = node.type, node.safe
+        return (lambda row: cast_value(operand(row), t, safe)), t
+
+    def compile_arrayliteral(self, node):
+        items = [self.compile(item) for item in node.items]
+        functions = [f for f, _ in items]
+        t = node.type or common_type([t for _, t in items])
+
+        def array(row):
+            values = [f(row) for f in functions]
+            if t.kind is not None:
+                values = [coerce_value(v, t) for v in values]
+            return values
+        return array, t.array()
+
+    def compile_structliteral(self, node):
+        items = [self.compile(expr) for expr, _ in node.items]
+        if node.types is not None:
+            if len(node.types) != len(items):
+                raise LocalSqlError('STRUCT has %d fields but %d values' % (
+                    len(node.types), len(items)))
+            fields = node.types
+        else:
+            fields = []
+            for i, ((expr, alias), (_, t)) in enumerate(zip(node.items, items)):
+                name = alias or (expr.path[-1] if isinstance(expr, Column) else '_field_%d' % (i + 1))
+                fields.append((name, t))
+
+        functions = [f for f, _ in items]
+        names = [name for name, _ in fields]
+        types = [t for _, t in fields]
+
+        def struct(row):
+            record = {}
+            for name, t, f in zip(names, types, functions):
+                value = f(row)
+                if t.kind not in (None, 'record') and not t.repeated:
+                    value = cast_value(value, t, False)
+                record[name] = value
+            return record
+        return struct, SqlType('record', fields, False)
+
+    def compile_subscript(self, node):
+        operand, t = self.compile(node.operand)
+        index, _ = self.compile(node.index)
+        mode = node.mode
+        base = 1 if 'ORDINAL' in mode else 0
+        safe = mode.startswith('SAFE')
+
+        def subscript(row):
+            array, i = operand(row), index(row)
+            if array is None or i is None:
+                return None
+            i -= base
+            if 0 <= i < len(array):
+                return array[i]
+            if safe:
+                return None
+            raise LocalSqlError('Array index %d is out of bounds' % (i + base))
+        return subscript, t.element()
+
+
+# query execution
+
+class Result(object):
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+    def records(self):
+        names = [name for name, _ in self.fields]
+        return [dict(zip(names, row)) for row in self.rows]
+
+
+def sort_key(value):
+    if isinstance(value, (dict, list)):
+        value = repr(canonicalize(value))
+    return (value is not None, value)
+
+
+def strip_nulls(value):
+    if isinstance(value, dict):
+        return {k: strip_nulls(v) for k, v in value.items()
+                if v is not None and v != []}
+    if isinstance(value, list):
+        return [strip_nulls(v) for v in value]
+    if isinstance(value, Null):
+        return None
+    return value
+
+
+def value_from_record(record, field):
+    # mock tables leave out empty values, but a missing array is an empty
+    # array rather than NULL
+    value = record.get(field.name)
+    if value is None or isinstance(value, Null):
+        return [] if field.repeated else None
+    if field.type != 'record':
+        return value
+    if field.repeated:
+        return [{f.name: value_from_record(v, f) for f in field.subfields} for v in value]
+    return {f.name: value_from_record(value, f) for f in field.subfields}
+
+
+class Engine(object):
+
+    def __init__(self, resolve_table, create_table=None, drop_table=None):
+        self.resolve_table = resolve_table
+        self.create_table = create_table
+        self.drop_table = drop_table
+
+    def execute(self, sql):
+        # runs every statement of a script and returns the last query's result
+        table = BigQueryTestTable([], [])
+        for statement in parse_script(sql):
+            if isinstance(statement, CreateTable):
+                self.run_create_table(statement)
+                table = BigQueryTestTable([], [])
+            elif isinstance(statement, DropTable):
+                if self.drop_table is None:
+                    raise LocalSqlError('DROP TABLE is not supported here')
+                self.drop_table(statement.path, statement.if_exists)
+                table = BigQueryTestTable([], [])
+            else:
+                table = self.table_from_result(self.run_query(statement, Scope()))
+        return table
+
+    def table_from_result(self, result, schema=None):
+        if schema is None:
+            schema = schema_from_type(result.fields)
+        records = []
+        for row in result.rows:
+            record = dict(zip([f.name for f in schema], row))
+            records.append({k: strip_nulls(v) for k, v in record.items()
+                            if v is not None and v != []})
+        return BigQueryTestTable(records, schema)
+
+    def run_create_table(self, statement):
+        if self.create_table is None:
+            raise LocalSqlError('CREATE TABLE is not supported here')
+        result = self.run_query(statement.query, Scope())
+
+        schema = None
+        if statement.columns is not None:
+            if len(statement.columns) != len(result.fields):
+                raise LocalSqlError('CREATE TABLE has %d columns but the query returns %d' % (
+                    len(statement.columns), len(result.fields)))
+            schema = schema_from_type([(name, t) for name, t, _ in statement.columns])
+            schema = [f._replace(nullable=False) if not_null else f
+                      for f, (_, _, not_null) in zip(schema, statement.columns)]
+            types = [t for _, t, _ in statement.columns]
+            result.rows = [[coerce_value(v, t) for v, t in zip(row, types)]
+                           for row in result.rows]
+
+        self.create_table(statement.path, self.table_from_result(result, schema),
+                          statement.if_not_exists, statement.replace)
+
+    def run_query(self, query, outer_scope):
+        scope = outer_scope
+        if query.ctes:
+            ctes = dict(scope.ctes)
+            for name, cte in query.ctes:
+                ctes[name.lower()] = self.run_query(cte, Scope(ctes=ctes))
+            scope = Scope(scope.bindings, ctes)
+
+        if isinstance(query.body, Select):
+            result = self.run_select(query.body, scope, query.order_by)
+        else:
+            result = self.run_set(query.body, scope)
+            if query.order_by:
+                result = self.order_output(result, query.order_by)
+
+        offset = self.constant(query.offset) if query.offset is not None else 0
+        if query.limit is not None:
+            limit = self.constant(query.limit)
+            result.rows = result.rows[offset:offset + limit]
+        elif offset:
+            result.rows = result.rows[offset:]
+        return result
+
+    def constant(self, expr):
+        value = Compiler(Scope()).compile(expr)[0]({})
+        if not isinstance(value, int):
+            raise LocalSqlError('Expected an integer constant, got %r' % value)
+        return value
+
+    def run_set(self, body, scope):
+        if isinstance(body, Union):
+            left = self.run_set(body.left, scope)
+            right = self.run_set(body.right, scope)
+            if len(left.fields) != len(right.fields):
+                raise LocalSqlError('UNION ALL inputs have different numbers of columns')
+            return Result(left.fields, left.rows + right.rows)
+        if isinstance(body, Query):
+            return self.run_query(body, scope)
+        return self.run_select(body, scope, [])
+
+    def order_output(self, result, order_by):
+        names = [name.lower() for name, _ in result.fields]
+        keys = []
+        for item in order_by:
+            if isinstance(item.expr, Literal) and isinstance(item.expr.value, int):
+                keys.append((item.expr.value - 1, item.descending))
+            elif isinstance(item.expr, Column) and len(item.expr.path) == 1 and \
+                    item.expr.path[0].lower() in names:
+                keys.append((names.index(item.expr.path[0].lower()), item.descending))
+            else:
+                raise LocalSqlError('ORDER BY after UNION ALL must use output columns')
+        rows = result.rows
+        for index, descending in reversed(keys):
+            rows = sorted(rows, key=lambda row: sort_key(row[index]), reverse=descending)
+        result.rows = rows
+        return result
+
+    # FROM
+
+    def run_from(self, from_, scope):
+        rows = [{}]
+        for join in from_:
+            rows, scope = self.run_join(rows, scope, join)
+        return rows, scope
+
+    def run_join(self, rows, scope, join):
+        item = join.right
+        if isinstance(item, TableRef) and self.is_correlated(item.path, scope):
+            # correlated array reference, e.g. FROM t, t.array_column
+            item = UnnestRef(Column(item.path), item.alias or item.path[-1], None)
+
+        if isinstance(item, UnnestRef):
+            array, t = Compiler(scope).compile(item.expr)
+            if not t.repeated and t.kind is not None:
+                raise LocalSqlError('UNNEST requires an array')
+            element_type = t.element()
+            alias = item.alias or (item.expr.path[-1] if isinstance(item.expr, Column) else '$unnest')
+            table_like = item.alias is None and element_type.kind == 'record'
+            bindings = [Binding(alias, element_type, table_like)]
+            if item.offset_alias:
+                bindings.append(Binding(item.offset_alias, INTEGER, False))
+
+            def right_rows(row):
+                for i, value in enumerate(array(row) or []):
+                    right = {alias: value}
+                    if item.offset_alias:
+                        right[item.offset_alias] = i
+                    yield right
+        else:
+            if isinstance(item, SubqueryRef):
+                result = self.run_query(item.query, Scope(ctes=scope.ctes))
+                alias = item.alias or '$subquery'
+            elif len(item.path) == 1 and item.path[0].lower() in scope.ctes:
+                result = scope.ctes[item.path[0].lower()]
+                alias = item.alias or item.path[0]
+            else:
+                table = self.resolve_table(item.path)
+                result = Result(type_from_schema(table.schema).fields,
+                                [[value_from_record(record, f) for f in table.schema]
+                                 for record in table.iter_records()])
+                alias = item.alias or item.path[-1]
+            bindings = [Binding(alias, SqlType('record', result.fields, False), True)]
+            records = result.records()
+            right_rows = lambda row: ({alias: record} for record in records)
+
+        joined_scope = scope.extend(bindings)
+        condition = None
+        if join.condition is not None:
+            condition = Compiler(joined_scope).compile(join.condition)[0]
+        elif join.using:
+            conditions = [
+                (scope.resolve([name])[0], joined_scope.extend([])
+                 .resolve([bindings[0].alias, name])[0])
+                for name in join.using]
+            condition = lambda row: all(
+                left(row) is not None and left(row) == right(row)
+                for left, right in conditions)
+
+        joined = []
+        for row in rows:
+            matched = False
+            for right in right_rows(row):
+                combined = dict(row)
+                combined.update(right)
+                if condition is None or condition(combined):
+                    joined.append(combined)
+                    matched = True
+            if join.kind == 'LEFT' and not matched:
+                combined = dict(row)
+                for binding in bindings:
+                    combined[binding.alias] = None
+                joined.append(combined)
+        return joined, joined_scope
+
+    def is_correlated(self, path, scope):
+        binding = scope.find_alias(path[0])
+        if binding is None:
+            return False
+        return len(path) > 1 or binding.type.repeated
+
+    # SELECT
+
+    def run_select(self, select, outer_scope, order_by):
+        if select.from_ is not None:
+            rows, scope = self.run_from(select.from_, outer_scope)
+        else:
+            rows, scope = [{}], outer_scope
+
+        if select.where is not None:
+            where = Compiler(scope).compile(select.where)[0]
+            rows = [row for row in rows if where(row) is True]
+
+        grouped = bool(select.group_by) or select.having is not None or \
+            contains_aggregate(select.items) or contains_aggregate(order_by)
+
+        items = self.expand_items(select.items, scope)
+
+        # select list aliases can be used in GROUP BY, HAVING and ORDER BY
+        alias_compiler = Compiler(scope)
+        aliases = {}
+        for expr, name in items:
+            if name:
+                aliases[name.lower()] = expr
+
+        if grouped:
+            keys = []
+            for expr in select.group_by:
+                if isinstance(expr, Literal) and isinstance(expr.value, int):
+                    expr = items[expr.value - 1][0]
+                elif isinstance(expr, Column) and len(expr.path) == 1 and \
+                        expr.path[0].lower() in aliases and \
+                        not contains_aggregate(aliases[expr.path[0].lower()]) and \
+                        not alias_compiler._resolvable(expr.path):
+                    expr = aliases[expr.path[0].lower()]
+                keys.append(Compiler(scope).compile(expr)[0])
+
+            groups = {}
+            order = []
+            for row in rows:
+                key = canonicalize([k(row) for k in keys])
+                if key not in groups:
+                    groups[key] = []
+                    order.append(key)
+                groups[key].append(row)
+            contexts = [groups[key] for key in order]
+            if not keys and not contexts:
+                contexts = [[]]
+        else:
+            contexts = rows
+
+        compiler = Compiler(scope, grouped)
+        compiled = [compiler.compile(expr) for expr, _ in items]
+
+        if select.having is not None:
+            having = Compiler(scope, grouped, aliases).compile(select.having)[0]
+            contexts = [c for c in contexts if having(c) is True]
+
+        fields = []
+        unnamed = 0
+        for (expr, name), (_, t) in zip(items, compiled):
+            if name is None:
+                name = 'f%d_' % unnamed
+                unnamed += 1
+            fields.append((name, t))
+
+        output = [[f(context) for f, _ in compiled] for context in contexts]
+
+        # fill in types that could not be inferred statically from the values
+        for i, (name, t) in enumerate(fields):
+            if t.kind is None:
+                fields[i] = (name, common_type([type_of_value(row[i]) for row in output]))
+
+        if select.distinct:
+            seen = set()
+            distinct_output = []
+            distinct_contexts = []
+            for row, context in zip(output, contexts):
+                key = canonicalize(row)
+                if key not in seen:
+                    seen.add(key)
+                    distinct_output.append(row)
+                    distinct_contexts.append(context)
+            output, contexts = distinct_output, distinct_contexts
+
+        if order_by:
+            output = self.order_select(output, contexts, fields, order_by,
+                                       compiler, grouped)
+
+        return Result(fields, output)
+
+    def expand_items(self, select_items, scope):
+        items = []
+        for item in select_items:
+            if isinstance(item, Star):
+                excepted = set(name.lower() for name in item.excepted)
+                for name, path in self.star_columns(item, scope):
+                    if name.lower() not in excepted:
+                        items.append((Column(path), name))
+            else:
+                name = item.alias
+                if name is None and isinstance(item.expr, Column):
+                    name = item.expr.path[-1]
+                items.append((item.expr, name))
+        return items
+
+    def star_columns(self, star, scope):
+        if star.qualifier is not None:
+            _, t = scope.resolve(star.qualifier)
+            if t.kind != 'record' or t.repeated:
+                raise LocalSqlError('Cannot expand %s.*' % '.'.join(star.qualifier))
+            return [(name, star.qualifier + [name]) for name, _ in t.fields]
+
+        columns = []
+        for binding in scope.bindings:
+            if binding.table_like:
+                columns += [(name, [binding.alias, name]) for name, _ in binding.type.fields]
+            else:
+                columns.append((binding.alias, [binding.alias]))
+        return columns
+
+    def order_select(self, output, contexts, fields, order_by, compiler, grouped):
+        names = [name.lower() for name, _ in fields]
+        keys = []
+        for item in order_by:
+            expr = item.expr
+            if isinstance(expr, Literal) and isinstance(expr.value, int):
+                index = expr.value - 1
+                keys.append((lambda row, context, index=index: row[index], item.descending))
+            elif isinstance(expr, Column) and len(expr.path) == 1 and \
+                    expr.path[0].lower() in names:
+                index = names.index(expr.path[0].lower())
+                keys.append((lambda row, context, index=index: row[index], item.descending))
+            else:
+                f = compiler.compile(expr)[0]
+                keys.append((lambda row, context, f=f: f(context), item.descending))
+
+        pairs = list(zip(output, contexts))
+        for key, descending in reversed(keys):
+            pairs.sort(key=lambda pair: sort_key(key(*pair)), reverse=descending)
+        return [row for row, _ in pairs]
+
+
+def normalize_schema(schema):
+    # schemas can be given as API resources, google-cloud SchemaFields or
+    # parsed BigQueryTestSchemaFields
+    schema = list(schema)
+    if schema and isinstance(schema[0], dict):
+        return schema_from_api_resource(schema)
+    if schema and not isinstance(schema[0], BigQueryTestSchemaField):
+        return schema_from_bigquery_schema(schema)
+    return schema
+
+
+class LocalBackend(object):
+
+    remote = False
+
+    def __init__(self, schemas=None):
+        self.tables = {}
+        self.schemas = {}
+        self.counters = Counters()
+        for table_id, schema in (schemas or {}).items():
+            self.add_schema(table_id, schema)
+
+    def add_schema(self, table_id, schema):
+        parts = table_id.strip('`').replace(':', '.').split('.')
+        if len(parts) == 2:
+            parts = [None] + parts
+        self.schemas[tuple(parts)] = normalize_schema(schema)
+
+    def load_schema(self, project, dataset, table_name):
+        for key in (project, dataset, table_name), (None, dataset, table_name):
+            if key in self.schemas:
+                return self.schemas[key]
+        for (_, schema_dataset, schema_table), schema in self.schemas.items():
+            if (schema_dataset, schema_table) == (dataset, table_name):
+                return schema
+        raise LocalSqlError('No schema registered for %s.%s.%s' % (
+            project, dataset, table_name))
+
+    def create_table(self, name, table, block=True, on_created=None):
+        self.tables[name] = table
+        if on_created is not None:
+            on_created()
+        return None
+
+    def delete_table(self, name, block=True):
+        self.tables.pop(name, None)
+
+    def list_tables(self):
+        return list(self.tables)
+
+    def query(self, sql, use_legacy_sql=False, page_size=None, max_rows=None,
+              max_bytes=None):
+        if use_legacy_sql:
+            raise LocalSqlError('The local backend only supports standard SQL')
+        table = Engine(self.resolve_table, self.create_table_from_query,
+                       self.drop_table_from_query).execute(sql)
+        if max_rows is not None and len(table.data) > max_rows:
+            raise ResultTooLargeError('Query returned more than %d rows' % max_rows)
+        self.counters.add('queries')
+        self.counters.add('rows_returned', len(table.data))
+        return table
+
+    def dry_run(self, sql, use_legacy_sql=False):
+        # runs the query without keeping any tables it creates or drops,
+        # and counts the size of every table it reads as processed
+        if use_legacy_sql:
+            raise LocalSqlError('The local backend only supports standard SQL')
+        scanned = {}
+
+        def resolve(path):
+            table = self.resolve_table(path)
+            scanned['.'.join(path)] = len(json.dumps(table.data, default=json_default))
+            return table
+
+        table = Engine(resolve, lambda *args: None, lambda *args: None).execute(sql)
+        self.counters.add('dry_runs')
+        return DryRunResult(sorted(scanned), table.schema, sum(scanned.values()))
+
+    def snapshot(self):
+        return self.counters.snapshot()
+
+    def create_table_from_query(self, path, table, if_not_exists, replace):
+        if path[-1] in self.tables and not replace:
+            if if_not_exists:
+                return
+            raise LocalSqlError('Table already exists: %s' % '.'.join(path))
+        self.tables[path[-1]] = table
+
+    def drop_table_from_query(self, path, if_exists):
+        if path[-1] not in self.tables:
+            if if_exists:
+                return
+            raise LocalSqlError('Table not found: %s' % '.'.join(path))
+        del self.tables[path[-1]]
+
+    def create_tables(self, tables, max_script_bytes=None):
+        for name, table, on_created in tables:
+            self.create_table(name, table, on_created=on_created)
+        return []
+
+    def delete_tables(self, names):
+        for name in names:
+            self.delete_table(name)
+
+    def resolve_table(self, path):
+        name = path[-1]
+        if name not in self.tables:
+            raise LocalSqlError('Table not found: %s' % '.'.join(path))
+        return self.tables[name]
@@ -0,0 +1,268 @@
+from __future__ import absolute_import
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# the counters of the phase running on each thread. Work done for a phase
+# on another thread counts toward it when run with counting_into
+_active = threading.local()
+
+
+def current_counters():
+    return getattr(_active, 'counters', None)
+
+
+@contextmanager
+def counting_into(counters):
+    previous = current_counters()
+    _active.counters = counters
+    try:
+        yield
+    finally:
+        _active.counters = previous
+
+
+def count(name, value=1):
+    counters = current_counters()
+    if counters is not None:
+        counters.add(name, value)
+
+
+class Counters(object):
+
+    # cumulative counts kept by a backend, such as bytes uploaded or
+    # processed. Every count also goes to the phase running on the thread
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _add(self, name, value):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def add(self, name, value=1):
+        self._add(name, value)
+        counters = current_counters()
+        if counters is not None and counters is not self:
+            counters._add(name, value)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Phase(object):
+
+    __slots__ = ['name', 'start', 'seconds', 'attributes']
+
+    def __init__(self, name, start, seconds, attributes):
+        self.name = name
+        self.start = start
+        self.seconds = seconds
+        self.attributes = attributes
+
+    def to_json(self):
+        return dict(self.attributes, phase=self.name, seconds=self.seconds)
+
+
+@contextmanager
+def no_phase(name, **attributes):
+    yield attributes
+
+
+class TestMetrics(object):
+
+    # only running totals per phase name are kept; the phases themselves
+    # go to the collector's sinks
+
+    def __init__(self, test_id, collector):
+        self.test_id = test_id
+        self.collector = collector
+        self.start = collector.clock()
+        self.seconds = None
+        self._totals = {}
+        self._open = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **attributes):
+        # a phase run inside another on the same thread, like parsing the
+        # expected table while comparing, counts toward its own totals and
+        # is taken out of the enclosing phase's, so nothing counts twice.
+        # Counts are made on the phase's own thread, so phases running at
+        # the same time on other threads don't count each other's work
+        stack = self._open.__dict__.setdefault('stack', [])
+        nested = {'seconds': 0.0}
+        stack.append(nested)
+        counters = Counters()
+        start = self.collector.clock()
+        try:
+            with counting_into(counters):
+                yield attributes
+        finally:
+            stack.pop()
+            elapsed = self.collector.clock() - start
+            if stack:
+                stack[-1]['seconds'] += elapsed
+            attributes.update(counters.snapshot())
+            phase = Phase(name, start, elapsed - nested['seconds'], attributes)
+            with self._lock:
+                add_phase_total(self._totals, phase.name, phase.seconds, phase.attributes)
+            self.collector.add_phase(self.test_id, phase)
+
+    def totals(self):
+        with self._lock:
+            return dict((name, dict(total)) for name, total in self._totals.items())
+
+    def to_json(self):
+        return {'test': self.test_id, 'seconds': self.seconds,
+                'phases': self.totals()}
+
+
+def add_phase_total(totals, name, seconds, attributes):
+    total = totals.setdefault(name, {'count': 0, 'seconds': 0.0})
+    total['count'] += 1
+    total['seconds'] += seconds
+    for key, value in attributes.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+
+
+class MetricsCollector(object):
+
+    # sinks are called with a dict for every finished phase and test. Only
+    # the keep_slowest slowest phases are kept for the summary, without
+    # their SQL
+
+    def __init__(self, sinks=None, clock=time.time, keep_slowest=10):
+        self.sinks = list(sinks or [])
+        self.clock = clock
+        self.keep_slowest = keep_slowest
+        self.tests = []
+        self._slowest_phases = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def start_test(self, test_id):
+        return TestMetrics(test_id, self)
+
+    def finish_test(self, metrics):
+        metrics.seconds = self.clock() - metrics.start
+        with self._lock:
+            self.tests.append(metrics)
+        self.emit({'test': metrics.test_id, 'phase': 'test', 'seconds': metrics.seconds})
+
+    def add_phase(self, test_id, phase):
+        event = dict(phase.to_json(), test=test_id)
+        self.emit(event)
+        entry = dict(event)
+        entry.pop('sql', None)
+        with self._lock:
+            heapq.heappush(self._slowest_phases, (phase.seconds, next(self._sequence), entry))
+            if len(self._slowest_phases) > self.keep_slowest:
+                heapq.heappop(self._slowest_phases)
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink(event)
+
+    def clear(self):
+        with self._lock:
+            self.tests = []
+            self._slowest_phases = []
+
+    def summary(self, top=10):
+        with self._lock:
+            tests = list(self.tests)
+            entries = [entry for _, _, entry in self._slowest_phases]
+        phases = {}
+        for metrics in tests:
+            for name, total in metrics.totals().items():
+                suite_total = phases.setdefault(name, {'count': 0, 'seconds': 0.0})
+                for key, value in total.items():
+                    suite_total[key] = suite_total.get(key, 0) + value
+
+        slowest_tests = sorted(tests, key=lambda m: -(m.seconds or 0))[:top]
+        return {
+            'num_tests': len(tests),
+            'seconds': sum(m.seconds or 0 for m in tests),
+            'phases': phases,
+            'slowest_tests': [{'test': m.test_id, 'seconds': m.seconds}
+                              for m in slowest_tests],
+            'slowest_phases': sorted(entries, key=lambda e: -e['seconds'])[:top],
+            'tests': [m.to_json() for m in tests],
+        }
+
+    def write_json(self, path, top=10):
+        with open(path, 'w') as f:
+            json.dump(self.summary(top), f, indent=2, sort_keys=True)
+
+    def report(self, top=10):
+        summary = self.summary(top)
+        lines = ['%d tests, %.3fs' % (summary['num_tests'], summary['seconds']),
+                 '%-14s %6s %10s  %s' % ('phase', 'count', 'seconds', 'counters')]
+        for name, total in sorted(summary['phases'].items(), key=lambda i: -i[1]['seconds']):
+            counters = ', '.join('%s=%s' % (k, v) for k, v in sorted(total.items())
+                                 if k not in ('count', 'seconds'))
+            lines.append('%-14s %6d %9.3fs  %s' % (name, total['count'], total['seconds'], counters))
+
+        lines.append('slowest tests:')
+        for test in summary['slowest_tests']:
+            lines.append('  %9.3fs  %s' % (test['seconds'] or 0, test['test']))
+
+        lines.append('slowest phases:')
+        for entry in summary['slowest_phases']:
+            detail = entry.get('table') or ''
+            lines.append(('  %9.3fs  %-14s %s %s' % (
+                entry['seconds'], entry['phase'], entry['test'], detail)).rstrip())
+        return '\n'.join(lines)
+
+
+class LogSink(object):
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('bigquerytest.metrics')
+        self.level = level
+
+    def __call__(self, event):
+        self.logger.log(self.level, json.dumps(event, sort_keys=True))
+
+
+class JsonLinesSink(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, sort_keys=True)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+def write_summary_at_exit(collector, path, top=10, stream=sys.stderr):
+    def write():
+        if not collector.tests:
+            return
+        collector.write_json(path, top)
+        stream.write(collector.report(top) + '\n')
+    atexit.register(write)
+
+
+default_metrics = MetricsCollector()
+if os.environ.get('BIGQUERYTEST_METRICS'):
+    write_summary_at_exit(default_metrics, os.environ['BIGQUERYTEST_METRICS'],
+                          int(os.environ.get('BIGQUERYTEST_METRICS_TOP', 10)))
@@ -0,0 +1,274 @@
+from __future__ import absolute_import, print_function
+import argparse
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+WORKER_ENV = 'BIGQUERYTEST_WORKER'
+LEASE_DIR_ENV = 'BIGQUERYTEST_LEASE_DIR'
+
+
+def worker_id():
+    return os.environ.get(WORKER_ENV) or os.environ.get('PYTEST_XDIST_WORKER') or None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class FileLock(object):
+
+    # an exclusive lock between processes, and between threads of this
+    # process, on a lock file
+
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, path, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        with self._thread_locks_lock:
+            self._thread_lock = self._thread_locks.setdefault(
+                os.path.abspath(path), threading.Lock())
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._acquire()
+        except Exception:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._release()
+        finally:
+            self._thread_lock.release()
+
+    def _acquire(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return
+        # without flock, the lock is held by whoever created the file
+        while True:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+                return
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                time.sleep(self.poll_interval)
+
+    def _release(self):
+        fd, self._fd = self._fd, None
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        else:
+            os.close(fd)
+            os.remove(self.path)
+
+
+class TableLeases(object):
+
+    # processes that use a shared mock table hold a lease on it in a file
+    # in a shared directory. A table is created by its first holder and
+    # only deleted when the last holder releases it. Leases of processes
+    # that died are ignored.
+
+    def __init__(self, directory, pid=None):
+        self.directory = directory
+        self.pid = pid if pid is not None else os.getpid()
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+
+    def _path(self, key):
+        digest = hashlib.md5(json.dumps(list(key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def lock(self, key):
+        return FileLock(self._path(key) + '.lock')
+
+    def holders(self, key):
+        try:
+            with open(self._path(key) + '.json') as f:
+                holders = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return dict((pid, count) for pid, count in holders.items()
+                    if int(pid) == self.pid or process_alive(int(pid)))
+
+    def _write(self, key, holders):
+        path = self._path(key) + '.json'
+        if not holders:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(holders, f)
+        replace = getattr(os, 'replace', os.rename)
+        replace(tmp_path, path)
+
+    def acquire(self, key):
+        # returns whether this is the first holder, callers hold lock(key)
+        holders = self.holders(key)
+        first = not holders
+        pid = str(self.pid)
+        holders[pid] = holders.get(pid, 0) + 1
+        self._write(key, holders)
+        return first
+
+    def release(self, key):
+        # returns whether this was the last holder, callers hold lock(key)
+        holders = self.holders(key)
+        pid = str(self.pid)
+        if holders.get(pid, 0) > 1:
+            holders[pid] -= 1
+        else:
+            holders.pop(pid, None)
+        self._write(key, holders)
+        return not holders
+
+
+_table_leases = {}
+_table_leases_lock = threading.Lock()
+
+
+def default_table_leases():
+    directory = os.environ.get(LEASE_DIR_ENV) or os.path.join(
+        tempfile.gettempdir(), 'bigquerytest-leases')
+    with _table_leases_lock:
+        if directory not in _table_leases:
+            _table_leases[directory] = TableLeases(directory)
+        return _table_leases[directory]
+
+
+def test_classes(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for test_class in test_classes(test):
+                yield test_class
+        else:
+            yield test.__class__, test
+
+
+def partition(classes, num_workers):
+    # longest processing time first, counting tests per class
+    workers = [[] for _ in range(num_workers)]
+    loads = [0] * num_workers
+    for name, num_tests in sorted(classes.items(), key=lambda c: (-c[1], c[0])):
+        i = loads.index(min(loads))
+        workers[i].append(name)
+        loads[i] += num_tests
+    return [w for w in workers if w]
+
+
+def discover(start_dir, pattern, top_level_dir=None):
+    loader = unittest.TestLoader()
+    suite = loader.discover(start_dir, pattern, top_level_dir)
+    classes = {}
+    failed = []
+    for test_class, test in test_classes(suite):
+        if test_class.__module__ == 'unittest.loader':
+            failed.append(test)
+            continue
+        name = '%s.%s' % (test_class.__module__, test_class.__name__)
+        classes[name] = classes.get(name, 0) + 1
+    return classes, failed
+
+
+def run_workers(groups, top_level_dir, lease_dir, verbosity=1):
+    env = dict(os.environ)
+    env[LEASE_DIR_ENV] = lease_dir
+    env['PYTHONPATH'] = os.pathsep.join(
+        [top_level_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    # output goes to files, a worker blocked on a full pipe would hold
+    # up the others while we wait for the one before it
+    processes = []
+    for i, names in enumerate(groups):
+        worker_env = dict(env)
+        worker_env[WORKER_ENV] = 'w%d' % i
+        command = [sys.executable, '-m', 'unittest'] + (['-v'] if verbosity > 1 else []) + names
+        output = tempfile.TemporaryFile()
+        processes.append((subprocess.Popen(
+            command, env=worker_env, stdout=output, stderr=subprocess.STDOUT), output))
+
+    results = []
+    for i, (process, output) in enumerate(processes):
+        process.wait()
+        with output:
+            output.seek(0)
+            results.append((i, process.returncode, output.read().decode('utf-8', 'replace')))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run unittest test classes in parallel worker processes.')
+    parser.add_argument('-n', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-s', '--start-directory', default='.')
+    parser.add_argument('-p', '--pattern', default='test*.py')
+    parser.add_argument('-t', '--top-level-directory', default=None)
+    parser.add_argument('-v', '--verbose', action='store_const', const=2, default=1)
+    args = parser.parse_args(argv)
+
+    top_level_dir = os.path.abspath(args.top_level_directory or args.start_directory)
+    sys.path.insert(0, top_level_dir)
+    classes, failed = discover(args.start_directory, args.pattern, top_level_dir)
+    for test in failed:
+        print('Failed to import: %s' % test.id())
+
+    num_workers = args.workers or multiprocessing.cpu_count()
+    groups = partition(classes, num_workers)
+    lease_dir = tempfile.mkdtemp(prefix='bigquerytest-leases-')
+
+    start = time.time()
+    try:
+        results = run_workers(groups, top_level_dir, lease_dir, args.verbose)
+    finally:
+        shutil.rmtree(lease_dir, ignore_errors=True)
+    elapsed = time.time() - start
+
+    failures = len(failed)
+    for i, returncode, output in results:
+        print('==== worker w%d (%d classes) ====' % (i, len(groups[i])))
+        print(output.rstrip())
+        if returncode != 0:
+            failures += 1
+
+    print('\n%d test classes on %d workers in %.3fs: %s' % (
+        len(classes), len(groups), elapsed, 'FAILED' if failures else 'OK'))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+from __future__ import absolute_import
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from .parallel import FileLock, process_alive
+
+
+class MockTableRegistry(object):
+
+    # with a path, the registry is shared by every process using it: each
+    # change reads the file, applies the change and writes it back under a
+    # lock file, and every entry counts its holders per pid, so that tables
+    # used by a live process are never stale
+
+    def __init__(self, path=None, ttl=7 * 24 * 60 * 60, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._tables = {}
+        self._reconciled = set()
+        self._lock = threading.RLock()
+        self.load()
+
+    @contextmanager
+    def _update(self):
+        with self._lock:
+            if not self.path:
+                yield self._tables
+                return
+            with FileLock(self.path + '.lock'):
+                self.load()
+                before = copy.deepcopy(self._tables)
+                yield self._tables
+                if self._tables != before:
+                    self.save()
+
+    def _read(self):
+        with self._lock:
+            self.load()
+            return self._tables
+
+    def is_reconciled(self, project, dataset):
+        return (project, dataset) in self._reconciled
+
+    def reconcile(self, project, dataset, list_table_names, prefix, in_use=None):
+        # listed tables for which in_use(name) is true may still be
+        # uploading, they are only registered once they have been created
+        with self._lock:
+            if self.is_reconciled(project, dataset):
+                return False
+            table_names = set(name for name in list_table_names()
+                              if name.startswith(prefix))
+            with self._update() as tables:
+                now = self.clock()
+                for key in list(tables):
+                    if key[:2] == (project, dataset) and key[2] not in table_names:
+                        del tables[key]
+                for name in table_names:
+                    key = (project, dataset, name)
+                    if key not in tables and not (in_use is not None and in_use(name)):
+                        tables[key] = new_entry(now)
+            self._reconciled.add((project, dataset))
+            return True
+
+    def lookup(self, key):
+        with self._lock:
+            found = key in self._read()
+            self._count_lookup(found)
+            return found
+
+    def keys(self):
+        # the registered keys, read once, without counting hits or misses
+        with self._lock:
+            return set(self._read())
+
+    def _count_lookup(self, found):
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def register(self, key):
+        with self._update() as tables:
+            tables[key] = new_entry(self.clock())
+
+    def forget(self, key):
+        with self._update() as tables:
+            tables.pop(key, None)
+
+    def acquire(self, key):
+        with self._update() as tables:
+            entry = tables.setdefault(key, new_entry(self.clock()))
+            add_holder(entry, 1)
+            entry['last_used'] = self.clock()
+
+    def acquire_registered(self, key):
+        # lookup and acquire in one step, so that no other process can
+        # collect the table in between
+        with self._update() as tables:
+            entry = tables.get(key)
+            self._count_lookup(entry is not None)
+            if entry is None:
+                return False
+            add_holder(entry, 1)
+            entry['last_used'] = self.clock()
+            return True
+
+    def release(self, key):
+        with self._update() as tables:
+            entry = tables.get(key)
+            if entry is not None:
+                add_holder(entry, -1)
+                entry['last_used'] = self.clock()
+
+    def refcount(self, key):
+        entry = self._read().get(key)
+        return sum(live_holders(entry).values()) if entry is not None else 0
+
+    def stale(self, project, dataset):
+        if self.ttl is None:
+            return []
+        now = self.clock()
+        with self._lock:
+            return sorted(key for key, entry in self._read().items()
+                          if key[:2] == (project, dataset) and is_stale(entry, now, self.ttl))
+
+    def delete_stale(self, project, dataset, delete_table):
+        # deletes and forgets stale tables while holding the lock, so that
+        # no other process acquires one of them in the meantime
+        if self.ttl is None:
+            return []
+        with self._update() as tables:
+            now = self.clock()
+            keys = sorted(key for key, entry in tables.items()
+                          if key[:2] == (project, dataset) and is_stale(entry, now, self.ttl))
+            for key in keys:
+                delete_table(key[2])
+                del tables[key]
+            return keys
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'tables': len(self._tables),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        tables = {}
+        for entry in entries:
+            key = tuple(entry.pop('key'))
+            entry.setdefault('holders', {})
+            tables[key] = entry
+        with self._lock:
+            self._tables = tables
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [dict(entry, key=list(key), holders=live_holders(entry))
+                       for key, entry in sorted(self._tables.items())]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        replace = getattr(os, 'replace', os.rename)
+        replace(tmp_path, self.path)
+
+
+def new_entry(now):
+    return {'created': now, 'last_used': now, 'holders': {}}
+
+
+def add_holder(entry, delta):
+    holders = entry.setdefault('holders', {})
+    pid = str(os.getpid())
+    count = holders.get(pid, 0) + delta
+    if count > 0:
+        holders[pid] = count
+    else:
+        holders.pop(pid, None)
+
+
+def live_holders(entry):
+    pid = str(os.getpid())
+    return dict((holder, count) for holder, count in entry.get('holders', {}).items()
+                if holder == pid or process_alive(int(holder)))
+
+
+def is_stale(entry, now, ttl):
+    return not live_holders(entry) and now - entry['last_used'] > ttl
@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from .table import BigQueryTestTable, Null, schema_to_json, schema_from_json
+
+
+# Null values, which the API's 'null' strings are parsed to, are stored as
+# this marker so that they come back as Null and not None
+NULL_MARKER = '__bigquerytest_null__'
+
+
+def encode_null(value):
+    if isinstance(value, Null):
+        return {NULL_MARKER: True}
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def decode_null(value):
+    if value.get(NULL_MARKER) is True and len(value) == 1:
+        return Null()
+    return value
+
+
+class QueryResultCache(object):
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, project, sql, use_legacy_sql, mock_table_hashes):
+        m = hashlib.sha1()
+        m.update(json.dumps([project, sql, use_legacy_sql,
+                             sorted(mock_table_hashes)]).encode('utf-8'))
+        return m.hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rb') as f:
+                stored = json.loads(f.read().decode('utf-8'), object_hook=decode_null)
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # bump the modification time so that eviction is least recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return BigQueryTestTable(stored['data'], schema_from_json(stored['schema']))
+
+    def put(self, key, table):
+        stored = {'schema': schema_to_json(table.schema), 'data': table.data}
+        content = json.dumps(stored, separators=(',', ':'), default=encode_null).encode('utf-8')
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                pass
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(content)
+        replace = getattr(os, 'replace', os.rename)
+        replace(tmp_path, self._path(key))
+
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.result.json.gz'):
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.result.json.gz'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.result.json.gz')
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+import time
+from collections import namedtuple
+
+from .table import schema_from_api_resource, table_from_api_response
+
+
+class ResultTooLargeError(Exception):
+    pass
+
+
+# what a dry run job says about a query without running it; referenced
+# tables are 'project.dataset.table' strings
+DryRunResult = namedtuple('DryRunResult', 'referenced_tables schema bytes_processed')
+
+
+def dry_run_from_job_resource(job):
+    statistics = job.get('statistics', {})
+    query = statistics.get('query', {})
+    tables = sorted(set('%s.%s.%s' % (t['projectId'], t['datasetId'], t['tableId'])
+                        for t in query.get('referencedTables', [])))
+    schema = schema_from_api_resource(query.get('schema', {}).get('fields', []))
+    bytes_processed = query.get('totalBytesProcessed', statistics.get('totalBytesProcessed'))
+    return DryRunResult(tables, schema, int(bytes_processed or 0))
+
+
+def row_size(value):
+    if isinstance(value, dict):
+        return sum(row_size(v) for v in value.values())
+    if isinstance(value, list):
+        return sum(row_size(v) for v in value)
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    return len(value.encode('utf-8'))
+
+
+class QueryResultReader(object):
+
+    def __init__(self, client, project, job_id, page_size=None, max_rows=None,
+                 max_bytes=None, waiter=None, prefetch=True, counters=None):
+        self.client = client
+        self.project = project
+        self.job_id = job_id
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.waiter = waiter
+        self.prefetch = prefetch and waiter is not None
+        self.counters = counters
+        self.schema = None
+        self.num_pages = 0
+        self.num_rows = 0
+        self.num_bytes = 0
+
+    def fetch_page(self, page_token=None):
+        params = {}
+        if self.page_size is not None:
+            params['maxResults'] = self.page_size
+        if page_token is not None:
+            params['pageToken'] = page_token
+        path = '/projects/%s/queries/%s' % (self.project, self.job_id)
+        start = time.time()
+        page = self.client._connection.api_request(
+            method='GET', path=path, query_params=params)
+        if self.counters is not None:
+            self.counters.add('fetch_seconds', time.time() - start)
+        return page
+
+    def first_page(self):
+        pages = []
+
+        def job_complete():
+            pages.append(self.fetch_page())
+            return pages[-1].get('jobComplete', True)
+
+        if self.waiter is None:
+            job_complete()
+        else:
+            self.waiter.wait(job_complete, 'query')
+        return pages[-1]
+
+    def pages(self):
+        page = self.first_page()
+        while True:
+            page_token = page.get('pageToken')
+            next_page = None
+            if page_token and self.prefetch:
+                next_page = self.waiter.submit(self.fetch_page, page_token)
+
+            self.num_pages += 1
+            yield page
+
+            if not page_token:
+                return
+            page = next_page.get() if next_page else self.fetch_page(page_token)
+
+    def rows(self):
+        for page in self.pages():
+            if self.schema is None:
+                self.schema = schema_from_api_resource(
+                    page.get('schema', {}).get('fields', []))
+                self._count_query(page)
+                total_rows = int(page.get('totalRows', 0))
+                if self.max_rows is not None and total_rows > self.max_rows:
+                    raise ResultTooLargeError('Query %s returned %d rows, more than %d' % (
+                        self.job_id, total_rows, self.max_rows))
+
+            for row in page.get('rows', ()):
+                self.num_rows += 1
+                if self.max_rows is not None and self.num_rows > self.max_rows:
+                    raise ResultTooLargeError(
+                        'Query %s returned more than %d rows' % (self.job_id, self.max_rows))
+                if self.max_bytes is not None:
+                    self.num_bytes += row_size(row)
+                    if self.num_bytes > self.max_bytes:
+                        raise ResultTooLargeError(
+                            'Query %s returned more than %d bytes' % (self.job_id, self.max_bytes))
+                yield row
+
+    def _count_query(self, page):
+        if self.counters is None:
+            return
+        self.counters.add('queries')
+        self.counters.add('rows_returned', int(page.get('totalRows', 0)))
+        self.counters.add('bytes_processed', int(page.get('totalBytesProcessed', 0)))
+        if page.get('cacheHit'):
+            self.counters.add('cache_hits')
+
+    def read_table(self):
+        if self.max_rows is not None or self.max_bytes is not None:
+            # the limits are checked as rows are read, so read them all now
+            # for the query to fail and not some later use of its result
+            return table_from_api_response(list(self.rows()), self.schema)
+
+        rows = self.rows()
+        try:
+            first_row = next(rows)
+        except StopIteration:
+            return table_from_api_response([], self.schema)
+
+        def all_rows():
+            yield first_row
+            for row in rows:
+                yield row
+
+        return table_from_api_response(all_rows(), self.schema)
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+import re
+
+
+TABLE_REGEX = re.compile(r'''
+    [\[`]?(?:(?P<dataset>[-a-zA-Z0-9_]+)[:.])?
+          (?P<project>[a-zA-Z0-9_]+)\.
+          (?P<table>[a-zA-Z0-9_]+)[\]`]?
+''', re.VERBOSE)
+
+# a single scanner for everything the rewriter needs to tell apart: string
+# literals and comments are emitted untouched, and table references are only
+# recognized at the start of an identifier
+TOKEN_REGEX = re.compile(r'''
+    (?P<string>
+        [rRbB]{0,2}
+        (?: \'\'\'(?:\\.|[^\\])*?\'\'\'
+          | """(?:\\.|[^\\])*?"""
+          | '(?:\\.|[^'\\\n])*'
+          | "(?:\\.|[^"\\\n])*"
+        )
+    )
+  | (?P<comment> --[^\n]* | \#[^\n]* | /\*.*?\*/ )
+  | (?<![-\w$.])(?P<reference>%s)
+''' % TABLE_REGEX.pattern, re.VERBOSE | re.DOTALL)
+
+
+LEADING_WITH_REGEX = re.compile(r'''
+    (?: \s+ | --[^\n]* | \#[^\n]* | /\*.*?\*/ )*
+    WITH\b
+    (?: (?: \s+ | --[^\n]* | \#[^\n]* | /\*.*?\*/ )+ RECURSIVE\b )?
+''', re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+# what can follow a table in a FROM clause other than an alias
+FROM_ITEM_KEYWORDS = [
+    'CROSS', 'EXCEPT', 'FOR', 'FULL', 'GROUP', 'HAVING', 'INNER', 'INTERSECT',
+    'JOIN', 'LEFT', 'LIMIT', 'NATURAL', 'ON', 'ORDER', 'PIVOT', 'QUALIFY',
+    'RIGHT', 'TABLESAMPLE', 'UNION', 'UNPIVOT', 'USING', 'WHERE', 'WINDOW',
+]
+
+ALIAS_REGEX = re.compile(r'''
+    (?: \s+ | --[^\n]* | \#[^\n]* | /\*.*?\*/ )*
+    (?: AS\b | ` | (?!(?:%s)\b)[a-zA-Z_] )
+''' % '|'.join(FROM_ITEM_KEYWORDS), re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+
+def add_ctes(sql, ctes):
+    if not ctes:
+        return sql
+    definitions = ',\n'.join('`%s` AS (%s)' % (name, query) for name, query in ctes)
+    match = LEADING_WITH_REGEX.match(sql)
+    if match:
+        return '%s\n%s,%s' % (sql[:match.end()], definitions, sql[match.end():])
+    return 'WITH %s\n%s' % (definitions, sql)
+
+
+def keep_implicit_alias(replacement, alias):
+    # a replacement that is still known by the replaced table's name,
+    # unless the query gives it an alias of its own
+    def replace(sql, end):
+        if ALIAS_REGEX.match(sql, end):
+            return replacement
+        return '%s AS `%s`' % (replacement, alias)
+    return replace
+
+
+def parse_table_id(table_id, default_project):
+    match = TABLE_REGEX.match(table_id)
+    if not match:
+        raise ValueError('Bad table name: %s' % table_id)
+    project, dataset, table = match.groups()
+    return (project or default_project, dataset, table)
+
+
+def unreplaced_references(sql, table_ids, default_project):
+    # names of the given tables left in a rewritten query, including
+    # spellings the rewriter doesn't recognize like `dataset`.`table` or
+    # dataset . table, outside of string literals and comments
+    code = TOKEN_REGEX.sub(
+        lambda m: m.group() if m.lastgroup == 'reference' else ' ' * len(m.group()), sql)
+    found = []
+    for table_id in sorted(table_ids):
+        _, dataset, table = parse_table_id(table_id, default_project)
+        pattern = r'(?<![-\w$])`?%s`?\s*[.:]\s*`?%s`?(?![-\w$])' % (
+            re.escape(dataset), re.escape(table))
+        found += [m.group() for m in re.finditer(pattern, code)]
+    return found
+
+
+class TableRewriter(object):
+
+    def __init__(self, replacements, default_project):
+        self.default_project = default_project
+        self._lookup = {
+            parse_table_id(table_id, default_project): replacement
+            for table_id, replacement in replacements.items()
+        }
+
+    def references(self, sql):
+        for match in TOKEN_REGEX.finditer(sql):
+            if match.lastgroup == 'reference':
+                project, dataset, table = match.group(
+                    'dataset', 'project', 'table')
+                yield (project or self.default_project, dataset, table), match
+
+    def rewrite(self, sql, on_replace=None):
+        if not self._lookup:
+            return sql
+
+        parts = []
+        position = 0
+        for key, match in self.references(sql):
+            replacement = self._lookup.get(key)
+            if replacement is None:
+                continue
+            start, end = match.span('reference')
+            parts.append(sql[position:start])
+            parts.append(replacement(sql, end) if callable(replacement) else replacement)
+            position = end
+            if on_replace is not None:
+                on_replace(sql[start:end])
+
+        parts.append(sql[position:])
+        return ''.join(parts)
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .table import schema_to_json, schema_from_json
+
+
+class SchemaCache(object):
+
+    def __init__(self, directory=None, ttl=None, max_entries=1024,
+                 clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        key = tuple(key)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = self._read(key)
+            if entry is None or self._expired(entry):
+                return None
+            self._entries[key] = entry
+            self._evict()
+            return entry[1]
+
+    def put(self, key, schema):
+        key = tuple(key)
+        entry = (self.clock(), schema)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._evict()
+            self._write(key, entry)
+
+    def get_or_load(self, key, load):
+        schema = self.get(key)
+        if schema is not None:
+            self.hits += 1
+            return schema
+        self.misses += 1
+        schema = load()
+        self.put(key, schema)
+        return schema
+
+    def invalidate(self, key):
+        key = tuple(key)
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.directory:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            if self.directory and os.path.isdir(self.directory):
+                for filename in os.listdir(self.directory):
+                    if filename.endswith('.schema.json'):
+                        try:
+                            os.remove(os.path.join(self.directory, filename))
+                        except OSError:
+                            pass
+        return keys
+
+    def _expired(self, entry):
+        return self.ttl is not None and self.clock() - entry[0] > self.ttl
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        digest = hashlib.md5(json.dumps(list(key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.schema.json')
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if tuple(stored['key']) != key:
+            return None
+        return stored['created'], schema_from_json(stored['schema'])
+
+    def _write(self, key, entry):
+        if not self.directory:
+            return
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                pass
+        created, schema = entry
+        stored = {'key': list(key), 'created': created,
+                  'schema': schema_to_json(schema)}
+
+        # write to a temporary file and rename, so that concurrent
+        # processes never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stored, f)
+        replace = getattr(os, 'replace', os.rename)
+        replace(tmp_path, self._path(key))
+
+
+default_schema_cache = SchemaCache(
+    directory=os.environ.get('BIGQUERYTEST_SCHEMA_CACHE_DIR') or None,
+    ttl=float(os.environ.get('BIGQUERYTEST_SCHEMA_CACHE_TTL', 24 * 60 * 60)))
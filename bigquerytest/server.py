@@ -0,0 +1,547 @@
+from __future__ import absolute_import
+import argparse
+import email
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from .local import Engine, LocalSqlError, normalize_schema
+from .table import (
+    BigQueryTestTable,
+    api_response_from_records,
+    json_default,
+    schema_from_api_resource,
+    schema_to_api_resource,
+)
+
+
+API_PREFIX = '/bigquery/v2'
+UPLOAD_PREFIX = '/upload/bigquery/v2'
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message, reason=None):
+        super(ApiError, self).__init__(message)
+        self.status = status
+        self.reason = reason or {400: 'invalid', 404: 'notFound', 409: 'duplicate'}.get(
+            status, 'backendError')
+
+    def resource(self):
+        message = '%s' % self
+        return {'error': {'code': self.status, 'message': message, 'errors': [
+            {'reason': self.reason, 'message': message}]}}
+
+
+class Failure(object):
+
+    def __init__(self, count, status, method, path):
+        self.count = count
+        self.status = status
+        self.method = method
+        self.path = re.compile(path) if path else None
+
+    def matches(self, method, path):
+        return (self.method is None or self.method == method) and \
+            (self.path is None or self.path.search(path))
+
+
+class FakeBigQueryServer(object):
+    """
+    In-memory stand-in for the parts of the BigQuery REST API that
+    bigquerytest uses. Queries run on the local SQL engine.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0,
+                 job_polls=0, page_size=10000, seed=None, sleep=time.sleep):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.job_polls = job_polls
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.tables = {}
+        self.datasets = set()
+        self.creation_times = {}
+        self.jobs = {}
+        self.requests = []
+        self._failures = []
+        self._job_ids = itertools.count()
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._log = logging.getLogger('bigquerytest')
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.host, self._server.server_address[1])
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_table(self, table_id, schema, records=(), created=None):
+        key = tuple(table_id.strip('`').replace(':', '.').split('.'))
+        with self._lock:
+            self.tables[key] = BigQueryTestTable(list(records), normalize_schema(schema))
+            self.creation_times[key] = time.time() if created is None else created
+
+    def fail_next(self, count=1, status=500, method=None, path=None):
+        with self._lock:
+            self._failures.append(Failure(count, status, method, path))
+
+    def count(self, method=None, path=None):
+        return len([r for r in self.requests
+                    if (method is None or r[0] == method) and
+                    (path is None or re.search(path, r[1]))])
+
+    def handle(self, method, url, body, headers):
+        parsed = urlparse(url)
+        path = parsed.path
+        params = dict((k, v[-1]) for k, v in parse_qs(parsed.query).items())
+        with self._lock:
+            self.requests.append((method, path))
+
+        latency = self.latency(method, path) if callable(self.latency) else self.latency
+        if latency:
+            self.sleep(latency)
+
+        try:
+            self.inject_failure(method, path)
+            if path.startswith(UPLOAD_PREFIX):
+                return 200, self.upload(path[len(UPLOAD_PREFIX):], body, headers)
+            if not path.startswith(API_PREFIX):
+                raise ApiError(404, 'Not found: %s' % path)
+            return self.route(method, path[len(API_PREFIX):], params, body)
+        except ApiError as e:
+            return e.status, e.resource()
+
+    def inject_failure(self, method, path):
+        with self._lock:
+            for failure in self._failures:
+                if failure.count > 0 and failure.matches(method, path):
+                    failure.count -= 1
+                    raise ApiError(failure.status, 'Injected failure: %s %s' % (method, path))
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                raise ApiError(503, 'Injected failure: %s %s' % (method, path))
+
+    def route(self, method, path, params, body):
+        parts = path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'projects':
+            raise ApiError(404, 'Not found: %s' % path)
+        project = parts[1]
+        rest = parts[2:]
+
+        if rest[:1] == ['queries']:
+            if method == 'POST' and len(rest) == 1:
+                return 200, self.run_query(project, json.loads(body))
+            if method == 'GET' and len(rest) == 2:
+                return 200, self.query_results(project, rest[1], params)
+        elif rest[:1] == ['jobs'] and method == 'GET' and len(rest) == 2:
+            return 200, self.get_job(rest[1])
+        elif rest[:1] == ['jobs'] and method == 'POST' and len(rest) == 1:
+            return 200, self.insert_job(project, json.loads(body))
+        elif rest[:1] == ['datasets'] and len(rest) == 1 and method == 'POST':
+            return 200, self.create_dataset(project, json.loads(body))
+        elif rest[:1] == ['datasets'] and len(rest) == 2 and method == 'GET':
+            return 200, self.dataset_resource(project, rest[1])
+        elif rest[:1] == ['datasets'] and len(rest) >= 3 and rest[2] == 'tables':
+            dataset = rest[1]
+            if len(rest) == 3:
+                if method == 'GET':
+                    return 200, self.list_tables(project, dataset, params)
+                if method == 'POST':
+                    return 200, self.create_table(project, dataset, json.loads(body))
+            elif len(rest) == 4:
+                key = (project, dataset, rest[3])
+                if method == 'GET':
+                    return 200, self.table_resource(key)
+                if method == 'DELETE':
+                    self.delete_table(key)
+                    return 204, None
+
+        raise ApiError(404, 'Not found: %s %s' % (method, path))
+
+    # datasets, which exist once created or once they have a table
+
+    def dataset_resource(self, project, dataset):
+        with self._lock:
+            exists = (project, dataset) in self.datasets or any(
+                (p, d) == (project, dataset) for (p, d, _) in self.tables)
+        if not exists:
+            raise ApiError(404, 'Not found: Dataset %s:%s' % (project, dataset))
+        return {
+            'kind': 'bigquery#dataset',
+            'id': '%s:%s' % (project, dataset),
+            'datasetReference': {'projectId': project, 'datasetId': dataset},
+        }
+
+    def create_dataset(self, project, resource):
+        dataset = resource['datasetReference']['datasetId']
+        with self._lock:
+            if (project, dataset) in self.datasets:
+                raise ApiError(409, 'Already Exists: Dataset %s:%s' % (project, dataset))
+            self.datasets.add((project, dataset))
+        return self.dataset_resource(project, dataset)
+
+    # tables
+
+    def table_resource(self, key):
+        with self._lock:
+            if key not in self.tables:
+                raise ApiError(404, 'Not found: Table %s:%s.%s' % key)
+            table = self.tables[key]
+            created = self.creation_times.get(key)
+        project, dataset, name = key
+        resource = {
+            'kind': 'bigquery#table',
+            'id': '%s:%s.%s' % key,
+            'tableReference': {'projectId': project, 'datasetId': dataset, 'tableId': name},
+            'type': 'TABLE',
+            'schema': {'fields': schema_to_api_resource(table.schema)},
+            'numRows': str(len(table.data)),
+        }
+        if created is not None:
+            resource['creationTime'] = str(int(created * 1000))
+        return resource
+
+    def create_table(self, project, dataset, resource):
+        name = resource['tableReference']['tableId']
+        key = (project, dataset, name)
+        schema = schema_from_api_resource(resource.get('schema', {}).get('fields', []))
+        with self._lock:
+            if key in self.tables:
+                raise ApiError(409, 'Already Exists: Table %s:%s.%s' % key)
+            self.tables[key] = BigQueryTestTable([], schema)
+            self.creation_times[key] = time.time()
+        return self.table_resource(key)
+
+    def delete_table(self, key):
+        with self._lock:
+            if self.tables.pop(key, None) is None:
+                raise ApiError(404, 'Not found: Table %s:%s.%s' % key)
+            self.creation_times.pop(key, None)
+
+    def list_tables(self, project, dataset, params):
+        with self._lock:
+            names = sorted(name for (p, d, name) in self.tables if (p, d) == (project, dataset))
+            creation_times = dict(self.creation_times)
+        start = int(params.get('pageToken', 0))
+        page_size = int(params.get('maxResults', self.page_size))
+        response = {'tables': [
+            {'kind': 'bigquery#table',
+             'id': '%s:%s.%s' % (project, dataset, name),
+             'tableReference': {'projectId': project, 'datasetId': dataset, 'tableId': name},
+             'type': 'TABLE',
+             'creationTime': str(int(creation_times.get((project, dataset, name), 0) * 1000))}
+            for name in names[start:start + page_size]]}
+        if start + page_size < len(names):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+    # jobs
+
+    def new_job(self, project, job):
+        with self._lock:
+            job_id = 'job_%d' % next(self._job_ids)
+            job.update(projectId=project, jobId=job_id, polls=self.job_polls)
+            self.jobs[job_id] = job
+        return job
+
+    def poll(self, job):
+        with self._lock:
+            if job['polls'] > 0:
+                job['polls'] -= 1
+                return False
+            return True
+
+    def upload(self, path, body, headers):
+        project = path.strip('/').split('/')[1]
+        metadata, data = parse_multipart(body, headers.get('content-type'))
+        load = metadata['configuration']['load']
+        destination = load['destinationTable']
+        key = (destination['projectId'], destination['datasetId'], destination['tableId'])
+        records = [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+
+        with self._lock:
+            if key not in self.tables:
+                raise ApiError(404, 'Not found: Table %s:%s.%s' % key)
+            table = self.tables[key]
+            table.data = table.data + records
+
+        job = self.new_job(project, {'configuration': {'load': load}})
+        return self.job_resource(job, 'RUNNING' if job['polls'] else 'DONE')
+
+    def get_job(self, job_id):
+        if job_id not in self.jobs:
+            raise ApiError(404, 'Not found: Job %s' % job_id)
+        job = self.jobs[job_id]
+        return self.job_resource(job, 'DONE' if self.poll(job) else 'RUNNING')
+
+    def job_resource(self, job, state):
+        resource = {
+            'kind': 'bigquery#job',
+            'id': '%s:%s' % (job['projectId'], job['jobId']),
+            'jobReference': {'projectId': job['projectId'], 'jobId': job['jobId']},
+            'configuration': job['configuration'],
+            'status': {'state': state},
+        }
+        if 'bytes_processed' in job and state == 'DONE':
+            resource['statistics'] = {'query': {
+                'totalBytesProcessed': str(job['bytes_processed']),
+                'totalBytesBilled': str(bytes_billed(job['bytes_processed'])),
+            }}
+        return resource
+
+    def insert_job(self, project, resource):
+        # only dry runs, which plan a query without creating a job
+        configuration = resource.get('configuration', {})
+        query = configuration.get('query')
+        if not configuration.get('dryRun') or query is None:
+            raise ApiError(400, 'Only dry run query jobs are supported', 'invalid')
+        if query.get('useLegacySql'):
+            raise ApiError(400, 'Legacy SQL is not supported', 'invalidQuery')
+        scanned = {}
+
+        def resolve(path):
+            key = self.table_key(project, path)
+            table = self.resolve_table(project, path)
+            scanned[key] = len(json.dumps(table.data, default=json_default))
+            return table
+
+        try:
+            result = Engine(resolve, lambda *args: None, lambda *args: None).execute(
+                query['query'])
+        except LocalSqlError as e:
+            raise ApiError(400, '%s' % e, 'invalidQuery')
+
+        bytes_processed = str(sum(scanned.values()))
+        return {
+            'kind': 'bigquery#job',
+            'configuration': configuration,
+            'status': {'state': 'DONE'},
+            'statistics': {
+                'totalBytesProcessed': bytes_processed,
+                'query': {
+                    'totalBytesProcessed': bytes_processed,
+                    'referencedTables': [
+                        {'projectId': p, 'datasetId': d, 'tableId': t}
+                        for p, d, t in sorted(scanned)],
+                    'schema': {'fields': schema_to_api_resource(result.schema)},
+                },
+            },
+        }
+
+    # queries
+
+    def run_query(self, project, resource):
+        if resource.get('useLegacySql'):
+            raise ApiError(400, 'Legacy SQL is not supported', 'invalidQuery')
+        scanned = []
+
+        def resolve(path):
+            table = self.resolve_table(project, path)
+            scanned.append(len(json.dumps(table.data, default=json_default)))
+            return table
+
+        try:
+            result = Engine(
+                resolve,
+                lambda path, table, if_not_exists, replace: self.create_table_from_query(
+                    project, path, table, if_not_exists, replace),
+                lambda path, if_exists: self.drop_table_from_query(project, path, if_exists),
+            ).execute(resource['query'])
+        except LocalSqlError as e:
+            raise ApiError(400, '%s' % e, 'invalidQuery')
+
+        job = self.new_job(project, {
+            'configuration': {'query': {'query': resource['query']}},
+            'result': result,
+            'bytes_processed': sum(scanned),
+        })
+        params = {}
+        if 'maxResults' in resource:
+            params['maxResults'] = resource['maxResults']
+        return self.query_page(job, params, self.poll(job))
+
+    def table_key(self, project, path):
+        if len(path) == 3:
+            return tuple(path)
+        if len(path) == 2:
+            return (project,) + tuple(path)
+        raise LocalSqlError('Table name must be qualified with a dataset: %s' % path[-1])
+
+    def resolve_table(self, project, path):
+        key = self.table_key(project, path)
+        with self._lock:
+            if key not in self.tables:
+                raise LocalSqlError('Not found: Table %s:%s.%s' % key)
+            return self.tables[key]
+
+    def create_table_from_query(self, project, path, table, if_not_exists, replace):
+        key = self.table_key(project, path)
+        with self._lock:
+            if key in self.tables and not replace:
+                if if_not_exists:
+                    return
+                raise LocalSqlError('Already Exists: Table %s:%s.%s' % key)
+            self.tables[key] = table
+            self.creation_times[key] = time.time()
+
+    def drop_table_from_query(self, project, path, if_exists):
+        key = self.table_key(project, path)
+        with self._lock:
+            if key not in self.tables:
+                if if_exists:
+                    return
+                raise LocalSqlError('Not found: Table %s:%s.%s' % key)
+            del self.tables[key]
+            self.creation_times.pop(key, None)
+
+    def query_results(self, project, job_id, params):
+        if job_id not in self.jobs:
+            raise ApiError(404, 'Not found: Job %s' % job_id)
+        job = self.jobs[job_id]
+        return self.query_page(job, params, self.poll(job))
+
+    def query_page(self, job, params, complete):
+        response = {
+            'kind': 'bigquery#getQueryResultsResponse',
+            'jobReference': {'projectId': job['projectId'], 'jobId': job['jobId']},
+            'jobComplete': complete,
+        }
+        if not complete:
+            return response
+
+        result = job['result']
+        start = int(params.get('pageToken', 0))
+        page_size = int(params.get('maxResults', self.page_size))
+        records = result.data[start:start + page_size]
+        response.update({
+            'schema': {'fields': schema_to_api_resource(result.schema)},
+            'totalRows': str(len(result.data)),
+            'totalBytesProcessed': str(job['bytes_processed']),
+            'cacheHit': False,
+            'rows': api_response_from_records(records, result.schema),
+        })
+        if start + page_size < len(result.data):
+            response['pageToken'] = str(start + page_size)
+        return response
+
+
+def bytes_billed(bytes_processed):
+    # rounded up to the next megabyte, with a minimum of 10 MB per query
+    if not bytes_processed:
+        return 0
+    megabyte = 1024 * 1024
+    return max(10 * megabyte, -(-bytes_processed // megabyte) * megabyte)
+
+
+def parse_multipart(body, content_type):
+    message = email.message_from_string(
+        'Content-Type: %s\r\n\r\n' % content_type + body.decode('latin-1'))
+    parts = message.get_payload()
+    metadata = json.loads(parts[0].get_payload())
+    data = parts[1].get_payload().encode('latin-1')
+    return metadata, data
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    def handle_request(self, method):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+        status, response = self.server.fake.handle(method, self.path, body, headers)
+
+        content = json.dumps(response).encode('utf-8') if response is not None else b''
+        self.send_response(status)
+        if content:
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def log_message(self, format, *args):
+        logging.getLogger('bigquerytest').debug(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake BigQuery REST API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9050)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before answering each request')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of requests that fail with 503')
+    parser.add_argument('--job-polls', type=int, default=0,
+                        help='number of polls before a job is done')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--schemas',
+                        help='JSON file mapping table ids to schema fields')
+    args = parser.parse_args()
+
+    server = FakeBigQueryServer(
+        args.host, args.port, latency=args.latency, failure_rate=args.failure_rate,
+        job_polls=args.job_polls, seed=args.seed)
+    if args.schemas:
+        with open(args.schemas) as f:
+            for table_id, schema in json.load(f).items():
+                server.add_table(table_id, schema)
+
+    server.start()
+    print('Serving on %s' % server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
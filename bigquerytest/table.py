@@ -5,6 +5,8 @@ import re
 from collections import namedtuple
 from google.cloud import bigquery
 
+from .columnar import ColumnarRecords
+
 
 class Null(object):
     pass
@@ -28,31 +30,138 @@ PRIMITIVE_CONVERTERS = {
 SUPPORTED_TYPES = set(PRIMITIVE_CONVERTERS) | set(["record"])
 
 
+class LazyRecords(object):
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __iter__(self):
+        return self.function(*self.args)
+
+
 class BigQueryTestTable(object):
 
     def __init__(self, data, schema):
         self.data = data
         self.schema = schema
 
+    @property
+    def schema(self):
+        return self._schema
+
+    @schema.setter
+    def schema(self, schema):
+        self._schema = schema
+
+    @property
+    def data(self):
+        if self._records is None:
+            self._records = list(self.iter_records())
+        return self._records
+
+    @data.setter
+    def data(self, data):
+        if isinstance(data, list):
+            self._records = data
+            self._source = None
+        else:
+            self._records = None
+            self._source = data
+            # single-use iterators are cached as they are consumed, re-iterable
+            # sources are iterated afresh every time
+            self._consumed = [] if iter(data) is data else None
+
+    def is_materialized(self):
+        return self._records is not None
+
+    def is_columnar(self):
+        return self._records is None and isinstance(self._source, ColumnarRecords)
+
+    def to_columnar(self):
+        # tables that can't be encoded losslessly stay as they are
+        if self.is_columnar():
+            return self
+        records = ColumnarRecords.from_records(self.iter_records(), self.schema)
+        if records is None:
+            return self
+        return BigQueryTestTable(records, self.schema)
+
+    def columns_equal(self, other):
+        # equal columns decode to equal records
+        return (self.is_columnar() and other.is_columnar() and
+                self.schema == other.schema and self._source == other._source)
+
+    def iter_records(self):
+        if self._records is not None:
+            return iter(self._records)
+        if self._consumed is None:
+            return iter(self._source)
+        return self._iter_consuming()
+
+    def _iter_consuming(self):
+        i = 0
+        while True:
+            if i < len(self._consumed):
+                yield self._consumed[i]
+                i += 1
+            elif self._records is not None:
+                return
+            else:
+                try:
+                    record = next(self._source)
+                except StopIteration:
+                    self._records = self._consumed
+                    return
+                self._consumed.append(record)
+
     def prettyprint(self, column_widths=None, min_space=2):
         return table_prettyprint(self.flatten(), column_widths, min_space)
 
+    def write_prettyprint(self, sink, column_widths=None, min_space=2):
+        if column_widths is None:
+            column_widths = get_column_widths(self.iter_flat())
+        write_table_prettyprint(self.iter_flat(), sink, column_widths, min_space)
+
     def flatten(self):
-        return flatten_table(self.data, self.schema)
+        return flatten_table(self.iter_records(), self.schema)
+
+    def iter_flat(self):
+        return iter_flatten_table(self.iter_records(), self.schema)
 
     def get_column_names(self):
         return columns_from_schema(self.schema)
 
     def get_hash(self):
-        m = hashlib.md5()
-        m.update(json.dumps(self.data, sort_keys=True) +
-                 json.dumps(self.schema, sort_keys=True))
-        return re.sub('[^a-zA-Z0-9]', '', base64.b64encode(m.hexdigest()))[:20]
+        # not cached, records can be modified in place. Tables from the
+        # definition cache have frozen records and cache it there
+        return table_hash(self.iter_records(), self.schema)
 
     def get_bigquery_schema(self):
         return bigquery_schema_from_schema(self.schema)
 
 
+def json_default(value):
+    if isinstance(value, Null):
+        return None
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def table_hash(records, schema):
+    # hashes the same bytes as json.dumps(records, sort_keys=True), one
+    # record at a time, so that table names don't change between versions
+    m = hashlib.md5()
+    separator = b'['
+    for record in records:
+        m.update(separator)
+        m.update(json.dumps(record, sort_keys=True, default=json_default).encode('utf-8'))
+        separator = b', '
+    m.update(b'[]' if separator == b'[' else b']')
+    m.update(json.dumps(schema, sort_keys=True).encode('utf-8'))
+    digest = base64.b64encode(m.hexdigest().encode('ascii')).decode('ascii')
+    return re.sub('[^a-zA-Z0-9]', '', digest)[:20]
+
+
 BigQueryTestSchemaField = namedtuple('BigQueryTestSchemaField', 'name type long_name subfields nullable repeated is_repeated_branch')
 
 
@@ -71,6 +180,23 @@ def schema_from_bigquery_schema(bq_fields, prefix='', is_repeated_branch=False):
     ]
 
 
+def schema_from_api_resource(fields, prefix='', is_repeated_branch=False):
+    schema = []
+    for f in fields:
+        mode = f.get('mode', 'NULLABLE')
+        repeated_branch = is_repeated_branch or mode == 'REPEATED'
+        schema.append(BigQueryTestSchemaField(
+            f['name'],
+            f['type'].lower(),
+            prefix + f['name'],
+            schema_from_api_resource(f['fields'], prefix + f['name'] + '.', repeated_branch) if f.get('fields') else None,
+            mode == 'NULLABLE',
+            mode == 'REPEATED',
+            repeated_branch
+        ))
+    return schema
+
+
 def bigquery_schema_from_schema(fields):
     return [
         bigquery.table.SchemaField(
@@ -83,20 +209,34 @@ def bigquery_schema_from_schema(fields):
     ]
 
 
-def table_from_executed_query(query):
-    # until google fixes https://github.com/GoogleCloudPlatform/google-cloud-python/issues/2354
-    response = query.__dict__['_properties']['rows']
-    schema = schema_from_bigquery_schema(query.schema)
-    return table_from_api_response(response, schema)
+def schema_to_json(fields):
+    return [
+        dict(f._asdict(), subfields=schema_to_json(f.subfields) if f.subfields else None)
+        for f in fields
+    ]
+
+
+def schema_from_json(fields):
+    return [
+        BigQueryTestSchemaField(**dict(
+            f, subfields=schema_from_json(f['subfields']) if f['subfields'] else None))
+        for f in fields
+    ]
 
 
 def table_from_api_response(response, schema):
-    records = []
-    for row in response:
-        records.append(parse_api_response_fields(row['f'], schema))
+    if isinstance(response, (list, tuple)):
+        records = LazyRecords(iter_records_from_api_response, response, schema)
+    else:
+        records = iter_records_from_api_response(response, schema)
     return BigQueryTestTable(records, schema)
 
 
+def iter_records_from_api_response(response, schema):
+    for row in response:
+        yield parse_api_response_fields(row['f'], schema)
+
+
 def parse_api_response_fields(record_fields, schema_fields):
     return {
         field.name: parse_api_response_value(value['v'], field)
@@ -107,6 +247,8 @@ def parse_api_response_fields(record_fields, schema_fields):
 
 def parse_api_response_value(value, field):
     if field.type in PRIMITIVE_CONVERTERS:
+        if field.repeated and isinstance(value, list):
+            return [PRIMITIVE_CONVERTERS[field.type](v['v']) for v in value]
         return PRIMITIVE_CONVERTERS[field.type](value)
     elif field.type == 'record':
         if field.repeated:
@@ -118,8 +260,42 @@ def parse_api_response_value(value, field):
         raise ValueError('Unsupported data type: %s' % field.type)
 
 
+def schema_to_api_resource(fields):
+    return [
+        dict({'name': f.name,
+              'type': f.type.upper(),
+              'mode': 'NULLABLE' if f.nullable else 'REPEATED' if f.repeated else 'REQUIRED'},
+             **({'fields': schema_to_api_resource(f.subfields)} if f.subfields else {}))
+        for f in fields
+    ]
+
+
+def api_response_from_records(records, schema):
+    return [api_response_fields(record, schema) for record in records]
+
+
+def api_response_fields(record, schema_fields):
+    return {'f': [{'v': api_response_value(record.get(field.name), field)}
+                  for field in schema_fields]}
+
+
+def api_response_value(value, field):
+    if field.repeated:
+        return [{'v': api_response_value(v, field._replace(repeated=False))}
+                for v in value or []]
+    if value is None or isinstance(value, Null):
+        return None
+    if field.type == 'record':
+        return api_response_fields(value, field.subfields)
+    if field.type == 'boolean':
+        return 'true' if value else 'false'
+    if field.type == 'float':
+        return repr(float(value))
+    return '%s' % value
+
+
 def table_from_definition_string(table_definition, schema):
-    columns = None
+    plan = None
     records = []
     record = None
     for row in table_definition.strip('\n').splitlines():
@@ -131,17 +307,19 @@ def table_from_definition_string(table_definition, schema):
         if '\t' in row:
             raise ValueError('Please use spaces instead of tabs')
 
-        if columns is None:
+        if plan is None:
             columns, offsets = parse_column_header(row)
             schema = narrow_fields_to_columns(schema, columns)
+            row_parser = RowParser(columns, offsets)
+            plan = RecordPlan(schema)
         else:
-            parsed_row = parse_row(row, columns, offsets)
-            if is_new_record(schema, parsed_row):
+            parsed_row = row_parser.parse(row)
+            if plan.is_new_record(parsed_row):
                 if record is not None:
                     records.append(record)
                 record = {}
 
-            update_record(schema, parsed_row, record)
+            plan.update(parsed_row, record)
 
     if record:
         records.append(record)
@@ -185,33 +363,45 @@ def parse_column_header(row):
     return columns, offsets
 
 
-def parse_row(row, columns, offsets):
-    parsed_row = {}
+class RowParser(object):
 
-    header = ''
-    for column, offset in zip(columns, offsets):
-        header += ' ' * (offset - len(header)) + column
+    # column slices are computed once per header, so that each row is
+    # parsed in a single pass over its columns
 
-    for i, (column, start) in enumerate(zip(columns, offsets)):
+    def __init__(self, columns, offsets):
+        self.columns = columns
+        self.offsets = offsets
+        ends = list(offsets[1:]) + [None]
+        self.slots = list(zip(columns, offsets, ends))
 
-        if start >= len(row):
-            break
+    def parse(self, row):
+        parsed_row = {}
+        length = len(row)
+        for column, start, end in self.slots:
+            if start >= length:
+                break
 
-        if i == len(offsets) - 1:
-            value = row[start:len(row)]
-        else:
-            value = row[start:offsets[i + 1]]
-            if len(row) > offsets[i + 1] and value[-1] != ' ':
-                raise ValueError('Values do not line up with columns: \n%s\n%s' % (header, row))
+            value = row[start:end]
+            if end is not None and length > end and value[-1] != ' ':
+                self._misaligned(row)
+            if value[0] == ' ' and value.strip():
+                self._misaligned(row)
+
+            value = value.strip()
+            if value:
+                parsed_row[column] = value
 
-        if value[0] == ' ' and value.strip():
-            raise ValueError('Values do not line up with columns: \n%s\n%s' % (header, row))
+        return parsed_row
 
-        value = value.strip()
-        if value:
-            parsed_row[column] = value
+    def _misaligned(self, row):
+        header = ''
+        for column, offset in zip(self.columns, self.offsets):
+            header += ' ' * (offset - len(header)) + column
+        raise ValueError('Values do not line up with columns: \n%s\n%s' % (header, row))
 
-    return parsed_row
+
+def parse_row(row, columns, offsets):
+    return RowParser(columns, offsets).parse(row)
 
 
 def is_new_record(schema, parsed_row):
@@ -223,41 +413,83 @@ def is_new_record(schema, parsed_row):
     ])
 
 
-def update_record(schema, parsed_row, record):
-    for field in schema:
-        update_record_for_field(field, parsed_row, record)
+def record_key_leaves(schema):
+    # a row starts a new record when all of these columns have values
+    return tuple(f.long_name for f in schema_leaves(schema)
+                 if f.type != 'record' and not f.is_repeated_branch)
 
 
-def update_record_for_field(field, parsed_row, record):
-    if field.type not in SUPPORTED_TYPES:
-        raise ValueError('Field type not supported: %s' % field.type)
+class FieldPlan(object):
 
-    value = None
-    append = True
-    if field.long_name in parsed_row:
-        if field.type in PRIMITIVE_CONVERTERS:
-            value = PRIMITIVE_CONVERTERS[field.type](parsed_row[field.long_name])
+    __slots__ = ['field', 'convert', 'subfields', 'key_leaves']
 
-    if field.type == 'record':
+    def __init__(self, field):
+        self.field = field
+        self.convert = PRIMITIVE_CONVERTERS.get(field.type)
+        if field.type == 'record':
+            self.subfields = [FieldPlan(f) for f in field.subfields]
+            self.key_leaves = record_key_leaves(field.subfields)
+        else:
+            self.subfields = None
+            self.key_leaves = None
+
+    def update(self, parsed_row, record):
+        field = self.field
+        if self.convert is None and self.subfields is None:
+            raise ValueError('Field type not supported: %s' % field.type)
+
+        if self.subfields is None:
+            if field.long_name not in parsed_row:
+                return
+            value = self.convert(parsed_row[field.long_name])
+            if value:
+                if field.repeated:
+                    record.setdefault(field.name, []).append(value)
+                else:
+                    record[field.name] = value
+            return
+
+        new = True
         if field.repeated:
-            if is_new_record(field.subfields, parsed_row) or not record.get(field.name):
-                value = {}
+            values = record.get(field.name)
+            if values and not all([l in parsed_row for l in self.key_leaves]):
+                value = values[-1]
+                new = False
             else:
-                value = record[field.name][-1]
-                append = False
+                value = {}
         else:
             value = record.get(field.name, {})
-        for f in field.subfields:
-            update_record_for_field(f, parsed_row, value)
 
-    if value:
-        if field.repeated:
-            if append:
-                record[field.name] = record.get(field.name, []) + [value]
+        for subfield in self.subfields:
+            subfield.update(parsed_row, value)
+
+        if value and new:
+            if field.repeated:
+                record.setdefault(field.name, []).append(value)
             else:
-                record[field.name][-1] = value
-        else:
-            record[field.name] = value
+                record[field.name] = value
+
+
+class RecordPlan(object):
+
+    def __init__(self, schema):
+        self.fields = [FieldPlan(f) for f in schema]
+        self.key_leaves = record_key_leaves(schema)
+
+    def is_new_record(self, parsed_row):
+        return all([l in parsed_row for l in self.key_leaves])
+
+    def update(self, parsed_row, record):
+        for field in self.fields:
+            field.update(parsed_row, record)
+
+
+def update_record(schema, parsed_row, record):
+    RecordPlan(schema).update(parsed_row, record)
+
+
+def update_record_for_field(field, parsed_row, record):
+    FieldPlan(field).update(parsed_row, record)
 
 
 def schema_leaves(fields):
@@ -304,35 +536,57 @@ def flatten_composite_record(record, fields, prefix, column_map, flat, index):
 
 
 def flatten_table(table, schema):
-    flat = []
+    return list(iter_flatten_table(table, schema))
+
+
+def iter_flatten_table(table, schema):
     columns = columns_from_schema(schema)
     column_map = {c: i for i, c in enumerate(columns)}
-    flat.append(columns)
+    yield columns
 
-    index = 1
+    # every record occupies its own block of rows, so records can be
+    # flattened one at a time
     for record in table:
-        index = max(flatten_composite_record(record, schema, '', column_map,
-                                             flat, index), index + 1)
-    return flat
+        flat = []
+        num_rows = max(flatten_composite_record(record, schema, '', column_map,
+                                                flat, 0), 1)
+        for row in flat:
+            yield row
+        for _ in range(num_rows - len(flat)):
+            yield [None] * len(columns)
 
 
 def get_column_widths(flat):
-    widths = [len(s) for s in flat[0]]
-    for row in flat[1:]:
+    rows = iter(flat)
+    widths = [len(s) for s in next(rows)]
+    for row in rows:
         for i, s in enumerate(row):
             if s and len('%s' % s) > widths[i]:
                 widths[i] = len('%s' % s)
     return widths
 
 
+def iter_table_prettyprint(flat, column_widths, min_space=2):
+    separator = ' ' * min_space
+    formats = ['%%-%ds' % w for w in column_widths]
+    for row in flat:
+        yield separator.join([
+            f % (s if s is not None else '')
+            for f, s in zip(formats, row)]).rstrip()
+
+
 def table_prettyprint(flat, column_widths=None, min_space=2):
     if column_widths is None:
+        # the widths need a pass over the rows before they are printed
+        if iter(flat) is flat:
+            flat = list(flat)
         column_widths = get_column_widths(flat)
 
-    rows = []
-    for row in flat:
-        rows.append((' ' * min_space).join([
-            ('%%-%ds' % w) % (s if s is not None else '')
-            for w, s in zip(column_widths, row)]).rstrip())
+    return '\n'.join(iter_table_prettyprint(flat, column_widths, min_space))
+
 
-    return '\n'.join(rows)
+def write_table_prettyprint(flat, sink, column_widths, min_space=2):
+    for i, line in enumerate(iter_table_prettyprint(flat, column_widths, min_space)):
+        if i > 0:
+            sink.write('\n')
+        sink.write(line)
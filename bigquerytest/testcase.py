@@ -1,31 +1,56 @@
 from __future__ import absolute_import
 import logging
-import json
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-import re
-import time
+import os
 import unittest
-from google.cloud import bigquery
 
+from .backend import BigQueryBackend
+from .clients import default_client_pool
 from .table import (
     table_from_definition_string,
-    table_from_executed_query,
-    schema_from_bigquery_schema,
     BigQueryTestTable,
-    get_column_widths
 )
+from .compare import (
+    diff_flat_tables,
+    diff_keyed_records,
+    diff_unordered_records,
+    string_types
+)
+from .definition_cache import default_definition_cache
+from .literals import table_literal
+from .metrics import default_metrics, no_phase
+from .parallel import default_table_leases, worker_id
+from .results import QueryResultReader
+from .rewrite import (
+    TABLE_REGEX,
+    TableRewriter,
+    add_ctes,
+    keep_implicit_alias,
+    parse_table_id,
+    unreplaced_references,
+)
+from .schema_cache import default_schema_cache
+from .wait import default_waiter
+
+
+class MockTableError(Exception):
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(MockTableError, self).__init__(
+            'Failed to mock %d table(s):\n%s' % (len(errors), '\n'.join([
+                '  %s: %s' % (table_id, error) for table_id, error in errors])))
 
 
 class BigQueryTestCase(unittest.TestCase):
 
-    TABLE_REGEX = re.compile(r'''
-        [\[`]?(?:(?P<dataset>[-a-zA-Z0-9_]+)[:.])?
-              (?P<project>[a-zA-Z0-9_]+)\.
-              (?P<table>[a-zA-Z0-9_]+)[\]`]?
-    ''', re.VERBOSE)
+    TABLE_REGEX = TABLE_REGEX
+
+    # mock tables shared by all tests in the class, as {table_id: definition}
+    class_mock_tables = {}
+
+    _class_mock_tables = {}
+    _class_inline_tables = {}
+    _class_fixture = None
 
     @property
     def project(self):
@@ -43,140 +68,649 @@ class BigQueryTestCase(unittest.TestCase):
     def use_legacy_sql(self):
         return False
 
+    @property
+    def backend(self):
+        if self._bigquery_backend is None:
+            self._bigquery_backend = BigQueryBackend(
+                self.project, self.mock_dataset, self.waiter, self.api_endpoint,
+                self.client_pool, self.fetch_bytes_billed)
+            if self.mock_dataset != self.dataset:
+                self._bigquery_backend.ensure_dataset()
+        return self._bigquery_backend
+
+    @property
+    def worker_id(self):
+        return worker_id()
+
+    @property
+    def worker_isolation(self):
+        # how parallel workers keep out of each other's way: 'leases' share
+        # mock tables and coordinate through lock files, 'tables' names
+        # tables per worker and 'dataset' uses a dataset per worker
+        return 'leases'
+
+    @property
+    def mock_dataset(self):
+        if self.worker_id is not None and self.worker_isolation == 'dataset':
+            return '%s_%s' % (self.dataset, self.worker_id)
+        return self.dataset
+
+    @property
+    def table_leases(self):
+        if self.worker_id is not None and self.worker_isolation == 'leases':
+            return default_table_leases()
+        return None
+
+    @property
+    def api_endpoint(self):
+        return os.environ.get('BIGQUERYTEST_API_ENDPOINT')
+
+    @property
+    def client_pool(self):
+        return default_client_pool
+
+    @property
+    def schema_cache(self):
+        return default_schema_cache
+
+    @property
+    def metrics(self):
+        return default_metrics
+
+    @property
+    def fetch_bytes_billed(self):
+        return False
+
+    @property
+    def definition_cache(self):
+        return default_definition_cache
+
+    @property
+    def waiter(self):
+        return default_waiter
+
+    @property
+    def wait_for_uploads(self):
+        return True
+
+    @property
+    def bulk_load(self):
+        return False
+
+    @property
+    def script_load_max_bytes(self):
+        return 64 * 1024
+
+    @property
+    def inline_mock_tables(self):
+        return False
+
+    @property
+    def inline_max_bytes(self):
+        return 16 * 1024
+
+    @property
+    def mock_table_registry(self):
+        return None
+
+    @property
+    def query_result_cache(self):
+        return None
+
+    @property
+    def cleanup_manager(self):
+        return None
+
+    @property
+    def orphaned_table_age(self):
+        # mock tables older than this many seconds are deleted by the
+        # cleanup manager before the first table is created, None to keep
+        return None
+
+    @property
+    def max_table_mismatches(self):
+        return 10
+
+    @property
+    def table_diff_context(self):
+        return 3
+
+    @property
+    def result_page_size(self):
+        return None
+
+    @property
+    def max_result_rows(self):
+        return None
+
+    @property
+    def max_result_bytes(self):
+        return None
+
+    @property
+    def columnar_tables(self):
+        return False
+
+    @property
+    def dry_run_queries(self):
+        # dry run every query before running it, which checks it and
+        # applies max_bytes_processed
+        return False
+
+    @property
+    def max_bytes_processed(self):
+        return None
+
+    @property
+    def refresh_query_results(self):
+        return bool(os.environ.get('BIGQUERYTEST_REFRESH_QUERY_RESULTS'))
+
     def __init__(self, *args, **kwargs):
         super(BigQueryTestCase, self).__init__(*args, **kwargs)
         self.addTypeEqualityFunc(BigQueryTestTable, 'assert_tables_equal')
-        self._bigquery_client = bigquery.Client(project=self.project)
+        self._bigquery_backend = None
+        self._inline_tables = {}
+        self._test_metrics = None
         self._log = logging.getLogger('bigquerytest')
 
+    @classmethod
+    def setUpClass(cls):
+        super(BigQueryTestCase, cls).setUpClass()
+        cls._class_mock_tables = {}
+        cls._class_inline_tables = {}
+        cls._class_fixture = None
+        if cls.class_mock_tables:
+            cls.mock_class_tables(cls.class_mock_tables)
+
+    @classmethod
+    def tearDownClass(cls):
+        errors = cls._delete_class_tables()
+        if errors:
+            raise MockTableError(errors)
+        super(BigQueryTestCase, cls).tearDownClass()
+
+    @classmethod
+    def _delete_class_tables(cls):
+        fixture = cls._class_fixture
+        tables, cls._class_mock_tables = cls._class_mock_tables, {}
+        cls._class_inline_tables = {}
+        cls._class_fixture = None
+        errors = []
+        if fixture is not None:
+            for table_id, mock_table_name in tables.items():
+                try:
+                    fixture._delete_table(mock_table_name)
+                except Exception as e:
+                    errors.append((table_id, e))
+        return errors
+
+    @classmethod
+    def mock_class_table(cls, table_id, table_definition):
+        cls.mock_class_tables({table_id: table_definition})
+
+    @classmethod
+    def mock_class_tables(cls, tables):
+        fixture = cls._get_class_fixture()
+        created = False
+        try:
+            fixture.mock_tables(tables, cleanup=False)
+            fixture._wait_for_pending_operations()
+            created = True
+        finally:
+            # the tables created so far are recorded even when some failed
+            cls._class_mock_tables = dict(cls._class_mock_tables, **fixture._mock_tables)
+            cls._class_inline_tables = dict(cls._class_inline_tables, **fixture._inline_tables)
+            if not created:
+                # unittest doesn't call tearDownClass when setUpClass fails
+                for table_id, e in cls._delete_class_tables():
+                    fixture._log.warning('Failed to delete class mock table %s: %s', table_id, e)
+
+    @classmethod
+    def _get_class_fixture(cls):
+        if cls._class_fixture is None:
+            # an instance that is never run, used for its configuration.
+            # Subclasses may have their own __init__ signatures, so theirs
+            # is not called and attributes it sets are not seen here
+            fixture = cls.__new__(cls)
+            BigQueryTestCase.__init__(fixture, 'setUpClass')
+            # only the base setUp, a subclass's would mock its per-test
+            # tables once for the whole class
+            BigQueryTestCase.setUp(fixture)
+            cls._class_fixture = fixture
+        return cls._class_fixture
+
     def setUp(self):
-        self._mock_tables = {}
+        self._mock_tables = dict(self._class_mock_tables)
+        self._inline_tables = dict(self._class_inline_tables)
+        self._pending_operations = []
+        self._pending_uploads = []
+
+        # registered first, so it runs after all other cleanups
+        collector = self.metrics
+        if collector is not None:
+            self._test_metrics = collector.start_test(self.id())
+            self.addCleanup(collector.finish_test, self._test_metrics)
+
+        # failures of tables created in the background, for tests that
+        # never query
+        self.addCleanup(self._wait_for_pending_operations)
+
+    def _phase(self, name, **attributes):
+        if self._test_metrics is None:
+            return no_phase(name, **attributes)
+        return self._test_metrics.phase(name, **attributes)
 
     def mock_table(self, table_id, table_definition, cleanup=True):
         schema = self._load_schema(table_id)
-        table = table_from_definition_string(table_definition, schema)
+        table = self._parse_table(table_definition, schema)
+        self._mock_parsed_table(table_id, table, cleanup)
+
+    def mock_tables(self, tables, cleanup=True):
+        for table_id, table_definition in tables.items():
+            self._pending_operations.append((table_id, self.waiter.submit(
+                self._mock_table_in_background, table_id, table_definition, cleanup)))
+
+    def _mock_table_in_background(self, table_id, table_definition, cleanup):
+        schema = self._load_schema(table_id)
+        table = self._parse_table(table_definition, schema)
+        self._mock_parsed_table(table_id, table, cleanup, block=True)
+
+    def _parse_table(self, table_definition, schema):
+        with self._phase('parse') as phase:
+            cache = self.definition_cache
+            if cache is None:
+                table = table_from_definition_string(table_definition, schema)
+            else:
+                table = cache.table(table_definition, schema)
+            phase['rows'] = len(table.data)
+        return table
+
+    def _mock_parsed_table(self, table_id, table, cleanup, block=False):
+        if self._inline_table(table_id, table):
+            self._mock_tables.pop(table_id, None)
+            return
+
         mock_table_name = self._get_table_name(table, table_id)
-        self._create_table(mock_table_name, table)
+        self._create_table(mock_table_name, table, block)
         self._mock_tables[table_id] = mock_table_name
+        self._inline_tables.pop(table_id, None)
 
         if cleanup:
             self.addCleanup(self._delete_table, mock_table_name)
 
+    def _inline_table(self, table_id, table):
+        # small tables are written into the query as a common table
+        # expression, named so that it can't clash with the query's own
+        if not self.inline_mock_tables or self.use_legacy_sql:
+            return False
+
+        select = 'SELECT * FROM '
+        try:
+            literal = table_literal(table, self.inline_max_bytes - len(select))
+        except ValueError:
+            return False
+        if literal is None:
+            return False
+        query = select + literal
+
+        _, _, table_name = parse_table_id(table_id, self.project)
+        name = '__bqt_%s_%s' % (table_name, table.get_hash())
+
+        self._log.debug('Inlining table: %s', table_id)
+        self._inline_tables[table_id] = (name, query)
+        return True
+
     def query(self, sql):
+        self._wait_for_pending_operations()
         sql = self._replace_tables_in_query(sql)
         self._log.debug(sql)
-        query = self._bigquery_client.run_sync_query(sql)
-        query.use_legacy_sql = self.use_legacy_sql
-        query.run()
-        query_fetch_data(self._bigquery_client, query)
-        return table_from_executed_query(query)
-
-    def assert_tables_equal(self, actual, expected):
-        if isinstance(expected, basestring):
-            expected = table_from_definition_string(expected, actual.schema)
+        with self._phase('query', sql=sql) as phase:
+            return self._run_query(sql, phase)
+
+    def dry_run(self, sql):
+        self._wait_for_pending_operations()
+        return self._dry_run(self._replace_tables_in_query(sql))
+
+    def assert_bytes_processed(self, sql, max_bytes, msg=None):
+        self._wait_for_pending_operations()
+        return self._dry_run(self._replace_tables_in_query(sql), max_bytes, msg)
+
+    def _dry_run(self, sql, max_bytes=None, msg=None):
+        mocked = list(self._mock_tables) + list(self._inline_tables)
+        unreplaced = unreplaced_references(sql, mocked, self.project)
+        if unreplaced:
+            self.fail('Mocked tables not replaced in query: %s' % ', '.join(unreplaced))
+
+        with self._phase('dry_run', sql=sql) as phase:
+            result = self.backend.dry_run(sql, self.use_legacy_sql)
+            phase['estimated_bytes'] = result.bytes_processed
+
+        mocked_keys = set(parse_table_id(table_id, self.project) for table_id in mocked)
+        unmocked = [table for table in result.referenced_tables
+                    if self.TABLE_REGEX.match(table)
+                    and parse_table_id(table, self.project) in mocked_keys]
+        if unmocked:
+            self.fail('Query reads tables that are mocked: %s' % ', '.join(unmocked))
+
+        if max_bytes is not None and result.bytes_processed > max_bytes:
+            self.fail(msg or 'Query processes %d bytes, more than %d' % (
+                result.bytes_processed, max_bytes))
+        return result
+
+    def _run_query(self, sql, phase):
+
+        cache = self.query_result_cache
+        if cache is not None:
+            key = cache.key(self.project, sql, self.use_legacy_sql,
+                            self._mock_tables.values())
+            if not self.refresh_query_results:
+                table = cache.get(key)
+                if table is not None:
+                    self._log.info('Using cached query result: %s', key)
+                    phase['result_cache_hit'] = True
+                    return table.to_columnar() if self.columnar_tables else table
+
+        # a cached result was checked when the query first ran
+        if self.dry_run_queries:
+            self._dry_run(sql, self.max_bytes_processed)
+
+        table = self.backend.query(
+            sql, self.use_legacy_sql, page_size=self.result_page_size,
+            max_rows=self.max_result_rows, max_bytes=self.max_result_bytes)
+
+        if cache is not None:
+            cache.put(key, table)
+
+        if self.columnar_tables:
+            table = table.to_columnar()
+        return table
+
+    def assert_tables_equal(self, actual, expected, msg=None, ordered=True, key=None):
+        with self._phase('compare'):
+            self._assert_tables_equal(actual, expected, msg, ordered, key)
+
+    def _assert_tables_equal(self, actual, expected, msg, ordered, key):
+        if isinstance(expected, string_types):
+            expected = self._parse_table(expected, actual.schema)
+            if actual.is_columnar():
+                expected = expected.to_columnar()
 
         columns1 = actual.get_column_names()
         columns2 = expected.get_column_names()
-        self.assertEquals(columns1, columns2)
+        self.assertEqual(columns1, columns2)
 
-        flat1 = actual.flatten()
-        flat2 = expected.flatten()
-        concat = flat1 + flat2
-        column_widths = get_column_widths(concat)
+        if ordered and key is None and actual.columns_equal(expected):
+            return
 
-        pretty1 = actual.prettyprint(column_widths)
-        pretty2 = expected.prettyprint(column_widths)
+        if key is not None or not ordered:
+            self._assert_records_equal(actual, expected, msg, key)
+            return
 
-        self.assertMultiLineEqual(pretty1, pretty2)
+        diff = diff_flat_tables(actual.iter_flat(), expected.iter_flat(),
+                                self.max_table_mismatches, self.table_diff_context)
+        if diff is None:
+            return
 
-    def _create_table(self, mock_table_name, table):
-        bq_schema = table.get_bigquery_schema()
-        bq_table = self._table(mock_table_name, bq_schema)
-        if bq_table.exists():
-            self._log.info('Table already exists, not creating: %s', mock_table_name)
+        pretty1, pretty2 = diff.render()
+        summary = '%d%s mismatching rows, first at row %d' % (
+            diff.num_mismatches, '+' if diff.truncated else '', diff.first_mismatch())
+        self.assertMultiLineEqual(pretty1, pretty2, msg or summary)
+
+    def _assert_records_equal(self, actual, expected, msg, key):
+        if key is None:
+            diff = diff_unordered_records(actual.iter_records(), expected.iter_records(),
+                                          self.max_table_mismatches)
+        else:
+            key_columns = [key] if isinstance(key, string_types) else list(key)
+            diff = diff_keyed_records(actual.iter_records(), expected.iter_records(),
+                                      key_columns, self.max_table_mismatches)
+        if diff is None:
             return
 
-        bq_table.create()
-        self._log.debug('Creating table: %s', mock_table_name)
-        while not bq_table.exists():
-            bq_table.reload()
-            time.sleep(5)
+        pretty1, pretty2 = diff.render(actual.schema, self.max_table_mismatches)
+        summary = '%d mismatching records%s' % (
+            diff.num_mismatches, '' if key is None else ' by key')
+        self.assertMultiLineEqual(pretty1, pretty2, msg or summary)
 
-        f = StringIO('\n'.join([json.dumps(row) for row in table.data]))
-        op = bq_table.upload_from_file(
-            f, 'NEWLINE_DELIMITED_JSON', size=f.len)
+    def _create_table(self, mock_table_name, table, block=False):
+        leases = self.table_leases
+        if leases is None:
+            self._create_table_locked(mock_table_name, table, block, None)
+            return
 
-        self._log.debug('Uploading data to table: %s', mock_table_name)
-        while op.state != 'DONE':
-            op.reload()
-            time.sleep(5)
+        # other workers must not see the table, not even in the registry,
+        # before its upload is done
+        with leases.lock((self.project, self.mock_dataset, mock_table_name)):
+            self._create_table_locked(mock_table_name, table, block, leases)
+
+    def _create_table_locked(self, mock_table_name, table, block, leases):
+        registry = self.mock_table_registry
+        key = (self.project, self.mock_dataset, mock_table_name)
+        if registry is not None:
+            self._reconcile_mock_table_registry(registry)
+            if registry.acquire_registered(key):
+                if leases is not None:
+                    leases.acquire(key)
+                self._log.info('Reusing registered table: %s', mock_table_name)
+                return
+
+        def on_created():
+            registry.register(key)
+            registry.acquire(key)
+
+        manager = self.cleanup_manager
+        if manager is not None:
+            self._sweep_orphaned_tables(manager)
+            if manager.reclaim(key):
+                self._log.info('Reusing table queued for deletion: %s', mock_table_name)
+                return
+
+        if leases is not None:
+            leases.acquire(key)
+
+        if self.bulk_load:
+            # uploaded together when a query needs them, CREATE TABLE IF
+            # NOT EXISTS doesn't race with other workers
+            self._pending_uploads.append((
+                mock_table_name, table, on_created if registry is not None else None))
+            return
+
+        if leases is not None:
+            try:
+                with self._phase('create_table', table=mock_table_name):
+                    self.backend.create_table(
+                        mock_table_name, table, True,
+                        on_created if registry is not None else None)
+            except Exception:
+                # no cleanup is registered for a table that failed
+                leases.release(key)
+                raise
+            return
+
+        with self._phase('create_table', table=mock_table_name):
+            pending = self.backend.create_table(
+                mock_table_name, table, block or self.wait_for_uploads,
+                on_created if registry is not None else None)
+        if pending is not None:
+            self._pending_operations.append((mock_table_name, pending))
+
+    def _reconcile_mock_table_registry(self, registry):
+        leases = self.table_leases
+
+        def in_use(name):
+            # tables other workers are still creating are listed already
+            return leases is not None and \
+                bool(leases.holders((self.project, self.mock_dataset, name)))
+
+        if not registry.reconcile(self.project, self.mock_dataset,
+                                  self.backend.list_tables, self.table_prefix, in_use):
+            return
+
+        def delete_table(name):
+            self._log.info('Deleting stale table: %s', name)
+            self.backend.delete_table(name, block=False)
+
+        registry.delete_stale(self.project, self.mock_dataset, delete_table)
+
+    def _sweep_orphaned_tables(self, manager):
+        max_age = self.orphaned_table_age
+        if max_age is None:
+            return
+        registry = self.mock_table_registry
+        leases = self.table_leases
+        registered = []
+
+        def keep(name):
+            # registered tables are reused by later runs, and leased ones
+            # are used by live workers. The registry is read once per sweep
+            key = (self.project, self.mock_dataset, name)
+            if registry is not None and not registered:
+                registered.append(registry.keys())
+            return (registry is not None and key in registered[0]) or \
+                (leases is not None and bool(leases.holders(key)))
+
+        manager.sweep_once(self.backend, self.project, self.mock_dataset,
+                           self.table_prefix, max_age, keep=keep)
 
     def _delete_table(self, table_name):
-        table = self._table(table_name)
-        table.delete()
-        self._log.debug('Deleting table: %s', table_name)
-        while table.exists():
-            table.reload()
-            time.sleep(5)
+        # a bulk upload that hasn't happened yet is dropped, not flushed
+        uploads = [u for u in self._pending_uploads if u[0] != table_name]
+        uploaded = len(uploads) == len(self._pending_uploads)
+        self._pending_uploads = uploads
+        try:
+            self._wait_for_pending_operations()
+        finally:
+            # other tables failing must not leave this one behind, their
+            # errors are raised once it's deleted
+            if uploaded:
+                self._delete_uploaded_table(table_name)
+            else:
+                self._release_unuploaded_table(table_name)
+
+    def _delete_uploaded_table(self, table_name):
+        registry = self.mock_table_registry
+        leases = self.table_leases
+        if registry is not None:
+            self._log.debug('Releasing table: %s', table_name)
+            key = (self.project, self.mock_dataset, table_name)
+            registry.release(key)
+            if leases is not None:
+                with leases.lock(key):
+                    leases.release(key)
+            return
+
+        if leases is not None:
+            key = (self.project, self.mock_dataset, table_name)
+            with leases.lock(key):
+                if not leases.release(key):
+                    self._log.debug('Table still used by other workers: %s', table_name)
+                    return
+                with self._phase('delete_table', table=table_name):
+                    self.backend.delete_table(table_name)
+            return
+
+        manager = self.cleanup_manager
+        if manager is not None:
+            self._log.debug('Queueing table for deletion: %s', table_name)
+            manager.delete(self.backend, (self.project, self.mock_dataset, table_name))
+            return
+
+        with self._phase('delete_table', table=table_name):
+            self.backend.delete_table(table_name)
+
+    def _release_unuploaded_table(self, table_name):
+        leases = self.table_leases
+        if leases is None:
+            return
+        key = (self.project, self.mock_dataset, table_name)
+        with leases.lock(key):
+            if leases.release(key):
+                # another worker may have uploaded it in the meantime
+                with self._phase('delete_table', table=table_name):
+                    self.backend.delete_tables([table_name])
+
+    def _wait_for_pending_operations(self):
+        pending, self._pending_operations = self._pending_operations, []
+        if not pending and not self._pending_uploads:
+            return
+
+        with self._phase('wait', operations=len(pending)):
+            errors = self._wait_for(pending)
+
+        if self._pending_uploads:
+            uploads = dict((name, (name, table, on_created))
+                           for name, table, on_created in self._pending_uploads)
+            self._pending_uploads = []
+            with self._phase('bulk_load', tables=len(uploads)):
+                upload_errors = self._wait_for(self.backend.create_tables(
+                    list(uploads.values()), self.script_load_max_bytes))
+            leases = self.table_leases
+            if leases is not None:
+                for name, _ in upload_errors:
+                    key = (self.project, self.mock_dataset, name)
+                    with leases.lock(key):
+                        leases.release(key)
+            errors += upload_errors
+
+        if errors:
+            raise MockTableError(errors)
+
+    def _wait_for(self, pending):
+        errors = []
+        for name, operation in pending:
+            try:
+                operation.get()
+            except Exception as e:
+                errors.append((name, e))
+        return errors
 
     def _get_table_name(self, table, table_id):
         match = self.TABLE_REGEX.match(table_id)
         if not match:
             raise ValueError('Bad table name: %s' % table_id)
         _, _, table_name = match.groups()
-        return '%s_%s_%s' % (self.table_prefix, table_name, table.get_hash())
+        prefix = self.table_prefix
+        if self.worker_id is not None and self.worker_isolation == 'tables':
+            prefix = '%s_%s' % (prefix, self.worker_id)
+        return '%s_%s_%s' % (prefix, table_name, table.get_hash())
 
     def _replace_tables_in_query(self, sql):
         replacements = {}
-
         for table_name, mock_table_name in self._mock_tables.items():
-            mock_table_id = (
+            replacements[table_name] = (
                 '[%s:%s.%s]' if self.use_legacy_sql else '`%s.%s.%s`'
-            ) % (self.project, self.dataset, mock_table_name)
-
-            match = self.TABLE_REGEX.match(table_name)
-            if not match:
-                raise ValueError('Bad table name: %s' % table_name)
-            project, dataset, table = match.groups()
-            if project is None:
-                project = self.project
-
-            for match in self.TABLE_REGEX.finditer(sql):
-                sql_project, sql_dataset, sql_table = match.groups()
-                if sql_project is None:
-                    sql_project = self.project
-
-                start, end = match.span()
-
-                if (sql_project == project and sql_dataset == dataset and
-                    sql_table == table):
-                    replacements[sql[start:end]] = mock_table_id
-                    self._log.info('Mocking table: %s', sql[start:end])
-
-        for string, replacement in replacements.items():
-            sql = sql.replace(string, replacement)
-
-        return sql
+            ) % (self.project, self.mock_dataset, mock_table_name)
+
+        inline = {}
+        for table_id, (name, query) in self._inline_tables.items():
+            key = parse_table_id(table_id, self.project)
+            replacements[table_id] = keep_implicit_alias('`%s`' % name, key[2])
+            inline[key] = (name, query)
+
+        rewriter = TableRewriter(replacements, self.project)
+        referenced = set(key for key, _ in rewriter.references(sql))
+        sql = rewriter.rewrite(
+            sql, lambda s: self._log.info('Mocking table: %s', s))
+        # tables with the same contents share a definition
+        return add_ctes(sql, sorted(set(cte for key, cte in inline.items()
+                                        if key in referenced)))
 
     def _load_schema(self, table_id):
         match = self.TABLE_REGEX.match(table_id)
         if not match:
             raise ValueError('Bad table name: %s' % table_id)
         project, dataset, table_name = match.groups()
-        table = bigquery.Client(project=project).dataset(dataset).table(table_name)
-        table.reload()
-        return schema_from_bigquery_schema(table.schema)
 
-    def _table(self, table_name, *args, **kwargs):
-        return self._bigquery_client.dataset(self.dataset).table(
-            table_name, *args, **kwargs)
+        def load():
+            with self._phase('load_schema', table=table_id):
+                return self.backend.load_schema(project, dataset, table_name)
 
+        if self.schema_cache is None or not self.backend.remote:
+            return load()
+        return self.schema_cache.get_or_load((project, dataset, table_name), load)
 
-# until google fixes https://github.com/GoogleCloudPlatform/google-cloud-python/issues/2354
-def query_fetch_data(client, query):
-    path = '/projects/%s/queries/%s' % (query.project, query.name)
-    params = {}
-    response = client._connection.api_request(
-        method='GET', path=path, query_params=params)
 
-    query._set_properties(response)
+# kept for code that called this before QueryResultReader existed
+def query_fetch_data(client, query):
+    page = QueryResultReader(client, query.project, query.name).first_page()
+    query._set_properties(page)
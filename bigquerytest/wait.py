@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+import math
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .metrics import counting_into, current_counters
+
+
+class WaitTimeoutError(Exception):
+    pass
+
+
+class SystemClock(object):
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class WaitHistogram(object):
+
+    # bucket i counts waits shorter than 2**i milliseconds
+    NUM_BUCKETS = 20
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * self.NUM_BUCKETS
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        millis = seconds * 1000
+        bucket = 0 if millis < 1 else int(math.floor(math.log(millis, 2))) + 1
+        self.buckets[min(bucket, self.NUM_BUCKETS - 1)] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class WaitStats(object):
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        with self._lock:
+            if operation not in self.histograms:
+                self.histograms[operation] = WaitHistogram()
+            self.histograms[operation].record(seconds)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def report(self):
+        lines = ['%-12s %6s %10s %10s %10s' % ('operation', 'count', 'mean', 'min', 'max')]
+        for operation, h in sorted(self.histograms.items()):
+            lines.append('%-12s %6d %9.3fs %9.3fs %9.3fs' % (
+                operation, h.count, h.mean(), h.min, h.max))
+            for i, n in enumerate(h.buckets):
+                if n:
+                    lines.append('    < %7d ms  %s' % (2 ** i, n))
+        return '\n'.join(lines)
+
+
+class Waiter(object):
+
+    def __init__(self, initial_delay=0.01, max_delay=5.0, multiplier=2.0,
+                 jitter=0.2, timeout=600.0, clock=None, max_workers=8,
+                 random=random.random):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.clock = clock or SystemClock()
+        self.max_workers = max_workers
+        self.random = random
+        self.stats = WaitStats()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def delays(self):
+        delay = self.initial_delay
+        while True:
+            spread = self.jitter * (2 * self.random() - 1)
+            yield min(delay, self.max_delay) * (1 + spread)
+            delay *= self.multiplier
+
+    def wait(self, predicate, operation='wait'):
+        start = self.clock.time()
+        delays = self.delays()
+        while not predicate():
+            elapsed = self.clock.time() - start
+            if self.timeout is not None and elapsed >= self.timeout:
+                raise WaitTimeoutError('Timed out after %.1fs waiting for %s' % (
+                    elapsed, operation))
+            delay = next(delays)
+            if self.timeout is not None:
+                delay = min(delay, self.timeout - elapsed)
+            self.clock.sleep(max(delay, 0))
+        self.stats.record(operation, self.clock.time() - start)
+
+    def submit(self, function, *args):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+        counters = current_counters()
+        if counters is not None:
+            # work submitted during a phase, like prefetching pages,
+            # counts toward that phase
+            return self._pool.apply_async(run_counting_into, (counters, function) + args)
+        return self._pool.apply_async(function, args)
+
+    def wait_async(self, predicate, operation='wait'):
+        return self.submit(self.wait, predicate, operation)
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+def run_counting_into(counters, function, *args):
+    with counting_into(counters):
+        return function(*args)
+
+
+default_waiter = Waiter()
@@ -0,0 +1,199 @@
+import itertools
+import json
+import threading
+from google.cloud.bigquery import SchemaField
+from google.cloud.exceptions import NotFound
+
+
+class FakeBigQuery(object):
+
+    def __init__(self):
+        self.tables = {}
+        self.datasets = set()
+        self.queries = {}
+        self.calls = []
+        self.query_response = lambda sql: ([], [])
+        self.fail_tables = set()
+        self.page_size = 100
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+
+    def client(self, project=None, *args, **kwargs):
+        return FakeClient(self, project)
+
+    def add_table(self, project, dataset, table, schema, rows=()):
+        self.tables[(project, dataset, table)] = {
+            'schema': schema, 'rows': list(rows)}
+
+    def record(self, call, *args):
+        with self._lock:
+            self.calls.append((call,) + args)
+
+    def count(self, call):
+        return len([c for c in self.calls if c[0] == call])
+
+    def query_page(self, job_id, maxResults=None, pageToken=None):
+        result = self.queries[job_id]
+        page_size = maxResults or self.page_size
+        start = int(pageToken or 0)
+        page = {
+            'jobComplete': True,
+            'schema': {'fields': schema_resource(result['schema'])},
+            'totalRows': str(len(result['rows'])),
+            'rows': result['rows'][start:start + page_size],
+        }
+        if start + page_size < len(result['rows']):
+            page['pageToken'] = str(start + page_size)
+        return page
+
+    def next_job_id(self):
+        with self._lock:
+            return 'job_%d' % next(self._job_ids)
+
+
+class FakeConnection(object):
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def api_request(self, method, path, query_params=None, data=None):
+        self.fake.record('api_request', method, path)
+        parts = path.strip('/').split('/')
+        if method == 'GET' and parts[2] == 'queries':
+            return self.fake.query_page(parts[3], **(query_params or {}))
+        raise NotImplementedError('%s %s' % (method, path))
+
+
+class FakeClient(object):
+
+    def __init__(self, fake, project):
+        self.fake = fake
+        self.project = project
+        self._connection = FakeConnection(fake)
+
+    def dataset(self, name):
+        return FakeDataset(self, name)
+
+    def run_sync_query(self, sql):
+        return FakeQuery(self, sql)
+
+
+class FakeDataset(object):
+
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self.project = client.project
+
+    def table(self, name, schema=()):
+        return FakeTable(self, name, schema)
+
+    def exists(self):
+        self._client.fake.record('dataset_exists', self.name)
+        return (self.project, self.name) in self._client.fake.datasets
+
+    def create(self):
+        self._client.fake.record('create_dataset', self.name)
+        self._client.fake.datasets.add((self.project, self.name))
+
+    def list_tables(self):
+        fake = self._client.fake
+        fake.record('list_tables', self.name)
+        return [self.table(name) for (project, dataset, name) in list(fake.tables)
+                if (project, dataset) == (self.project, self.name)]
+
+
+class FakeTable(object):
+
+    def __init__(self, dataset, name, schema=()):
+        self.fake = dataset._client.fake
+        self.name = name
+        self.key = (dataset.project, dataset.name, name)
+        self.schema = list(schema)
+
+    def exists(self):
+        self.fake.record('exists', self.name)
+        return self.key in self.fake.tables
+
+    def create(self):
+        self.fake.record('create', self.name)
+        if any(t in self.name for t in self.fake.fail_tables):
+            raise ValueError('Failed to create %s' % self.name)
+        self.fake.tables[self.key] = {'schema': self.schema, 'rows': []}
+
+    def reload(self):
+        self.fake.record('reload', self.name)
+        if self.key not in self.fake.tables:
+            raise NotFound(self.name)
+        self.schema = self.fake.tables[self.key]['schema']
+
+    def delete(self):
+        self.fake.record('delete', self.name)
+        self.fake.tables.pop(self.key, None)
+
+    def upload_from_file(self, f, source_format, size=None):
+        self.fake.record('upload', self.name)
+        data = f.read(size).decode('utf-8')
+        rows = [json.loads(line) for line in data.splitlines()]
+        self.fake.tables[self.key]['rows'] = rows
+        return FakeJob(self.fake)
+
+
+class FakeJob(object):
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.state = 'RUNNING'
+
+    def reload(self):
+        self.fake.record('job_reload')
+        self.state = 'DONE'
+
+
+class FakeQuery(object):
+
+    def __init__(self, client, sql):
+        self._client = client
+        self.sql = sql
+        self.project = client.project
+        self.name = None
+        self.schema = []
+        self.use_legacy_sql = None
+        self._properties = {}
+
+    def run(self):
+        fake = self._client.fake
+        fake.record('query', self.sql)
+        self.name = fake.next_job_id()
+        self.schema, rows = fake.query_response(self.sql)
+        fake.queries[self.name] = {'schema': self.schema, 'rows': rows}
+
+    def _set_properties(self, response):
+        self._properties = dict(response)
+
+
+def field(name, field_type, mode='NULLABLE', fields=()):
+    return SchemaField(name, field_type, mode=mode, fields=fields)
+
+
+def schema_resource(fields):
+    return [dict({'name': f.name, 'type': f.field_type, 'mode': f.mode},
+                 **({'fields': schema_resource(f.fields)} if f.fields else {}))
+            for f in fields]
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
@@ -0,0 +1,168 @@
+import threading
+import time
+import unittest
+from mock import patch
+from bigquerytest.cleanup import CleanupManager
+from bigquerytest.registry import MockTableRegistry
+from fake_bigquery import FakeBigQuery, field
+from test_testcase import BigQueryTestCaseFakeDummy
+
+
+class RecordingBackend(object):
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def delete_table(self, name, block=True):
+        self.gate.wait()
+        if self.fail:
+            raise ValueError('Failed to delete %s' % name)
+        self.calls.append(('delete_table', name, block))
+
+    def delete_tables(self, names):
+        self.gate.wait()
+        self.calls.append(('delete_tables', list(names)))
+
+    def list_table_creation_times(self):
+        return {'bigquery_test_mock_old': 900.0, 'bigquery_test_mock_new': 990.0,
+                'bigquery_test_mock_unknown': None, 'other': 0.0}
+
+
+def key(name):
+    return ('my-project', 'my_dataset', name)
+
+
+def wait_until(predicate):
+    while not predicate():
+        time.sleep(0.001)
+
+
+class TestCleanupManager(unittest.TestCase):
+
+    def test_batches(self):
+        backend = RecordingBackend()
+        backend.gate.clear()
+        manager = CleanupManager(max_workers=1, batch_size=3)
+        self.addCleanup(manager.close)
+        manager.delete(backend, key('a'))
+        wait_until(lambda: manager._in_flight)
+        for name in 'bcde':
+            manager.delete(backend, key(name))
+        manager.delete(backend, ('my-project', 'other_dataset', 'f'))
+        self.assertEquals(manager.pending(), 6)
+
+        backend.gate.set()
+        self.assertEquals(manager.flush(), [])
+        self.assertEquals(backend.calls, [
+            ('delete_table', 'a', False),
+            ('delete_tables', ['b', 'c', 'd']),
+            ('delete_table', 'e', False),
+            ('delete_table', 'f', False),
+        ])
+        self.assertEquals(manager.deleted, 6)
+
+    def test_reclaim(self):
+        backend = RecordingBackend()
+        backend.gate.clear()
+        manager = CleanupManager(max_workers=1)
+        self.addCleanup(manager.close)
+        manager.delete(backend, key('a'))
+        wait_until(lambda: manager._in_flight)
+        manager.delete(backend, key('b'))
+
+        self.assertTrue(manager.reclaim(key('b')))
+        self.assertFalse(manager.reclaim(key('c')))
+        threading.Timer(0.01, backend.gate.set).start()
+        self.assertFalse(manager.reclaim(key('a')))
+        self.assertEquals(backend.calls, [('delete_table', 'a', False)])
+        manager.flush()
+        self.assertEquals(backend.calls, [('delete_table', 'a', False)])
+
+    def test_errors(self):
+        manager = CleanupManager()
+        self.addCleanup(manager.close)
+        manager.delete(RecordingBackend(fail=True), key('a'))
+        errors = manager.flush()
+        self.assertEquals([k for k, e in errors], [key('a')])
+        self.assertIsInstance(errors[0][1], ValueError)
+        self.assertEquals(manager.flush(), [])
+
+    def test_sweep(self):
+        backend = RecordingBackend()
+        manager = CleanupManager()
+        self.addCleanup(manager.close)
+        self.assertEquals(
+            manager.sweep_once(backend, 'my-project', 'my_dataset', 'bigquery_test_mock', 50,
+                               clock=lambda: 1000.0),
+            ['bigquery_test_mock_old'])
+        self.assertEquals(
+            manager.sweep_once(backend, 'my-project', 'my_dataset', 'bigquery_test_mock', 50,
+                               clock=lambda: 1000.0),
+            [])
+        manager.flush()
+        self.assertEquals(backend.calls, [('delete_table', 'bigquery_test_mock_old', False)])
+
+        self.assertEquals(
+            manager.sweep(backend, 'my-project', 'my_dataset', 'bigquery_test_mock', 5,
+                          clock=lambda: 1000.0, keep=lambda name: name.endswith('_old')),
+            ['bigquery_test_mock_new'])
+        self.assertRaises(ValueError, manager.sweep, backend, 'my-project', 'my_dataset',
+                          'bigquery_test_mock', 0)
+
+
+class TestDeferredCleanup(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBigQuery()
+        self.fake.add_table('src', 'data', 'a', [field('x', 'INTEGER')])
+        patcher = patch('google.cloud.bigquery.Client', self.fake.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mock_tables(self):
+        return [k for k in self.fake.tables if k[0] == 'my-project']
+
+    def test_deferred_cleanup(self):
+        manager = CleanupManager()
+        self.addCleanup(manager.close)
+
+        class CleanupDummy(BigQueryTestCaseFakeDummy):
+            cleanup_manager = manager
+
+        for _ in range(3):
+            test = CleanupDummy()
+            test.setUp()
+            test.mock_table('src.data.a', '''
+                x
+                1
+            ''')
+            test.query('select * from src.data.a')
+            self.assertEquals(len(self.mock_tables()), 1)
+            test.doCleanups()
+
+        self.assertEquals(manager.flush(), [])
+        self.assertEquals(self.mock_tables(), [])
+        self.assertEquals(self.fake.count('create'), self.fake.count('delete'))
+
+    def test_sweep_keeps_registered_tables(self):
+        manager = CleanupManager()
+        self.addCleanup(manager.close)
+        registry = MockTableRegistry()
+        registry.register(key('bigquery_test_mock_old'))
+
+        class SweepDummy(BigQueryTestCaseFakeDummy):
+            cleanup_manager = manager
+            orphaned_table_age = 50
+            mock_table_registry = registry
+
+        test = SweepDummy()
+        backend = test._bigquery_backend = RecordingBackend()
+        with patch.object(registry, '_read', wraps=registry._read) as read:
+            test._sweep_orphaned_tables(manager)
+        self.assertEquals(read.call_count, 1)
+        self.assertEquals(manager.flush(), [])
+        self.assertEquals(backend.calls, [('delete_table', 'bigquery_test_mock_new', False)])
+        self.assertEquals(registry.stats()['misses'], 0)
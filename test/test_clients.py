@@ -0,0 +1,77 @@
+import threading
+import unittest
+from mock import Mock, patch
+from google.cloud.bigquery._http import Connection
+from bigquerytest.backend import BigQueryBackend
+from bigquerytest.clients import ClientPool, PooledHttp
+from bigquerytest.server import FakeBigQueryServer
+from bigquerytest.wait import Waiter, WaitStats
+
+
+class TestClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ClientPool()
+        self.addCleanup(self.pool.close)
+
+    def test_reuses_clients(self):
+        with FakeBigQueryServer() as server:
+            client = self.pool.client('p', server.url)
+            self.assertIs(self.pool.client('p', server.url), client)
+            self.assertIsNot(self.pool.client('q', server.url), client)
+        self.assertEquals((self.pool.clients_created, self.pool.clients_reused), (2, 1))
+        self.assertEquals(self.pool.stats.histograms['client'].count, 2)
+
+    def test_discovers_credentials_once(self):
+        default_credentials = Mock()
+        default_credentials.create_scoped_required.return_value = False
+        calls = []
+
+        def make_client(project, credentials=None, http=None):
+            # the first client discovers the default credentials
+            calls.append(credentials)
+            return Mock(_connection=Connection(credentials=default_credentials))
+
+        with patch('google.cloud.bigquery.Client', make_client):
+            client = self.pool.client('p')
+            self.pool.client('q')
+
+        self.assertEquals(calls, [None, default_credentials])
+        self.assertIsInstance(client._connection.http, PooledHttp)
+
+    def test_request_metrics(self):
+        with FakeBigQueryServer() as server:
+            server.add_table('p.d.a', [])
+            backend = BigQueryBackend('p', 'd', Waiter(), server.url, self.pool)
+            self.assertEquals(backend.list_tables(), ['a'])
+            self.assertEquals(backend.list_tables(), ['a'])
+        self.assertEquals(self.pool.stats.histograms['GET'].count, 2)
+        self.assertIn('clients: 1 created, 0 reused', self.pool.report())
+
+
+class TestPooledHttp(unittest.TestCase):
+
+    def test_one_http_per_thread(self):
+        instances = []
+
+        def make_http():
+            http = Mock(connections={'c': Mock()})
+            instances.append(http)
+            return http
+
+        stats = WaitStats()
+        http = PooledHttp(make_http, stats)
+        http.request('http://x', 'GET')
+        http.request('http://x', 'POST')
+        thread = threading.Thread(target=http.request, args=('http://x',))
+        thread.start()
+        thread.join()
+
+        self.assertEquals(len(instances), 2)
+        self.assertEquals(instances[0].request.call_count, 2)
+        self.assertEquals(stats.histograms['GET'].count, 2)
+
+        connection = instances[0].connections['c']
+        http.close()
+        self.assertTrue(connection.close.called)
+        self.assertEquals(instances[0].connections, {})
@@ -0,0 +1,123 @@
+import random
+import unittest
+from array import array
+from bigquerytest.table import BigQueryTestSchemaField, BigQueryTestTable, Null
+from bigquerytest.columnar import ColumnarRecords
+
+
+def field(long_name, type, repeated=False, subfields=None, repeated_branch=False):
+    return BigQueryTestSchemaField(
+        long_name.split('.')[-1], type, long_name, subfields, not repeated,
+        repeated, repeated_branch or repeated)
+
+
+SCHEMA = [
+    field('id', 'integer'),
+    field('tags', 'string', repeated=True),
+    field('a', 'record', subfields=[
+        field('a.flag', 'boolean'),
+        field('a.b', 'record', repeated=True, subfields=[
+            field('a.b.x', 'float', repeated_branch=True),
+            field('a.b.c', 'record', repeated=True, subfields=[
+                field('a.b.c.y', 'integer', repeated=True),
+                field('a.b.c.z', 'string', repeated_branch=True),
+            ]),
+        ]),
+    ]),
+]
+
+RECORDS = [
+    {'id': 1, 'tags': ['x', 'y'], 'a': {'flag': True, 'b': [
+        {'x': 1.5, 'c': [{'y': [1, 2], 'z': 'foo'}, {'z': 'bar'}]},
+        {'c': [{'y': [3]}]},
+        {'x': 2.5},
+    ]}},
+    {'id': 2},
+    {'tags': ['z'], 'a': {}},
+    {'a': {'b': [{}, {'c': [{}, {'y': [4]}]}]}},
+    {'id': 3, 'a': {'flag': False}},
+]
+
+
+class TestColumnarRecords(unittest.TestCase):
+
+    def test_round_trip(self):
+        records = ColumnarRecords.from_records(RECORDS, SCHEMA)
+        self.assertEquals(len(records), 5)
+        self.assertEquals(list(records), RECORDS)
+        self.assertEquals(list(records), RECORDS)
+
+    def test_levels(self):
+        records = ColumnarRecords.from_records(RECORDS, SCHEMA)
+        column = records.column('a.b.c.y')
+        self.assertEquals(list(column.repetition), [0, 3, 2, 1, 1, 0, 0, 0, 1, 2, 0])
+        self.assertEquals(list(column.definition), [4, 4, 3, 4, 2, 0, 1, 2, 3, 4, 1])
+        self.assertEquals(column.values, array('q', [1, 2, 3, 4]))
+
+    def test_typed_values(self):
+        records = ColumnarRecords.from_records(RECORDS, SCHEMA)
+        self.assertEquals(records.column('id').values.typecode, 'q')
+        self.assertEquals(records.column('a.b.x').values.typecode, 'd')
+        self.assertEquals(records.column('a.flag').values.typecode, 'b')
+        self.assertEquals(records.column('tags').values, ['x', 'y', 'z'])
+        self.assertIs(list(records)[0]['a']['flag'], True)
+
+        null = Null()
+        records = ColumnarRecords.from_records([{'id': 1}, {'id': null}, {'id': 2 ** 70}], SCHEMA)
+        self.assertEquals(records.column('id').values, [1, null, 2 ** 70])
+        self.assertIs(list(records)[1]['id'], null)
+
+    def test_not_canonical(self):
+        for record in [{'id': None}, {'tags': []}, {'other': 1}, {'tags': 'x'},
+                       {'a': {'b': [None]}}, {'a': 1}]:
+            self.assertIsNone(ColumnarRecords.from_records([record], SCHEMA))
+        self.assertIsNone(ColumnarRecords.from_records([], []))
+
+    def test_equality(self):
+        records1 = ColumnarRecords.from_records(RECORDS, SCHEMA)
+        records2 = ColumnarRecords.from_records([dict(r) for r in RECORDS], SCHEMA)
+        records3 = ColumnarRecords.from_records(RECORDS[:-1] + [{'id': 3}], SCHEMA)
+        self.assertEquals(records1, records2)
+        self.assertNotEquals(records1, records3)
+
+    def test_random_round_trip(self):
+        rng = random.Random(0)
+
+        def generate(fields):
+            record = {}
+            for f in fields:
+                if rng.random() < 0.3:
+                    continue
+                count = rng.randint(1, 3) if f.repeated else 1
+                if f.type == 'record':
+                    values = [generate(f.subfields) for _ in range(count)]
+                elif f.type == 'integer':
+                    values = [rng.randint(-5, 5) for _ in range(count)]
+                elif f.type == 'float':
+                    values = [rng.random() for _ in range(count)]
+                elif f.type == 'boolean':
+                    values = [rng.random() < 0.5 for _ in range(count)]
+                else:
+                    values = ['s%d' % rng.randint(0, 9) for _ in range(count)]
+                record[f.name] = values if f.repeated else values[0]
+            return record
+
+        records = [generate(SCHEMA) for _ in range(500)]
+        self.assertEquals(list(ColumnarRecords.from_records(records, SCHEMA)), records)
+
+    def test_table_to_columnar(self):
+        table = BigQueryTestTable(RECORDS, SCHEMA)
+        columnar = table.to_columnar()
+        self.assertTrue(columnar.is_columnar())
+        self.assertIs(columnar.to_columnar(), columnar)
+        records = RECORDS[:2] + RECORDS[4:]
+        self.assertEquals(BigQueryTestTable(records, SCHEMA).to_columnar().flatten(),
+                          BigQueryTestTable(records, SCHEMA).flatten())
+        self.assertTrue(columnar.columns_equal(BigQueryTestTable(iter(RECORDS), SCHEMA).to_columnar()))
+        self.assertFalse(columnar.columns_equal(table))
+
+        self.assertEquals(columnar.data, RECORDS)
+        self.assertFalse(columnar.is_columnar())
+
+        table = BigQueryTestTable([{'id': None}], SCHEMA)
+        self.assertIs(table.to_columnar(), table)
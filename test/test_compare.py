@@ -0,0 +1,173 @@
+import unittest
+from bigquerytest.compare import (
+    diff_flat_tables,
+    diff_keyed_records,
+    diff_unordered_records,
+    tables_equal
+)
+from bigquerytest.table import BigQueryTestSchemaField, Null, table_from_definition_string
+
+
+def flat(values):
+    return [['c1', 'c2']] + [[v, i] for i, v in enumerate(values)]
+
+
+class TestDiffFlatTables(unittest.TestCase):
+
+    def test_equal(self):
+        self.assertIsNone(diff_flat_tables(flat('abcd'), flat('abcd')))
+
+    def test_equal_rendering(self):
+        self.assertIsNone(diff_flat_tables([['c'], [None]], [['c'], ['']]))
+
+    def test_window(self):
+        diff = diff_flat_tables(flat('abcdefghij'), flat('abcdeXghij'), context=2)
+        self.assertEquals(diff.num_mismatches, 1)
+        self.assertEquals(diff.first_mismatch(), 6)
+        actual, expected = diff.render()
+        self.assertMultiLineEqual(actual, '\n'.join([
+            'c1  c2',
+            '...',
+            'd   3',
+            'e   4',
+            'f   5',
+            'g   6',
+            'h   7',
+            '...',
+        ]))
+        self.assertMultiLineEqual(expected, '\n'.join([
+            'c1  c2',
+            '...',
+            'd   3',
+            'e   4',
+            'X   5',
+            'g   6',
+            'h   7',
+            '...',
+        ]))
+
+    def test_stops_early(self):
+        consumed = []
+
+        def rows():
+            yield ['c1']
+            for i in range(100000):
+                consumed.append(i)
+                yield [i]
+
+        expected = [['c1']] + [[-1]] * 100000
+        diff = diff_flat_tables(rows(), expected, max_mismatches=3, context=1)
+        self.assertEquals(diff.num_mismatches, 3)
+        self.assertTrue(diff.truncated)
+        self.assertEquals(len(consumed), 4)
+
+    def test_different_lengths(self):
+        diff = diff_flat_tables(flat('ab'), flat('abc'), context=1)
+        actual, expected = diff.render()
+        self.assertMultiLineEqual(actual, 'c1  c2\n...\nb   1')
+        self.assertMultiLineEqual(expected, 'c1  c2\n...\nb   1\nc   2')
+
+
+SCHEMA = [
+    BigQueryTestSchemaField('id', 'integer', 'id', None, False, False, False),
+    BigQueryTestSchemaField('r', 'record', 'r', [
+        BigQueryTestSchemaField('s', 'string', 'r.s', None, True, False, True),
+    ], False, True, True),
+]
+
+
+def table(definition):
+    return table_from_definition_string(definition, SCHEMA)
+
+
+class TestUnorderedComparison(unittest.TestCase):
+
+    def test_unordered_equal(self):
+        table1 = table('''
+            id  r.s
+            1   a
+                b
+            2   c
+        ''')
+        table2 = table('''
+            id  r.s
+            2   c
+            1   a
+                b
+        ''')
+        self.assertFalse(tables_equal(table1, table2))
+        self.assertTrue(tables_equal(table1, table2, ordered=False))
+        self.assertTrue(tables_equal(table1, table2, key='id'))
+
+    def test_unordered_repeated_order_matters(self):
+        table1 = table('''
+            id  r.s
+            1   a
+                b
+        ''')
+        table2 = table('''
+            id  r.s
+            1   b
+                a
+        ''')
+        self.assertFalse(tables_equal(table1, table2, ordered=False))
+
+    def test_unordered_multiset(self):
+        table1 = table('''
+            id  r.s
+            1   a
+            1   a
+        ''')
+        table2 = table('''
+            id  r.s
+            1   a
+        ''')
+        diff = diff_unordered_records(table1.data, table2.data)
+        self.assertEquals(diff.only1, [{'id': 1, 'r': [{'s': 'a'}]}])
+        self.assertEquals(diff.only2, [])
+
+    def test_keyed_diff(self):
+        table1 = table('''
+            id  r.s
+            1   a
+            2   b
+            3   c
+        ''')
+        table2 = table('''
+            id  r.s
+            3   c
+            2   x
+            4   d
+        ''')
+        diff = diff_keyed_records(table1.data, table2.data, ['id'])
+        actual, expected = diff.render(SCHEMA)
+        self.assertMultiLineEqual(actual, 'id  r.s\n1   a\n2   b')
+        self.assertMultiLineEqual(expected, 'id  r.s\n2   x\n4   d')
+
+    def test_keyed_duplicate(self):
+        table1 = table('''
+            id  r.s
+            1   a
+            1   b
+        ''')
+        with self.assertRaises(ValueError):
+            diff_keyed_records(table1.data, table1.data, ['id'])
+
+    def test_explicit_null_matches_missing_field(self):
+        records = [{'id': 1, 'name': Null(), 'r': []}]
+        api_records = [{'id': 1}]
+        self.assertIsNone(diff_unordered_records(records, api_records))
+        self.assertIsNone(diff_keyed_records(records, api_records, ['id']))
+
+    def test_max_records(self):
+        records1 = [{'id': i} for i in range(10)]
+        records2 = [{'id': i} for i in range(10, 20)]
+        diff = diff_unordered_records(records1, records2, max_records=2)
+        self.assertEquals(diff.only1, [{'id': 0}, {'id': 1}])
+        self.assertEquals(diff.only2, [{'id': 10}, {'id': 11}])
+        self.assertEquals(diff.num_mismatches, 10)
+
+        diff = diff_keyed_records(records1, records2, ['id'], max_records=2)
+        self.assertEquals(diff.only1, [{'id': 0}, {'id': 1}])
+        self.assertEquals(diff.only2, [])
+        self.assertEquals(diff.num_mismatches, 10)
@@ -0,0 +1,87 @@
+import copy
+import json
+import pickle
+import unittest
+from bigquerytest.table import BigQueryTestSchemaField, table_from_definition_string
+from bigquerytest.definition_cache import DefinitionCache, normalize_definition
+
+
+SCHEMA = [
+    BigQueryTestSchemaField('c1', 'string', 'c1', None, True, False, False),
+    BigQueryTestSchemaField('c2', 'record', 'c2', [
+        BigQueryTestSchemaField('x', 'integer', 'c2.x', None, False, True, True),
+    ], False, True, True),
+]
+
+
+class TestDefinitionCache(unittest.TestCase):
+
+    def test_parse_once(self):
+        cache = DefinitionCache()
+        definition = '''
+            c1   c2.x
+            foo  1
+                 2
+            bar  3
+        '''
+        table1 = cache.table(definition, SCHEMA)
+        table2 = cache.table('\n  c1   c2.x  \n  foo  1\n       2\n  bar  3', SCHEMA)
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+        self.assertIsNot(table1, table2)
+        self.assertIs(table1.data, table2.data)
+        self.assertEquals(table1.data, table_from_definition_string(definition, SCHEMA).data)
+        self.assertEquals(table1.schema, table2.schema)
+
+    def test_schema_is_part_of_key(self):
+        cache = DefinitionCache()
+        cache.table('c1\nfoo', SCHEMA)
+        table = cache.table('c1\nfoo', SCHEMA[:1])
+        self.assertEquals((cache.hits, cache.misses), (0, 2))
+        self.assertEquals(table.data, [{'c1': 'foo'}])
+
+    def test_records_are_read_only(self):
+        cache = DefinitionCache()
+        table = cache.table('c1   c2.x\nfoo  1\n     2', SCHEMA)
+        with self.assertRaises(TypeError):
+            table.data[0]['c1'] = 'bar'
+        with self.assertRaises(TypeError):
+            table.data[0]['c2'].append({'x': 3})
+        with self.assertRaises(TypeError):
+            table.data.sort()
+
+        table.data = table.data + [{'c1': 'bar'}]
+        self.assertEquals(len(table.data), 2)
+        self.assertEquals(len(cache.table('c1   c2.x\nfoo  1\n     2', SCHEMA).data), 1)
+
+        copied = copy.deepcopy(table.data)
+        copied[0]['c1'] = 'baz'
+        self.assertEquals(pickle.loads(pickle.dumps(table.data))[0]['c1'], 'foo')
+        self.assertEquals(json.loads(json.dumps(table.data))[0]['c1'], 'foo')
+
+    def test_shared_hash(self):
+        cache = DefinitionCache()
+        definition = 'c1   c2.x\nfoo  1\n     2'
+        table1 = cache.table(definition, SCHEMA)
+        table2 = cache.table(definition, SCHEMA)
+        expected = table_from_definition_string(definition, SCHEMA).get_hash()
+        self.assertEquals(table1.get_hash(), expected)
+        self.assertEquals(cache._entries[list(cache._entries)[0]][2], expected)
+        self.assertEquals(table2.get_hash(), expected)
+
+        table2.data = table2.data + [{'c1': 'bar'}]
+        self.assertNotEquals(table2.get_hash(), expected)
+        self.assertEquals(cache.table(definition, SCHEMA).get_hash(), expected)
+
+    def test_bounded(self):
+        cache = DefinitionCache(max_entries=2, max_bytes=20)
+        for value in ['a', 'b', 'c']:
+            cache.table('c1\n' + value, SCHEMA)
+        self.assertEquals(len(cache._entries), 2)
+        cache.table('c1\n' + 'x' * 30, SCHEMA)
+        self.assertEquals(len(cache._entries), 0)
+
+    def test_normalize_definition(self):
+        self.assertEquals(normalize_definition('\n    a  b  \n    1  2\n'), 'a  b\n1  2')
+        self.assertEquals(normalize_definition('\ta'), '\ta')
+        with self.assertRaises(ValueError):
+            DefinitionCache().table('c1\n\tfoo', SCHEMA)
@@ -0,0 +1,72 @@
+import unittest
+from mock import patch
+from bigquerytest.literals import (
+    create_table_statement, sql_literal, sql_type, struct_literal, table_literal)
+from bigquerytest.local import LocalBackend
+from bigquerytest.table import BigQueryTestTable, Null, schema_from_api_resource
+
+
+def f(name, field_type, mode='NULLABLE', fields=None):
+    return dict({'name': name, 'type': field_type, 'mode': mode},
+                **({'fields': fields} if fields else {}))
+
+
+SCHEMA = schema_from_api_resource([
+    f('i', 'INTEGER', 'REQUIRED'),
+    f('s', 'STRING'),
+    f('r', 'RECORD', 'REPEATED', [f('x', 'FLOAT'), f('b', 'BOOLEAN', 'REPEATED')]),
+])
+
+
+class TestLiterals(unittest.TestCase):
+
+    def test_sql_type(self):
+        self.assertEquals(sql_type(SCHEMA[0]), 'INT64')
+        self.assertEquals(sql_type(SCHEMA[2]), 'ARRAY<STRUCT<`x` FLOAT64, `b` ARRAY<BOOL>>>')
+        self.assertRaises(ValueError, sql_type, SCHEMA[0]._replace(type='timestamp'))
+
+    def test_sql_literal(self):
+        self.assertEquals(sql_literal("it's\n\\", SCHEMA[1]), r"'it\'s\n\\'")
+        self.assertEquals(sql_literal(None, SCHEMA[1]), 'NULL')
+        self.assertEquals(sql_literal(Null(), SCHEMA[1]), 'NULL')
+        self.assertEquals(sql_literal(float('inf'), SCHEMA[2].subfields[0]), "CAST('inf' AS FLOAT64)")
+        self.assertEquals(sql_literal([{'x': 1.5}], SCHEMA[2]),
+                          '[STRUCT(1.5 AS `x`, [] AS `b`)]')
+        self.assertRaises(ValueError, sql_literal, [{'b': [True, Null()]}], SCHEMA[2])
+
+    def test_table_literal(self):
+        table = BigQueryTestTable([{'i': 1}], SCHEMA[:2])
+        self.assertEquals(
+            table_literal(table),
+            'UNNEST(ARRAY<STRUCT<`i` INT64, `s` STRING>>[STRUCT(1 AS `i`, NULL AS `s`)])')
+
+    def test_table_literal_max_length(self):
+        table = BigQueryTestTable([{'i': i} for i in range(100)], SCHEMA[:1])
+        literal = table_literal(table)
+        self.assertEquals(table_literal(table, len(literal)), literal)
+        self.assertIsNone(table_literal(table, len(literal) - 1))
+        with patch('bigquerytest.literals.struct_literal', wraps=struct_literal) as structs:
+            self.assertIsNone(table_literal(table, 100))
+        self.assertLess(structs.call_count, 10)
+
+    def test_create_table_statement_max_length(self):
+        table = BigQueryTestTable([{'i': i} for i in range(100)], SCHEMA[:1])
+        statement = create_table_statement('p.d.t', table)
+        self.assertEquals(create_table_statement('p.d.t', table, len(statement)), statement)
+        self.assertIsNone(create_table_statement('p.d.t', table, len(statement) - 1))
+
+    def test_create_table_statement_round_trip(self):
+        records = [
+            {'i': 1, 's': "it's", 'r': [{'x': 1.5, 'b': [True, False]}, {'b': [True]}]},
+            {'i': 2},
+        ]
+        table = BigQueryTestTable(records, SCHEMA)
+        statement = create_table_statement('p.d.t', table)
+        self.assertTrue(statement.startswith(
+            'CREATE TABLE IF NOT EXISTS `p.d.t` (`i` INT64 NOT NULL, `s` STRING, '))
+
+        backend = LocalBackend()
+        backend.query(statement)
+        created = backend.tables['t']
+        self.assertEquals(created.data, records)
+        self.assertEquals(created.schema, SCHEMA)
@@ -0,0 +1,173 @@
+import unittest
+from bigquerytest.local import LocalBackend, LocalSqlError, parse
+from bigquerytest.table import table_from_definition_string
+from fake_bigquery import field
+
+
+SCHEMA = [
+    field('id', 'INTEGER'),
+    field('name', 'STRING'),
+    field('score', 'FLOAT'),
+    field('tags', 'RECORD', 'REPEATED', [
+        field('key', 'STRING'),
+        field('value', 'INTEGER'),
+    ]),
+]
+
+
+class TestLocalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LocalBackend({'p.d.users': SCHEMA})
+        table = table_from_definition_string('''
+id  name   score  tags.key  tags.value
+1   alice  1.5    a         1
+                  b         2
+2   bob    2.5    a         3
+3   carol  null
+''', self.backend.load_schema('p', 'd', 'users'))
+        self.backend.create_table('users', table)
+
+    def query(self, sql):
+        return self.backend.query(sql).prettyprint()
+
+    def test_load_schema(self):
+        schema = self.backend.load_schema('other-project', 'd', 'users')
+        self.assertEquals([f.name for f in schema], ['id', 'name', 'score', 'tags'])
+        self.assertRaises(LocalSqlError, self.backend.load_schema, 'p', 'd', 'missing')
+
+    def test_select_where_order(self):
+        self.assertEquals(self.query('''
+            SELECT id, UPPER(name) AS name FROM `p.d.users`
+            WHERE score IS NULL OR score > 2 ORDER BY id DESC
+        '''), '''
+id  name
+3   CAROL
+2   BOB
+'''.strip())
+
+    def test_star_keeps_nested_schema(self):
+        table = self.backend.query('SELECT * EXCEPT (score) FROM users WHERE id = 1')
+        self.assertEquals(table.get_column_names(), ['id', 'name', 'tags.key', 'tags.value'])
+        self.assertEquals(table.data, [{'id': 1, 'name': 'alice', 'tags': [
+            {'key': 'a', 'value': 1}, {'key': 'b', 'value': 2}]}])
+
+    def test_unnest(self):
+        self.assertEquals(self.query('''
+            SELECT u.id, t.key, o FROM users u, UNNEST(u.tags) t WITH OFFSET o
+            ORDER BY t.key, u.id
+        '''), '''
+id  key  o
+1   a    0
+2   a    0
+1   b    1
+'''.strip())
+
+    def test_group_by(self):
+        self.assertEquals(self.query('''
+            SELECT t.key, COUNT(*) n, SUM(t.value) total, ARRAY_AGG(u.name) names
+            FROM users u CROSS JOIN u.tags t
+            GROUP BY 1 HAVING n > 0 ORDER BY total DESC
+        '''), '''
+key  n  total  names
+a    2  4      alice
+               bob
+b    1  2      alice
+'''.strip())
+
+    def test_aggregate_without_rows(self):
+        self.assertEquals(self.query(
+            'SELECT COUNT(*), MAX(id) FROM users WHERE id > 10'), 'f0_  f1_\n0')
+
+    def test_aggregate_edge_cases(self):
+        table = self.backend.query('''
+            SELECT STRING_AGG(name, '-') AS names, LOGICAL_AND(score > 1) AS all_high,
+                   LOGICAL_OR(score > 9) AS any_huge
+            FROM users WHERE id > 10
+        ''')
+        self.assertEquals(table.data, [{}])
+
+        table = self.backend.query('SELECT STRING_AGG(name, \'-\') AS names FROM users')
+        self.assertEquals(table.data, [{'names': 'alice-bob-carol'}])
+
+    def test_ifnull_float(self):
+        table = self.backend.query('SELECT id, IFNULL(score, 0) AS score FROM users ORDER BY id')
+        self.assertEquals([r['score'] for r in table.data], [1.5, 2.5, 0.0])
+        self.assertIsInstance(table.data[2]['score'], float)
+
+    def test_with_union_and_left_join(self):
+        self.assertEquals(self.query('''
+            WITH names AS (
+              SELECT 1 AS id, 'one' AS label UNION ALL SELECT 4, 'four'
+            )
+            SELECT u.id, n.label FROM users u LEFT JOIN names n ON u.id = n.id
+            ORDER BY id
+        '''), '''
+id  label
+1   one
+2
+3
+'''.strip())
+
+    def test_expressions(self):
+        self.assertEquals(self.query('''
+            SELECT
+              CASE WHEN id BETWEEN 1 AND 2 THEN 'low' ELSE 'high' END AS bucket,
+              IF(name LIKE '%o%', CAST(id AS STRING), 'none') AS s,
+              ARRAY_LENGTH(tags) AS n,
+              id IN (1, 3) AS odd
+            FROM users ORDER BY id
+        '''), '''
+bucket  s     n  odd
+low     none  2  True
+low     2     1  False
+high    3     0  True
+'''.strip())
+
+    def test_struct_and_array_literals(self):
+        table = self.backend.query(
+            "SELECT [1, 2] AS xs, STRUCT(1 AS a, 'x' AS b) AS s, [1, 2][OFFSET(1)] AS y")
+        self.assertEquals(table.data, [{'xs': [1, 2], 's': {'a': 1, 'b': 'x'}, 'y': 2}])
+        self.assertEquals(table.get_column_names(), ['xs', 's.a', 's.b', 'y'])
+
+    def test_errors(self):
+        self.assertRaises(LocalSqlError, self.backend.query, 'SELECT missing FROM users')
+        self.assertRaises(LocalSqlError, self.backend.query, 'SELECT * FROM nope')
+        self.assertRaises(LocalSqlError, parse, 'SELECT FROM')
+        self.assertRaises(LocalSqlError, self.backend.query, 'SELECT 1', True)
+
+    def test_create_table_script(self):
+        self.backend.query('''
+            CREATE TABLE IF NOT EXISTS `p.d.names` (id INT64 NOT NULL, name STRING) AS
+            SELECT id, name FROM users WHERE id < 3;
+            CREATE TABLE IF NOT EXISTS `p.d.names` AS SELECT 1 AS id;
+        ''')
+        table = self.backend.tables['names']
+        self.assertEquals(table.data, [{'id': 1, 'name': 'alice'}, {'id': 2, 'name': 'bob'}])
+        self.assertFalse(table.schema[0].nullable)
+        self.assertRaises(LocalSqlError, self.backend.query,
+                          'CREATE TABLE names AS SELECT 1 AS id')
+
+    def test_drop_table_script(self):
+        self.backend.query('CREATE TABLE `p.d.names` AS SELECT 1 AS id')
+        self.backend.query('DROP TABLE `p.d.names`; DROP TABLE IF EXISTS `p.d.names`')
+        self.assertNotIn('names', self.backend.tables)
+        self.assertRaises(LocalSqlError, self.backend.query, 'DROP TABLE names')
+        self.assertRaises(LocalSqlError, self.backend.query, 'DROP VIEW users')
+
+    def test_dry_run(self):
+        result = self.backend.dry_run('''
+            CREATE TABLE `p.d.names` AS SELECT name FROM users;
+            SELECT u.id, v.name FROM `p.d.users` u JOIN users v USING (id)
+        ''')
+        self.assertEquals(result.referenced_tables, ['p.d.users', 'users'])
+        self.assertEquals([f.name for f in result.schema], ['id', 'name'])
+        self.assertGreater(result.bytes_processed, 0)
+        self.assertNotIn('names', self.backend.tables)
+        self.assertRaises(LocalSqlError, self.backend.dry_run, 'SELECT * FROM nope')
+        self.assertRaises(LocalSqlError, self.backend.dry_run, 'SELECT 1', True)
+
+    def test_delete_table(self):
+        self.assertEquals(self.backend.list_tables(), ['users'])
+        self.backend.delete_table('users')
+        self.assertEquals(self.backend.list_tables(), [])
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from bigquerytest.metrics import Counters, JsonLinesSink, MetricsCollector
+from bigquerytest.wait import Waiter
+from fake_bigquery import FakeClock
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.events = []
+        self.collector = MetricsCollector([self.events.append], clock=self.clock)
+
+    def run_test(self, test_id, seconds, counters=None):
+        counters = counters or Counters()
+        metrics = self.collector.start_test(test_id)
+        with metrics.phase('create_table', table='t1'):
+            counters.add('bytes_uploaded', 100)
+            counters.add('api_calls', 3)
+            self.clock.now += seconds
+        with metrics.phase('query', sql='select 1') as phase:
+            counters.add('api_calls', 2)
+            phase['rows'] = 4
+            self.clock.now += 2 * seconds
+        self.collector.finish_test(metrics)
+        return metrics
+
+    def test_phases(self):
+        metrics = self.run_test('test_a', 1.0)
+        self.assertEquals(self.events, [
+            {'test': 'test_a', 'phase': 'create_table', 'seconds': 1.0, 'table': 't1',
+             'bytes_uploaded': 100, 'api_calls': 3},
+            {'test': 'test_a', 'phase': 'query', 'seconds': 2.0, 'sql': 'select 1',
+             'rows': 4, 'api_calls': 2},
+            {'test': 'test_a', 'phase': 'test', 'seconds': 3.0},
+        ])
+        self.assertEquals(metrics.totals()['create_table'], {
+            'count': 1, 'seconds': 1.0, 'bytes_uploaded': 100, 'api_calls': 3})
+
+    def test_phase_with_error(self):
+        metrics = self.collector.start_test('test_a')
+        with self.assertRaises(ValueError):
+            with metrics.phase('query'):
+                self.clock.now += 1
+                raise ValueError()
+        self.assertEquals(self.events, [{'test': 'test_a', 'phase': 'query', 'seconds': 1.0}])
+
+    def test_summary(self):
+        self.run_test('test_a', 1.0)
+        self.run_test('test_b', 3.0)
+        self.run_test('test_c', 2.0)
+        summary = self.collector.summary(top=2)
+        self.assertEquals(summary['num_tests'], 3)
+        self.assertEquals(summary['seconds'], 18.0)
+        self.assertEquals(summary['phases']['query'], {
+            'count': 3, 'seconds': 12.0, 'rows': 12, 'api_calls': 6})
+        self.assertEquals([t['test'] for t in summary['slowest_tests']], ['test_b', 'test_c'])
+        self.assertEquals([(p['test'], p['phase']) for p in summary['slowest_phases']],
+                          [('test_b', 'query'), ('test_c', 'query')])
+
+        report = self.collector.report(top=2)
+        self.assertIn('3 tests, 18.000s', report)
+        self.assertIn('query               3    12.000s  api_calls=6, rows=12', report)
+        self.assertIn('      6.000s  query          test_b\n', report)
+
+    def test_nested_phases_count_once(self):
+        counters = Counters()
+        metrics = self.collector.start_test('test_a')
+        with metrics.phase('compare'):
+            self.clock.now += 1
+            with metrics.phase('parse'):
+                counters.add('api_calls', 1)
+                self.clock.now += 2
+        self.assertEquals(metrics.totals(), {
+            'compare': {'count': 1, 'seconds': 1.0},
+            'parse': {'count': 1, 'seconds': 2.0, 'api_calls': 1},
+        })
+
+    def test_concurrent_phases_count_their_own_work(self):
+        counters = Counters()
+        metrics = self.collector.start_test('test_a')
+        started = threading.Barrier(4) if hasattr(threading, 'Barrier') else None
+
+        def create(size):
+            with metrics.phase('create_table'):
+                if started is not None:
+                    started.wait()
+                counters.add('bytes_uploaded', size)
+
+        threads = [threading.Thread(target=create, args=(size,)) for size in [3, 6, 9, 18]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(metrics.totals()['create_table']['bytes_uploaded'], 36)
+        self.assertEquals(counters.snapshot(), {'bytes_uploaded': 36})
+
+    def test_submitted_work_counts_toward_phase(self):
+        counters = Counters()
+        waiter = Waiter()
+        self.addCleanup(waiter.close)
+        metrics = self.collector.start_test('test_a')
+        with metrics.phase('query'):
+            waiter.submit(counters.add, 'api_calls', 2).get()
+        waiter.submit(counters.add, 'api_calls', 5).get()
+        self.assertEquals(metrics.totals()['query']['api_calls'], 2)
+
+    def test_keeps_slowest_phases_without_sql(self):
+        collector = MetricsCollector(clock=self.clock, keep_slowest=2)
+        metrics = collector.start_test('test_a')
+        for seconds in [1, 3, 2, 0.5]:
+            with metrics.phase('query', sql='select %s' % seconds):
+                self.clock.now += seconds
+        collector.finish_test(metrics)
+        summary = collector.summary()
+        self.assertEquals(summary['slowest_phases'], [
+            {'test': 'test_a', 'phase': 'query', 'seconds': 3.0},
+            {'test': 'test_a', 'phase': 'query', 'seconds': 2.0},
+        ])
+        self.assertEquals(summary['phases']['query'], {'count': 4, 'seconds': 6.5})
+
+    def test_json_output(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.collector.add_sink(JsonLinesSink(os.path.join(directory, 'events.jsonl')))
+        self.run_test('test_a', 1.0)
+        self.collector.write_json(os.path.join(directory, 'summary.json'))
+
+        with open(os.path.join(directory, 'events.jsonl')) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEquals([e['phase'] for e in events], ['create_table', 'query', 'test'])
+        with open(os.path.join(directory, 'summary.json')) as f:
+            summary = json.load(f)
+        self.assertEquals(summary['tests'][0]['phases']['query']['rows'], 4)
@@ -0,0 +1,204 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from mock import patch
+from bigquerytest.backend import BigQueryBackend
+from bigquerytest.parallel import FileLock, TableLeases, main, partition
+from bigquerytest.registry import MockTableRegistry
+from fake_bigquery import FakeBigQuery, field
+from test_testcase import BigQueryTestCaseFakeDummy
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class TestTableLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_first_and_last_holder(self):
+        key = ('my-project', 'my_dataset', 'a')
+        mine = TableLeases(self.directory)
+        other = TableLeases(self.directory, pid=os.getppid())
+        with mine.lock(key):
+            self.assertTrue(mine.acquire(key))
+        with other.lock(key):
+            self.assertFalse(other.acquire(key))
+        with mine.lock(key):
+            self.assertFalse(mine.acquire(key))
+            self.assertFalse(mine.release(key))
+            self.assertFalse(mine.release(key))
+        with other.lock(key):
+            self.assertTrue(other.release(key))
+        self.assertEquals(mine.holders(key), {})
+
+    def test_dead_holders_are_ignored(self):
+        key = ('my-project', 'my_dataset', 'a')
+        dead = TableLeases(self.directory, pid=2 ** 22 + 1)
+        dead.acquire(key)
+        leases = TableLeases(self.directory)
+        self.assertEquals(leases.holders(key), {})
+        self.assertTrue(leases.acquire(key))
+        self.assertTrue(leases.release(key))
+
+    def test_file_lock(self):
+        path = os.path.join(self.directory, 'x.lock')
+        inside = []
+
+        def work():
+            for _ in range(50):
+                with FileLock(path):
+                    inside.append(1)
+                    self.assertEquals(len(inside), 1)
+                    inside.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_partition(self):
+        groups = partition({'a': 10, 'b': 6, 'c': 5, 'd': 3, 'e': 1}, 2)
+        self.assertEquals(groups, [['a', 'd'], ['b', 'c', 'e']])
+        self.assertEquals(partition({'a': 1}, 4), [['a']])
+
+
+class TestWorkerIsolation(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBigQuery()
+        self.fake.add_table('src', 'data', 'a', [field('x', 'INTEGER')])
+        patcher = patch('google.cloud.bigquery.Client', self.fake.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lease_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lease_dir)
+
+    def run_test(self, test_class, worker='w1'):
+        environ = {'BIGQUERYTEST_WORKER': worker, 'BIGQUERYTEST_LEASE_DIR': self.lease_dir}
+        with patch.dict(os.environ, environ):
+            test = test_class()
+            test.setUp()
+            test.mock_table('src.data.a', '''
+                x
+                1
+            ''')
+            test.query('select * from src.data.a')
+            test.doCleanups()
+        return [(c[0], c[1:]) for c in self.fake.calls]
+
+    def mock_tables(self):
+        return [key for key in self.fake.tables if key[0] == 'my-project']
+
+    def test_leases(self):
+        calls = self.run_test(BigQueryTestCaseFakeDummy)
+        self.assertEquals(self.mock_tables(), [])
+        table_name = [args[0] for call, args in calls if call == 'create'][0]
+
+        # another worker still uses the table
+        key = ('my-project', 'my_dataset', table_name)
+        other = TableLeases(self.lease_dir, pid=os.getppid())
+        other.acquire(key)
+        self.run_test(BigQueryTestCaseFakeDummy)
+        self.assertEquals(self.mock_tables(), [key])
+        self.assertEquals(self.fake.count('delete'), 1)
+
+        other.release(key)
+        self.run_test(BigQueryTestCaseFakeDummy)
+        self.assertEquals(self.mock_tables(), [])
+        self.assertEquals(self.fake.count('delete'), 2)
+
+    def test_registry_ignores_leased_tables(self):
+
+        class RegistryDummy(BigQueryTestCaseFakeDummy):
+            mock_table_registry = MockTableRegistry()
+
+        calls = self.run_test(RegistryDummy)
+        table_name = [args[0] for call, args in calls if call == 'create'][0]
+        key = ('my-project', 'my_dataset', table_name)
+        self.assertEquals(self.mock_tables(), [key])
+
+        # another worker is still uploading the listed table
+        other = TableLeases(self.lease_dir, pid=os.getppid())
+        other.acquire(key)
+        RegistryDummy.mock_table_registry = registry = MockTableRegistry()
+        self.run_test(RegistryDummy)
+        self.assertEquals(registry.stats()['hits'], 0)
+        self.assertEquals(list(TableLeases(self.lease_dir).holders(key)), [str(os.getppid())])
+
+    def test_lease_released_when_create_fails(self):
+        self.fake.fail_tables = set(['_a_'])
+        environ = {'BIGQUERYTEST_WORKER': 'w1', 'BIGQUERYTEST_LEASE_DIR': self.lease_dir}
+        with patch.dict(os.environ, environ):
+            test = BigQueryTestCaseFakeDummy()
+            test.setUp()
+            with self.assertRaises(Exception):
+                test.mock_table('src.data.a', '''
+                    x
+                    1
+                ''')
+            test.doCleanups()
+        table_name = [c[1] for c in self.fake.calls if c[0] == 'create'][0]
+        leases = TableLeases(self.lease_dir)
+        self.assertEquals(leases.holders(('my-project', 'my_dataset', table_name)), {})
+
+    def test_tables(self):
+
+        class TablesDummy(BigQueryTestCaseFakeDummy):
+            worker_isolation = 'tables'
+
+        calls = self.run_test(TablesDummy, 'w3')
+        created = [args[0] for call, args in calls if call == 'create']
+        self.assertEquals(len(created), 1)
+        self.assertTrue(created[0].startswith('bigquery_test_mock_w3_a_'))
+        self.assertEquals(self.mock_tables(), [])
+
+    def test_dataset(self):
+
+        class DatasetDummy(BigQueryTestCaseFakeDummy):
+            worker_isolation = 'dataset'
+
+        self.addCleanup(BigQueryBackend._datasets.clear)
+        self.run_test(DatasetDummy, 'w4')
+        self.run_test(DatasetDummy, 'w4')
+        self.assertEquals(self.fake.datasets, set([('my-project', 'my_dataset_w4')]))
+        self.assertEquals(self.fake.count('create_dataset'), 1)
+        self.assertEquals(self.fake.count('dataset_exists'), 1)
+        queries = [c[1] for c in self.fake.calls if c[0] == 'query']
+        self.assertIn('my_dataset_w4.bigquery_test_mock_a_', queries[-1])
+
+
+class TestRunner(unittest.TestCase):
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for i in range(3):
+            with open(os.path.join(directory, 'test_w%d.py' % i), 'w') as f:
+                f.write(
+                    'import os, unittest\n'
+                    'class TestW%d(unittest.TestCase):\n'
+                    '    def test_worker(self):\n'
+                    '        self.assertTrue(os.environ["BIGQUERYTEST_WORKER"])\n'
+                    '        self.assertTrue(os.path.isdir(os.environ["BIGQUERYTEST_LEASE_DIR"]))\n'
+                    % i)
+
+        stdout = StringIO()
+        with patch.object(sys, 'stdout', stdout), patch.object(sys, 'path', list(sys.path)):
+            status = main(['-n', '2', '-s', directory])
+        self.assertEquals(status, 0, stdout.getvalue())
+        output = stdout.getvalue()
+        self.assertIn('==== worker w0 (2 classes) ====', output)
+        self.assertIn('==== worker w1 (1 classes) ====', output)
+        self.assertIn('3 test classes on 2 workers', output)
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from bigquerytest.registry import MockTableRegistry
+from fake_bigquery import FakeClock
+
+
+class TestMockTableRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'registry.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_stats(self):
+        registry = MockTableRegistry()
+        self.assertFalse(registry.lookup(('p', 'd', 'mock_a')))
+        registry.register(('p', 'd', 'mock_a'))
+        self.assertTrue(registry.lookup(('p', 'd', 'mock_a')))
+        self.assertEquals(registry.stats(), {
+            'tables': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_persisted(self):
+        MockTableRegistry(self.path).register(('p', 'd', 'mock_a'))
+        self.assertTrue(MockTableRegistry(self.path).lookup(('p', 'd', 'mock_a')))
+
+    def test_reconcile(self):
+        registry = MockTableRegistry(self.path)
+        registry.register(('p', 'd', 'mock_gone'))
+        registry.register(('p', 'other', 'mock_kept'))
+        listed = []
+        list_table_names = lambda: listed.append(1) or ['mock_new', 'unrelated']
+        self.assertTrue(registry.reconcile('p', 'd', list_table_names, 'mock_'))
+        self.assertFalse(registry.reconcile('p', 'd', list_table_names, 'mock_'))
+        self.assertEquals(len(listed), 1)
+
+        self.assertTrue(registry.lookup(('p', 'd', 'mock_new')))
+        self.assertTrue(registry.lookup(('p', 'other', 'mock_kept')))
+        self.assertFalse(registry.lookup(('p', 'd', 'mock_gone')))
+        self.assertFalse(registry.lookup(('p', 'd', 'unrelated')))
+
+    def test_reconcile_skips_tables_in_use(self):
+        registry = MockTableRegistry(self.path)
+        registry.reconcile('p', 'd', lambda: ['mock_a', 'mock_uploading'], 'mock_',
+                           lambda name: name == 'mock_uploading')
+        self.assertTrue(registry.lookup(('p', 'd', 'mock_a')))
+        self.assertFalse(registry.lookup(('p', 'd', 'mock_uploading')))
+
+    def test_stale(self):
+        clock = FakeClock()
+        registry = MockTableRegistry(ttl=60, clock=clock)
+        registry.register(('p', 'd', 'mock_a'))
+        registry.register(('p', 'd', 'mock_b'))
+        registry.acquire(('p', 'd', 'mock_b'))
+        clock.now += 61
+        self.assertEquals(registry.stale('p', 'd'), [('p', 'd', 'mock_a')])
+
+        registry.release(('p', 'd', 'mock_b'))
+        self.assertEquals(registry.refcount(('p', 'd', 'mock_b')), 0)
+        clock.now += 61
+        self.assertEquals(registry.stale('p', 'd'), [('p', 'd', 'mock_a'), ('p', 'd', 'mock_b')])
+
+    def test_shared_between_processes(self):
+        registry = MockTableRegistry(self.path, ttl=60, clock=FakeClock())
+        other = MockTableRegistry(self.path, ttl=60, clock=registry.clock)
+        registry.register(('p', 'd', 'mock_a'))
+        other.register(('p', 'd', 'mock_b'))
+        self.assertTrue(registry.lookup(('p', 'd', 'mock_b')))
+        self.assertTrue(other.acquire_registered(('p', 'd', 'mock_a')))
+        self.assertFalse(other.acquire_registered(('p', 'd', 'mock_c')))
+        self.assertEquals(registry.refcount(('p', 'd', 'mock_a')), 1)
+
+        registry.clock.now += 61
+        deleted = []
+        self.assertEquals(registry.delete_stale('p', 'd', deleted.append), [('p', 'd', 'mock_b')])
+        self.assertEquals(deleted, ['mock_b'])
+        self.assertFalse(other.lookup(('p', 'd', 'mock_b')))
+
+    def test_unchanged_registry_is_not_written(self):
+        registry = MockTableRegistry(self.path, ttl=60, clock=FakeClock())
+        registry.register(('p', 'd', 'mock_a'))
+        with patch.object(registry, 'save') as save:
+            registry.reconcile('p', 'd', lambda: ['mock_a'], 'mock_')
+            registry.delete_stale('p', 'd', lambda name: None)
+            registry.release(('p', 'd', 'mock_missing'))
+        self.assertEquals(save.call_count, 0)
+
+    def test_dead_holders(self):
+        clock = FakeClock()
+        registry = MockTableRegistry(self.path, ttl=60, clock=clock)
+        registry.register(('p', 'd', 'mock_a'))
+        with open(self.path) as f:
+            entries = json.load(f)
+        entries[0]['holders'] = {str(2 ** 22 + 1): 1}
+        with open(self.path, 'w') as f:
+            json.dump(entries, f)
+
+        self.assertEquals(registry.refcount(('p', 'd', 'mock_a')), 0)
+        clock.now += 61
+        self.assertEquals(registry.stale('p', 'd'), [('p', 'd', 'mock_a')])
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from bigquerytest.table import BigQueryTestSchemaField, BigQueryTestTable, Null
+from bigquerytest.result_cache import QueryResultCache
+
+
+SCHEMA = [
+    BigQueryTestSchemaField('c1', 'string', 'c1', None, True, False, False),
+    BigQueryTestSchemaField('c2', 'integer', 'c2', None, False, True, True),
+]
+
+
+class TestQueryResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_roundtrip(self):
+        cache = QueryResultCache(self.directory)
+        key = cache.key('p', 'select 1', False, ['mock_a', 'mock_b'])
+        self.assertIsNone(cache.get(key))
+        cache.put(key, BigQueryTestTable([{'c1': 'foo', 'c2': [1, 2]}], SCHEMA))
+
+        table = QueryResultCache(self.directory).get(key)
+        self.assertEquals(table.data, [{'c1': 'foo', 'c2': [1, 2]}])
+        self.assertEquals(table.schema, SCHEMA)
+
+    def test_null_values(self):
+        cache = QueryResultCache(self.directory)
+        cache.put('k', BigQueryTestTable([{'c1': Null(), 'c2': [1]}, {'c1': 'null'}], SCHEMA))
+        table = cache.get('k')
+        self.assertIsInstance(table.data[0]['c1'], Null)
+        self.assertEquals(table.data[0]['c2'], [1])
+        self.assertEquals(table.data[1], {'c1': 'null'})
+
+    def test_key(self):
+        cache = QueryResultCache(self.directory)
+        key = cache.key('p', 'select 1', False, ['mock_a', 'mock_b'])
+        self.assertEquals(key, cache.key('p', 'select 1', False, ['mock_b', 'mock_a']))
+        self.assertNotEquals(key, cache.key('p', 'select 2', False, ['mock_a', 'mock_b']))
+        self.assertNotEquals(key, cache.key('p', 'select 1', True, ['mock_a', 'mock_b']))
+        self.assertNotEquals(key, cache.key('p', 'select 1', False, ['mock_a', 'mock_c']))
+
+    def test_eviction(self):
+        cache = QueryResultCache(self.directory, max_bytes=0)
+        table = BigQueryTestTable([{'c1': 'foo'}], SCHEMA)
+        cache.put('a', table)
+        self.assertEquals(os.listdir(self.directory), [])
+
+        cache.max_bytes = 1024 * 1024
+        cache.put('a', table)
+        size = os.path.getsize(os.path.join(self.directory, 'a.result.json.gz'))
+        os.utime(os.path.join(self.directory, 'a.result.json.gz'), (time.time() - 10,) * 2)
+        cache.put('b', table)
+        os.utime(os.path.join(self.directory, 'b.result.json.gz'), (time.time() - 5,) * 2)
+        cache.get('a')
+
+        cache.max_bytes = size + 1
+        cache.put('c', table)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
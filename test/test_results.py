@@ -0,0 +1,50 @@
+import unittest
+from bigquerytest.results import QueryResultReader, ResultTooLargeError, row_size
+from bigquerytest.wait import Waiter
+from fake_bigquery import FakeBigQuery, field
+
+
+class TestQueryResultReader(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBigQuery()
+        self.fake.page_size = 4
+        self.fake.queries['job'] = {
+            'schema': [field('s', 'STRING')],
+            'rows': [{'f': [{'v': 'row%02d' % i}]} for i in range(10)],
+        }
+        self.client = self.fake.client('p')
+
+    def test_follows_page_tokens(self):
+        reader = QueryResultReader(self.client, 'p', 'job')
+        rows = [row['f'][0]['v'] for row in reader.rows()]
+        self.assertEquals(rows, ['row%02d' % i for i in range(10)])
+        self.assertEquals(reader.num_pages, 3)
+
+    def test_prefetch(self):
+        waiter = Waiter()
+        self.addCleanup(waiter.close)
+        reader = QueryResultReader(self.client, 'p', 'job', waiter=waiter)
+        table = reader.read_table()
+        self.assertEquals(len(table.data), 10)
+        self.assertEquals(self.fake.count('api_request'), 3)
+
+    def test_page_size(self):
+        reader = QueryResultReader(self.client, 'p', 'job', page_size=5)
+        list(reader.rows())
+        self.assertEquals(reader.num_pages, 2)
+
+    def test_max_bytes(self):
+        reader = QueryResultReader(self.client, 'p', 'job', max_bytes=25)
+        with self.assertRaises(ResultTooLargeError):
+            list(reader.rows())
+        self.assertEquals(reader.num_bytes, 30)
+
+    def test_row_size_counts_bytes(self):
+        self.assertEquals(row_size({'f': [{'v': u'\u00e5\u00e4'}, {'v': None}, {'v': [{'v': 'ab'}]}]}), 6)
+
+    def test_empty_result(self):
+        self.fake.queries['job']['rows'] = []
+        table = QueryResultReader(self.client, 'p', 'job').read_table()
+        self.assertEquals(table.data, [])
+        self.assertEquals(table.get_column_names(), ['s'])
@@ -0,0 +1,76 @@
+import unittest
+from bigquerytest.rewrite import (
+    TableRewriter, add_ctes, keep_implicit_alias, parse_table_id, unreplaced_references)
+
+
+class TestTableRewriter(unittest.TestCase):
+
+    def test_parse_table_id(self):
+        self.assertEquals(parse_table_id('`a-b.c.d`', 'p'), ('a-b', 'c', 'd'))
+        self.assertEquals(parse_table_id('[a:c.d]', 'p'), ('a', 'c', 'd'))
+        self.assertEquals(parse_table_id('c.d', 'p'), ('p', 'c', 'd'))
+        with self.assertRaises(ValueError):
+            parse_table_id('d', 'p')
+
+    def test_rewrite_substring_table(self):
+        rewriter = TableRewriter({'p.a.t': 'MOCK1', 'p.a.t_2': 'MOCK2'}, 'p')
+        sql = 'select * from a.t join a.t_2 using (id) join xa.t using (id)'
+        self.assertEquals(
+            rewriter.rewrite(sql),
+            'select * from MOCK1 join MOCK2 using (id) join xa.t using (id)')
+
+    def test_rewrite_skips_strings_and_comments(self):
+        rewriter = TableRewriter({'p.a.t': 'MOCK'}, 'p')
+        sql = '''
+            -- reads from a.t
+            # also a.t
+            select 'a.t', "a.t", """a.t
+            """, r'a\\'.t' /* a.t */
+            from `p.a.t`
+        '''
+        expected = '''
+            -- reads from a.t
+            # also a.t
+            select 'a.t', "a.t", """a.t
+            """, r'a\\'.t' /* a.t */
+            from MOCK
+        '''
+        self.assertMultiLineEqual(rewriter.rewrite(sql), expected)
+
+    def test_rewrite_reports_replacements(self):
+        replaced = []
+        rewriter = TableRewriter({'p.a.t': 'MOCK'}, 'p')
+        rewriter.rewrite('select * from a.t, [p:a.t], b.t', replaced.append)
+        self.assertEquals(replaced, ['a.t', '[p:a.t]'])
+
+    def test_add_ctes(self):
+        ctes = [('t', 'SELECT 1 AS x'), ('u', 'SELECT 2 AS y')]
+        self.assertEquals(add_ctes('select * from t', []), 'select * from t')
+        self.assertEquals(
+            add_ctes('select * from t, u', ctes),
+            'WITH `t` AS (SELECT 1 AS x),\n`u` AS (SELECT 2 AS y)\nselect * from t, u')
+        self.assertEquals(
+            add_ctes('-- with comment\nwith v as (select 3) select * from t, v', ctes[:1]),
+            '-- with comment\nwith\n`t` AS (SELECT 1 AS x), v as (select 3) select * from t, v')
+        self.assertEquals(
+            add_ctes('WITH RECURSIVE v AS (select 3) select * from t, v', ctes[:1]),
+            'WITH RECURSIVE\n`t` AS (SELECT 1 AS x), v AS (select 3) select * from t, v')
+
+    def test_keep_implicit_alias(self):
+        rewriter = TableRewriter({'p.a.t': keep_implicit_alias('`cte`', 't')}, 'p')
+        self.assertEquals(
+            rewriter.rewrite('select t.x from a.t where x > 1'),
+            'select t.x from `cte` AS `t` where x > 1')
+        self.assertEquals(
+            rewriter.rewrite('select u.x from a.t u join a.t as v using (x) join a.t\nleft join b'),
+            'select u.x from `cte` u join `cte` as v using (x) join `cte` AS `t`\nleft join b')
+
+    def test_unreplaced_references(self):
+        sql = '''
+            select 'src.data.a' from `p.d.bigquery_test_mock_a_123`  -- src.data.a
+            join `data`.`a` using (x) join data . a using (x) /* data.a */
+            join src.data.ab using (x) join mydata.a using (x) join data.b using (x)
+        '''
+        self.assertEquals(unreplaced_references(sql, ['src.data.a', 'data.c'], 'p'),
+                          ['`data`.`a`', 'data . a'])
+        self.assertEquals(unreplaced_references(sql, [], 'p'), [])
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+from bigquerytest.table import BigQueryTestSchemaField
+from bigquerytest.schema_cache import SchemaCache
+from fake_bigquery import FakeClock
+
+
+SCHEMA = [
+    BigQueryTestSchemaField('c1', 'string', 'c1', None, True, False, False),
+    BigQueryTestSchemaField('c2', 'record', 'c2', [
+        BigQueryTestSchemaField('x', 'integer', 'c2.x', None, False, True, True),
+    ], False, True, True),
+]
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_or_load_memory(self):
+        cache = SchemaCache()
+        loads = []
+        load = lambda: loads.append(1) or SCHEMA
+        self.assertEquals(cache.get_or_load(('p', 'd', 't'), load), SCHEMA)
+        self.assertEquals(cache.get_or_load(('p', 'd', 't'), load), SCHEMA)
+        self.assertEquals(len(loads), 1)
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+
+    def test_shared_through_disk(self):
+        SchemaCache(self.directory).put(('p', 'd', 't'), SCHEMA)
+        self.assertEquals(SchemaCache(self.directory).get(('p', 'd', 't')), SCHEMA)
+        self.assertIsNone(SchemaCache(self.directory).get(('p', 'd', 'other')))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = SchemaCache(self.directory, ttl=60, clock=clock)
+        cache.put(('p', 'd', 't'), SCHEMA)
+        clock.now += 59
+        self.assertEquals(cache.get(('p', 'd', 't')), SCHEMA)
+        clock.now += 2
+        self.assertIsNone(cache.get(('p', 'd', 't')))
+
+    def test_lru_eviction(self):
+        cache = SchemaCache(max_entries=2)
+        cache.put(('p', 'd', 'a'), SCHEMA)
+        cache.put(('p', 'd', 'b'), SCHEMA)
+        cache.get(('p', 'd', 'a'))
+        cache.put(('p', 'd', 'c'), SCHEMA)
+        self.assertIsNotNone(cache.get(('p', 'd', 'a')))
+        self.assertIsNone(cache.get(('p', 'd', 'b')))
+
+    def test_invalidate(self):
+        cache = SchemaCache(self.directory)
+        cache.put(('p', 'd', 't'), SCHEMA)
+        cache.invalidate(('p', 'd', 't'))
+        self.assertIsNone(cache.get(('p', 'd', 't')))
+        self.assertIsNone(SchemaCache(self.directory).get(('p', 'd', 't')))
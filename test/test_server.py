@@ -0,0 +1,259 @@
+import shutil
+import tempfile
+import unittest
+from google.cloud.exceptions import BadRequest, InternalServerError
+from bigquerytest.backend import BigQueryBackend
+from bigquerytest.metrics import MetricsCollector
+from bigquerytest.result_cache import QueryResultCache
+from bigquerytest.server import FakeBigQueryServer
+from bigquerytest.testcase import BigQueryTestCase
+from bigquerytest.wait import Waiter
+
+
+class BigQueryTestCaseServerDummy(BigQueryTestCase):
+    project = 'my-project'
+    dataset = 'my_dataset'
+    schema_cache = None
+    waiter = Waiter(initial_delay=0.001)
+    result_page_size = 2
+
+    def __init__(self, api_endpoint):
+        super(BigQueryTestCaseServerDummy, self).__init__(methodName='__class__')
+        self._api_endpoint = api_endpoint
+
+    @property
+    def api_endpoint(self):
+        return self._api_endpoint
+
+
+class TestFakeBigQueryServer(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.server = FakeBigQueryServer(sleep=self.sleeps.append).start()
+        self.addCleanup(self.server.stop)
+        self.server.add_table('src.data.a', [
+            {'name': 'x', 'type': 'INTEGER'},
+            {'name': 'r', 'type': 'RECORD', 'mode': 'REPEATED', 'fields': [
+                {'name': 's', 'type': 'STRING'}]},
+        ])
+
+    def make_test(self):
+        test = BigQueryTestCaseServerDummy(self.server.url)
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  r.s
+            1  a
+               b
+            2
+            3  c
+        ''')
+        return test
+
+    def test_mock_and_query(self):
+        test = self.make_test()
+        self.assertEquals(len(self.server.tables), 2)
+
+        actual = test.query('select x, r from src.data.a where x != 2 order by x desc')
+        test.assert_tables_equal(actual, '''
+            x  r.s
+            3  c
+            1  a
+               b
+        ''')
+        self.assertEquals(self.server.count('GET', '/queries/'), 1)
+
+        test.doCleanups()
+        self.assertEquals(list(self.server.tables), [('src', 'data', 'a')])
+
+    def test_metrics(self):
+        events = []
+
+        class MetricsDummy(BigQueryTestCaseServerDummy):
+            metrics = MetricsCollector([events.append])
+            fetch_bytes_billed = True
+
+        test = MetricsDummy(self.server.url)
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  r.s
+            1  a
+            2
+        ''')
+        actual = test.query('select x from src.data.a')
+        test.assert_tables_equal(actual, '''
+            x
+            1
+            2
+        ''')
+        test.doCleanups()
+
+        phases = dict((e['phase'], e) for e in events)
+        self.assertEquals(sorted(phases), [
+            'compare', 'create_table', 'delete_table', 'load_schema', 'parse', 'query', 'test'])
+        self.assertGreater(phases['load_schema']['api_calls'], 0)
+        self.assertEquals(phases['parse']['rows'], 2)
+        self.assertEquals(phases['create_table']['bytes_uploaded'],
+                          len(b'{"r": [{"s": "a"}], "x": 1}\n{"x": 2}'))
+        self.assertEquals(phases['query']['rows_returned'], 2)
+        self.assertEquals(phases['query']['queries'], 1)
+        self.assertEquals(phases['query']['bytes_processed'], len('[{"r": [{"s": "a"}], "x": 1}, {"x": 2}]'))
+        self.assertEquals(phases['query']['bytes_billed'], 10 * 1024 * 1024)
+        self.assertIn('select x from', phases['query']['sql'])
+
+        summary = MetricsDummy.metrics.summary()
+        self.assertEquals(summary['num_tests'], 1)
+        self.assertEquals(summary['phases']['query']['rows_returned'], 2)
+
+    def test_dry_run(self):
+        test = self.make_test()
+        queries = self.server.count('POST', '/queries$')
+        result = test.dry_run('select x, r from src.data.a')
+        self.assertEquals(len(result.referenced_tables), 1)
+        self.assertTrue(result.referenced_tables[0].startswith(
+            'my-project.my_dataset.bigquery_test_mock_a_'))
+        self.assertEquals([f.name for f in result.schema], ['x', 'r'])
+        self.assertEquals(result.bytes_processed, len(
+            '[{"r": [{"s": "a"}, {"s": "b"}], "x": 1}, {"x": 2}, {"r": [{"s": "c"}], "x": 3}]'))
+        self.assertEquals(self.server.count('POST', '/queries$'), queries)
+
+        test.assert_bytes_processed('select x from src.data.a', 1000)
+        with self.assertRaises(AssertionError) as cm:
+            test.assert_bytes_processed('select x from src.data.a', 10)
+        self.assertIn('more than 10', str(cm.exception))
+        with self.assertRaises(AssertionError) as cm:
+            test.dry_run('select x from `src`.`data`.`a`')
+        self.assertIn('Mocked tables not replaced in query: `data`.`a`', str(cm.exception))
+        test.doCleanups()
+
+    def test_dry_run_queries(self):
+        class BudgetDummy(BigQueryTestCaseServerDummy):
+            dry_run_queries = True
+            max_bytes_processed = 5
+
+        test = BudgetDummy(self.server.url)
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x
+            1
+        ''')
+        queries = self.server.count('POST', '/queries$')
+        with self.assertRaises(AssertionError):
+            test.query('select x from src.data.a')
+        self.assertEquals(self.server.count('POST', '/queries$'), queries)
+        self.assertEquals(test.query('select 1 as y').data, [{'y': 1}])
+        test.doCleanups()
+
+    def test_dry_run_queries_skipped_on_cache_hit(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class CachedDummy(BigQueryTestCaseServerDummy):
+            dry_run_queries = True
+            query_result_cache = QueryResultCache(directory)
+
+        for _ in range(2):
+            test = CachedDummy(self.server.url)
+            test.setUp()
+            self.assertEquals(test.query('select 1 as y').data, [{'y': 1}])
+            test.doCleanups()
+        self.assertEquals(self.server.count('POST', '/jobs$'), 1)
+        self.assertEquals(self.server.count('POST', '/queries$'), 1)
+
+    def test_job_polls(self):
+        self.server.job_polls = 2
+        test = self.make_test()
+        self.assertEquals(self.server.count('GET', '/jobs/'), 3)
+        self.assertEquals(len(test.query('select x from src.data.a').data), 3)
+        self.assertEquals(self.server.count('GET', '/queries/'), 3)
+
+    def test_latency(self):
+        self.server.latency = lambda method, path: 0.5 if method == 'POST' else 0
+        self.make_test()
+        self.assertEquals(self.sleeps, [0.5, 0.5])
+
+    def test_fail_next(self):
+        test = self.make_test()
+        self.server.fail_next(status=500, method='POST', path='/queries$')
+        with self.assertRaises(InternalServerError):
+            test.query('select x from src.data.a')
+        test.query('select x from src.data.a')
+
+    def test_failure_rate(self):
+        self.server.failure_rate = 1.0
+        with self.assertRaises(Exception):
+            self.make_test()
+
+    def test_query_errors(self):
+        test = self.make_test()
+        with self.assertRaises(BadRequest):
+            test.query('select missing from src.data.a')
+
+    def test_list_tables(self):
+        self.server.page_size = 2
+        for name in 'abc':
+            self.server.add_table('my-project.my_dataset.%s' % name, [])
+        backend = BigQueryBackend('my-project', 'my_dataset', Waiter(), self.server.url)
+        self.assertEquals(sorted(backend.list_tables()), ['a', 'b', 'c'])
+
+    def test_ensure_dataset(self):
+        self.addCleanup(BigQueryBackend._datasets.clear)
+        backend = BigQueryBackend('my-project', 'my_dataset_w0', Waiter(), self.server.url)
+        backend.ensure_dataset()
+        backend.ensure_dataset()
+        self.assertEquals(self.server.datasets, set([('my-project', 'my_dataset_w0')]))
+        self.assertEquals(len([r for r in self.server.requests if r[0] == 'POST']), 1)
+
+    def test_delete_tables(self):
+        for name in 'abc':
+            self.server.add_table('my-project.my_dataset.%s' % name, [], created=1000.0 + ord(name))
+        backend = BigQueryBackend('my-project', 'my_dataset', Waiter(), self.server.url)
+        self.assertEquals(backend.list_table_creation_times(), {
+            'a': 1097.0, 'b': 1098.0, 'c': 1099.0})
+        backend.delete_tables(['a', 'b', 'x'])
+        self.assertEquals(backend.list_tables(), ['c'])
+        self.assertEquals(self.server.count('POST', '/queries$'), 1)
+        self.assertEquals(self.server.count('DELETE', '/tables/'), 0)
+
+    def test_bulk_load(self):
+        class BulkLoadDummy(BigQueryTestCaseServerDummy):
+            bulk_load = True
+            script_load_max_bytes = 300
+
+        self.server.add_table('src.data.b', [{'name': 'y', 'type': 'STRING'}])
+        test = BulkLoadDummy(self.server.url)
+        test.setUp()
+        for i in range(3):
+            test.mock_table('src.data.b', '''
+                y
+                foo%d
+            ''' % i)
+        test.mock_table('src.data.a', '''
+            x  r.s
+            1  %s
+        ''' % ('a' * 300))
+        self.assertEquals(len(self.server.tables), 2)
+
+        actual = test.query('select y, x from src.data.a, src.data.b')
+        test.assert_tables_equal(actual, '''
+            y     x
+            foo2  1
+        ''')
+        self.assertEquals(len(self.server.tables), 6)
+        self.assertEquals(self.server.count('POST', '/queries$'), 2)
+        self.assertEquals(self.server.count('POST', '/upload/'), 1)
+
+    def test_bulk_load_cleanup_drops_pending_uploads(self):
+        class BulkLoadDummy(BigQueryTestCaseServerDummy):
+            bulk_load = True
+
+        test = BulkLoadDummy(self.server.url)
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  r.s
+            1  a
+        ''')
+        test.doCleanups()
+        self.assertEquals(len(self.server.tables), 1)
+        self.assertEquals(self.server.count('POST', '/queries$'), 0)
+        self.assertEquals(self.server.count('DELETE', '/tables/'), 0)
@@ -1,11 +1,15 @@
 import unittest
+from io import StringIO
 from bigquerytest.table import (
     parse_column_header,
     parse_row,
     BigQueryTestSchemaField,
+    BigQueryTestTable,
+    Null,
     update_record,
     table_from_definition_string,
     table_from_api_response,
+    api_response_from_records,
     flatten_table,
     table_prettyprint,
     narrow_fields_to_columns
@@ -45,6 +49,41 @@ class TestBigQueryTestTable(unittest.TestCase):
         with self.assertRaises(ValueError):
             parse_row(row, columns, offsets)
 
+    def test_parse_bad_row_message(self):
+        columns, offsets = parse_column_header('  c1   c2.a c2.b')
+        with self.assertRaises(ValueError) as cm:
+            parse_row('  ab cde   fghi', columns, offsets)
+        self.assertIn('\n  c1   c2.a c2.b\n  ab cde   fghi', str(cm.exception))
+
+    def test_get_hash(self):
+        schema = [
+            BigQueryTestSchemaField('c1', 'string', 'c1', None, True, False, False),
+            BigQueryTestSchemaField('c2', 'integer', 'c2', None, True, True, True),
+        ]
+        records = [{'c2': [1, 2], 'c1': u'f\xf6o'}, {'c1': Null()}]
+        table = BigQueryTestTable(records, schema)
+        digest = table.get_hash()
+        # names of registered tables depend on this value
+        self.assertEquals(digest, 'N2QwNzliZWMwMWM3YTVj')
+        self.assertEquals(BigQueryTestTable(iter(records), schema).get_hash(), digest)
+        self.assertEquals(BigQueryTestTable([dict(reversed(list(r.items()))) for r in records], schema).get_hash(), digest)
+        self.assertEquals(BigQueryTestTable([], schema).get_hash(), 'ZDlmYzAxZWQxM2ZiOWMy')
+
+        table.data = records[:1]
+        self.assertNotEquals(table.get_hash(), digest)
+        table.data = records
+        self.assertEquals(table.get_hash(), digest)
+        table.schema = schema[:1]
+        self.assertNotEquals(table.get_hash(), digest)
+
+        table = BigQueryTestTable([dict(r) for r in records], schema)
+        self.assertEquals(table.get_hash(), digest)
+        table.data[0]['c1'] = 'bar'
+        self.assertNotEquals(table.get_hash(), digest)
+        table.data[0]['c1'] = u'f\xf6o'
+        table.data.append({'c1': 'baz'})
+        self.assertNotEquals(table.get_hash(), digest)
+
     def test_update_record_flat_empty(self):
         schema = [
             BigQueryTestSchemaField('c1', 'string', 'c1', None, False, False, False),
@@ -242,6 +281,24 @@ class TestBigQueryTestTable(unittest.TestCase):
 
         self.assertEquals(table_from_api_response(response, schema).data, expected)
 
+    def test_api_response_from_records(self):
+        schema = [
+            BigQueryTestSchemaField('c1', 'string', 'c1', None, True, False, False),
+            BigQueryTestSchemaField('c2', 'float', 'c2', None, True, False, False),
+            BigQueryTestSchemaField('c3', 'record', 'c3', [
+                BigQueryTestSchemaField('x', 'boolean', 'c3.x', None, True, False, True),
+                BigQueryTestSchemaField('y', 'integer', 'c3.y', None, False, True, True),
+            ], False, True, True),
+        ]
+        records = [
+            {'c1': 'foo', 'c2': 1.5, 'c3': [{'x': True, 'y': [1, 2]}, {'y': [3]}]},
+            {'c1': 'bar'},
+        ]
+
+        response = api_response_from_records(records, schema)
+        self.assertEquals(response[1], {'f': [{'v': 'bar'}, {'v': None}, {'v': []}]})
+        self.assertEquals(table_from_api_response(response, schema).data, records)
+
     def test_prettyprint_flat(self):
         schema = [
             BigQueryTestSchemaField('c1', 'string', 'c1', None, False, False, False),
@@ -261,6 +318,7 @@ bar  456
 
         flat = flatten_table(table, schema)
         self.assertEquals(table_prettyprint(flat), expected.strip())
+        self.assertEquals(table_prettyprint(iter(flat)), expected.strip())
 
     def test_prettyprint_records_flat(self):
         schema = [
@@ -443,3 +501,48 @@ baz  3        b
         ]
 
         self.assertEquals(narrow_fields_to_columns(schema, columns), expected)
+
+    def test_lazy_table_from_api_response(self):
+        schema = [
+            BigQueryTestSchemaField('c1', 'string', 'c1', None, False, False, False),
+            BigQueryTestSchemaField('c2', 'integer', 'c2', None, False, True, True),
+        ]
+        parsed = []
+
+        def rows():
+            for i in range(3):
+                parsed.append(i)
+                yield {'f': [{'v': 'r%d' % i}, {'v': [{'v': str(i)}, {'v': str(i + 1)}]}]}
+
+        table = table_from_api_response(rows(), schema)
+        self.assertEquals(parsed, [])
+        self.assertFalse(table.is_materialized())
+
+        flat = table.iter_flat()
+        self.assertEquals(next(flat), ['c1', 'c2'])
+        self.assertEquals(next(flat), ['r0', 0])
+        self.assertEquals(parsed, [0])
+
+        self.assertEquals(table.data, [
+            {'c1': 'r0', 'c2': [0, 1]},
+            {'c1': 'r1', 'c2': [1, 2]},
+            {'c1': 'r2', 'c2': [2, 3]},
+        ])
+        self.assertEquals(list(flat), [[None, 1], ['r1', 1], [None, 2], ['r2', 2], [None, 3]])
+        self.assertEquals(parsed, [0, 1, 2])
+
+    def test_write_prettyprint(self):
+        schema = [
+            BigQueryTestSchemaField('c1', 'string', 'c1', None, False, False, False),
+            BigQueryTestSchemaField('c2', 'integer', 'c2', None, False, True, True),
+        ]
+        response = [
+            {'f': [{'v': 'a'}, {'v': [{'v': '1'}, {'v': '2'}]}]},
+            {'f': [{'v': 'bb'}, {'v': [{'v': '3'}]}]},
+        ]
+        table = table_from_api_response(response, schema)
+        sink = StringIO()
+        table.write_prettyprint(sink)
+        self.assertEquals(sink.getvalue(), table.prettyprint())
+        self.assertFalse(table.is_materialized())
+        self.assertEquals(sink.getvalue(), 'c1  c2\na   1\n    2\nbb  3')
@@ -1,6 +1,15 @@
+import shutil
+import tempfile
 import unittest
-from bigquerytest.testcase import BigQueryTestCase
+from bigquerytest.local import LocalBackend
+from bigquerytest.result_cache import QueryResultCache
+from bigquerytest.results import ResultTooLargeError
+from bigquerytest.table import BigQueryTestSchemaField, table_from_definition_string
+from bigquerytest.testcase import BigQueryTestCase, MockTableError, query_fetch_data
+from bigquerytest.registry import MockTableRegistry
+from bigquerytest.wait import Waiter
 from mock import patch
+from fake_bigquery import FakeBigQuery, field
 
 
 class BigQueryTestCaseDummy(BigQueryTestCase):
@@ -14,6 +23,36 @@ class BigQueryTestCaseLegacyDummy(BigQueryTestCaseDummy):
     use_legacy_sql = True
 
 
+class BigQueryTestCaseFakeDummy(BigQueryTestCaseDummy):
+    client_pool = None
+    schema_cache = None
+    waiter = Waiter(initial_delay=0.001)
+
+
+class BigQueryTestCaseBackgroundDummy(BigQueryTestCaseFakeDummy):
+    wait_for_uploads = False
+
+
+class BigQueryTestCaseRegistryDummy(BigQueryTestCaseFakeDummy):
+    mock_table_registry = MockTableRegistry(ttl=-1)
+
+
+class BigQueryTestCaseLocalDummy(BigQueryTestCaseDummy):
+    backend = LocalBackend({'src.data.a': [field('x', 'INTEGER'), field('y', 'STRING')]})
+
+
+class BigQueryTestCaseInlineDummy(BigQueryTestCaseDummy):
+    inline_mock_tables = True
+    inline_max_bytes = 200
+
+    def __init__(self):
+        super(BigQueryTestCaseInlineDummy, self).__init__()
+        self._bigquery_backend = LocalBackend({
+            'src.data.a': [field('x', 'INTEGER'), field('y', 'STRING')],
+            'src.data.c': [field('z', 'STRING', 'REPEATED')],
+        })
+
+
 class TestBigQueryTestCase(unittest.TestCase):
 
     @patch('google.cloud.bigquery.Client')
@@ -62,3 +101,463 @@ class TestBigQueryTestCase(unittest.TestCase):
         '''
 
         self.assertMultiLineEqual(test._replace_tables_in_query(sql), expected)
+
+
+class TestMockTables(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBigQuery()
+        self.fake.add_table('src', 'data', 'a', [field('x', 'INTEGER')])
+        self.fake.add_table('src', 'data', 'b', [field('y', 'STRING')])
+        self.fake.add_table('src', 'data', 'c', [field('z', 'STRING', 'REPEATED')])
+        patcher = patch('google.cloud.bigquery.Client', self.fake.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_test(self):
+        test = BigQueryTestCaseFakeDummy()
+        test.setUp()
+        return test
+
+    def test_mock_tables(self):
+        test = self.make_test()
+        test.mock_tables({
+            'src.data.a': '''
+                x
+                1
+                2
+            ''',
+            'src.data.b': '''
+                y
+                foo
+            ''',
+            'src.data.c': '''
+                z
+                foo
+                bar
+            ''',
+        })
+        test.query('select * from src.data.a, src.data.b, src.data.c')
+
+        self.assertEquals(self.fake.count('create'), 3)
+        self.assertEquals(self.fake.count('upload'), 3)
+        self.assertEquals(sorted(test._mock_tables), ['src.data.a', 'src.data.b', 'src.data.c'])
+        sql = self.fake.calls[-2][1]
+        for mock_table_name in test._mock_tables.values():
+            self.assertIn('`my-project.my_dataset.%s`' % mock_table_name, sql)
+
+        mock_rows = [t['rows'] for (project, _, _), t in self.fake.tables.items()
+                     if project == 'my-project']
+        self.assertEquals(sorted(mock_rows, key=len), [
+            [{'y': 'foo'}], [{'x': 1}, {'x': 2}], [{'z': ['foo']}, {'z': ['bar']}]])
+
+        test.doCleanups()
+        self.assertEquals(self.fake.count('delete'), 3)
+
+    def test_mock_table_with_null(self):
+        test = self.make_test()
+        test.mock_table('src.data.b', '''
+            y
+            null
+            b
+        ''')
+        (key,) = [k for k in self.fake.tables if k[0] == 'my-project']
+        self.assertEquals(self.fake.tables[key]['rows'], [{'y': None}, {'y': 'b'}])
+        test.doCleanups()
+
+    def test_mock_tables_collects_errors(self):
+        self.fake.fail_tables = set(['_a_', '_b_'])
+        test = self.make_test()
+        test.mock_tables({
+            'src.data.a': '''
+                x
+                1
+            ''',
+            'src.data.b': '''
+                y
+                foo
+            ''',
+            'src.data.c': '''
+                z
+                foo
+            ''',
+        })
+        with self.assertRaises(MockTableError) as context:
+            test.query('select 1')
+
+        self.assertEquals(sorted([table_id for table_id, _ in context.exception.errors]),
+                          ['src.data.a', 'src.data.b'])
+        self.assertEquals(self.fake.count('query'), 0)
+
+    def test_cleanup_deletes_tables_when_others_failed(self):
+        self.fake.fail_tables = set(['_b_'])
+        test = self.make_test()
+        test.mock_tables({
+            'src.data.a': '''
+                x
+                1
+            ''',
+            'src.data.b': '''
+                y
+                foo
+            ''',
+        })
+        for _, operation in list(test._pending_operations):
+            try:
+                operation.get()
+            except Exception:
+                pass
+        test.doCleanups()
+        self.assertEquals([k for k in self.fake.tables if k[0] == 'my-project'], [])
+
+    def test_single_error_is_wrapped(self):
+        self.fake.fail_tables = set(['_a_'])
+        test = self.make_test()
+        test.mock_tables({'src.data.a': '''
+            x
+            1
+        '''})
+        with self.assertRaises(MockTableError) as context:
+            test.query('select 1')
+        self.assertEquals([table_id for table_id, _ in context.exception.errors], ['src.data.a'])
+
+    def test_errors_without_query_fail_the_test(self):
+        self.fake.fail_tables = set(['_a_'])
+
+        class NoQueryTest(BigQueryTestCaseFakeDummy):
+            def __init__(self):
+                BigQueryTestCase.__init__(self, 'test_no_query')
+
+            def test_no_query(self):
+                self.mock_tables({'src.data.a': '''
+                    x
+                    1
+                '''}, cleanup=False)
+
+        result = unittest.TestResult()
+        NoQueryTest().run(result)
+        self.assertEquals(len(result.errors), 1)
+        self.assertIn('MockTableError', result.errors[0][1])
+
+    def test_query_fetch_data(self):
+        self.fake.query_response = lambda sql: ([field('n', 'INTEGER')], [{'f': [{'v': '3'}]}])
+        query = self.fake.client('my-project').run_sync_query('select 3 as n')
+        query.run()
+        query_fetch_data(self.fake.client('my-project'), query)
+        self.assertEquals(query._properties['rows'], [{'f': [{'v': '3'}]}])
+
+    def test_wait_for_uploads_in_background(self):
+        test = BigQueryTestCaseBackgroundDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x
+            1
+        ''')
+        self.assertEquals(len(test._pending_operations), 1)
+        test.query('select * from src.data.a')
+        self.assertEquals(test._pending_operations, [])
+        self.assertEquals(self.fake.count('query'), 1)
+
+    def test_mock_table_registry(self):
+        self.fake.add_table('my-project', 'my_dataset', 'bigquery_test_mock_stale', [])
+        self.fake.add_table('my-project', 'my_dataset', 'unrelated', [])
+        for _ in range(3):
+            test = BigQueryTestCaseRegistryDummy()
+            test.setUp()
+            test.mock_table('src.data.a', '''
+                x
+                1
+            ''')
+            test.doCleanups()
+
+        self.assertEquals(self.fake.count('list_tables'), 1)
+        self.assertEquals(self.fake.count('create'), 1)
+        self.assertEquals(self.fake.count('exists'), 2)
+        self.assertEquals(self.fake.calls.count(('delete', 'bigquery_test_mock_stale')), 1)
+        self.assertEquals(self.fake.calls.count(('delete', 'unrelated')), 0)
+        self.assertEquals(test.mock_table_registry.stats()['hits'], 2)
+
+    def test_query_result_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.fake.query_response = lambda sql: ([field('n', 'INTEGER')], [{'f': [{'v': '3'}]}])
+
+        class CachedDummy(BigQueryTestCaseFakeDummy):
+            query_result_cache = QueryResultCache(directory)
+
+        class RefreshDummy(CachedDummy):
+            refresh_query_results = True
+
+        for test_class in [CachedDummy, CachedDummy, RefreshDummy]:
+            test = test_class()
+            test.setUp()
+            test.mock_table('src.data.a', '''
+                x
+                1
+            ''')
+            self.assertEquals(test.query('select count(*) as n from src.data.a').data, [{'n': 3}])
+
+        self.assertEquals(self.fake.count('query'), 2)
+
+    def test_query_multiple_pages(self):
+        self.fake.page_size = 3
+        self.fake.query_response = lambda sql: (
+            [field('n', 'INTEGER'), field('r', 'RECORD', 'REPEATED', [field('s', 'STRING')])],
+            [{'f': [{'v': str(i)}, {'v': [{'v': {'f': [{'v': 'x%d' % i}]}}]}]} for i in range(10)])
+        test = self.make_test()
+        actual = test.query('select 1')
+        self.assertEquals(actual.data, [{'n': i, 'r': [{'s': 'x%d' % i}]} for i in range(10)])
+        self.assertEquals(self.fake.count('api_request'), 4)
+
+    def test_query_max_rows(self):
+        self.fake.query_response = lambda sql: (
+            [field('n', 'INTEGER')], [{'f': [{'v': str(i)}]} for i in range(10)])
+
+        class LimitedDummy(BigQueryTestCaseFakeDummy):
+            max_result_rows = 5
+
+        test = LimitedDummy()
+        test.setUp()
+        with self.assertRaises(ResultTooLargeError):
+            test.query('select 1')
+
+    def test_assert_tables_equal(self):
+        test = self.make_test()
+        actual = table_from_definition_string('''
+            x
+            1
+            2
+        ''', [BigQueryTestSchemaField('x', 'integer', 'x', None, True, False, False)])
+        test.assert_tables_equal(actual, '''
+            x
+            1
+            2
+        ''')
+        test.assertEqual(actual, actual)
+        with self.assertRaises(AssertionError) as context:
+            test.assert_tables_equal(actual, '''
+                x
+                1
+                3
+            ''')
+        self.assertIn('1 mismatching rows, first at row 2', str(context.exception))
+
+    def test_assert_tables_equal_unordered(self):
+        test = self.make_test()
+        actual = table_from_definition_string('''
+            x  y
+            1  a
+            2  b
+        ''', [BigQueryTestSchemaField('x', 'integer', 'x', None, True, False, False),
+              BigQueryTestSchemaField('y', 'string', 'y', None, True, False, False)])
+        expected = '''
+            x  y
+            2  b
+            1  a
+        '''
+        test.assert_tables_equal(actual, expected, ordered=False)
+        test.assert_tables_equal(actual, expected, key='x')
+        with self.assertRaises(AssertionError):
+            test.assert_tables_equal(actual, expected)
+        with self.assertRaises(AssertionError) as context:
+            test.assert_tables_equal(actual, '''
+                x  y
+                2  c
+                1  a
+            ''', key=['x'])
+        self.assertIn('1 mismatching records by key', str(context.exception))
+
+    def test_local_backend(self):
+        test = BigQueryTestCaseLocalDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  y
+            1  foo
+            2  bar
+            3  foo
+        ''')
+        actual = test.query('''
+            select y, sum(x) as total from src.data.a group by y order by total
+        ''')
+        test.assert_tables_equal(actual, '''
+            y    total
+            bar  2
+            foo  4
+        ''')
+        test.doCleanups()
+        self.assertEquals(test.backend.list_tables(), [])
+
+    def test_columnar_tables(self):
+        class ColumnarDummy(BigQueryTestCaseLocalDummy):
+            columnar_tables = True
+
+        test = ColumnarDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  y
+            1  foo
+            2  bar
+            3  foo
+        ''')
+        actual = test.query('''
+            select y, sum(x) as total from src.data.a group by y order by total
+        ''')
+        self.assertTrue(actual.is_columnar())
+        test.assert_tables_equal(actual, '''
+            y    total
+            bar  2
+            foo  4
+        ''')
+        with self.assertRaises(AssertionError):
+            test.assert_tables_equal(actual, '''
+                y    total
+                bar  2
+                foo  5
+            ''')
+        test.doCleanups()
+
+    def test_class_mock_tables(self):
+        queries = []
+        setups = []
+
+        class ClassFixtureTest(BigQueryTestCaseFakeDummy):
+            class_mock_tables = {
+                'src.data.a': '''
+                    x
+                    1
+                ''',
+            }
+
+            @classmethod
+            def setUpClass(cls):
+                super(ClassFixtureTest, cls).setUpClass()
+                cls.mock_class_table('src.data.b', '''
+                    y
+                    foo
+                ''')
+
+            def __init__(self, methodName):
+                BigQueryTestCase.__init__(self, methodName)
+
+            def setUp(self):
+                super(ClassFixtureTest, self).setUp()
+                setups.append(self.id())
+
+            def test_one(self):
+                queries.append(self.query('select * from src.data.a, src.data.b'))
+
+            def test_two(self):
+                self.mock_table('src.data.b', '''
+                    y
+                    bar
+                ''')
+                queries.append(self.query('select * from src.data.a, src.data.b'))
+
+        suite = unittest.TestLoader().loadTestsFromTestCase(ClassFixtureTest)
+        result = unittest.TestResult()
+        suite.run(result)
+        self.assertEquals(result.errors + result.failures, [])
+
+        self.assertEquals(len(queries), 2)
+        self.assertEquals(len(setups), 2)
+        self.assertEquals(self.fake.count('create'), 3)
+        sql1, sql2 = [c[1] for c in self.fake.calls if c[0] == 'query']
+        self.assertNotEquals(sql1, sql2)
+        self.assertEquals(sql1.split(',')[0], sql2.split(',')[0])
+        self.assertEquals(self.fake.count('delete'), 3)
+        self.assertEquals(ClassFixtureTest._class_mock_tables, {})
+
+    def test_class_mock_tables_failure_deletes_created_tables(self):
+        self.fake.fail_tables = set(['_b_'])
+
+        class FailingClassFixtureTest(BigQueryTestCaseFakeDummy):
+            class_mock_tables = {
+                'src.data.a': '''
+                    x
+                    1
+                ''',
+                'src.data.b': '''
+                    y
+                    foo
+                ''',
+            }
+
+            def __init__(self, methodName):
+                BigQueryTestCase.__init__(self, methodName)
+
+            def test_one(self):
+                pass
+
+        suite = unittest.TestLoader().loadTestsFromTestCase(FailingClassFixtureTest)
+        result = unittest.TestResult()
+        suite.run(result)
+        self.assertEquals(len(result.errors), 1)
+        self.assertEquals(result.testsRun, 0)
+        self.assertEquals(self.fake.count('create'), 2)
+        self.assertEquals(self.fake.count('delete'), 1)
+        self.assertEquals([k for k in self.fake.tables if k[0] == 'my-project'], [])
+        self.assertEquals(FailingClassFixtureTest._class_mock_tables, {})
+
+    def test_inline_mock_tables(self):
+        test = BigQueryTestCaseInlineDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  y
+            1  foo
+            2
+        ''')
+        test.mock_table('src.data.c', '''
+            z
+            foo
+            bar
+        ''')
+        self.assertEquals(sorted(test._inline_tables), ['src.data.a', 'src.data.c'])
+
+        sql = test._replace_tables_in_query('select a.x, y from src.data.a')
+        self.assertTrue(sql.startswith('WITH `__bqt_a_'))
+        self.assertIn(' AS (SELECT * FROM UNNEST(ARRAY<STRUCT<`x` INT64', sql)
+        self.assertIn('` AS `a`', sql)
+        self.assertNotIn('__bqt_c_', sql)
+
+        actual = test.query('''
+            select a.x, a.y, c.z from src.data.a, src.data.c where c.z[offset(0)] = 'foo'
+        ''')
+        test.assert_tables_equal(actual, '''
+            x  y    z
+            1  foo  foo
+            2
+        ''')
+        self.assertEquals(test.backend.list_tables(), [])
+
+    def test_inline_mock_tables_with_query_ctes(self):
+        test = BigQueryTestCaseInlineDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  y
+            1  foo
+            2  bar
+        ''')
+        actual = test.query('''
+            with a as (select x from src.data.a where x > 1)
+            select a.x, b.y from a, src.data.a b where b.x = 1
+        ''')
+        test.assert_tables_equal(actual, '''
+            x  y
+            2  foo
+        ''')
+
+    def test_inline_mock_tables_fallback(self):
+        test = BigQueryTestCaseInlineDummy()
+        test.setUp()
+        test.mock_table('src.data.a', '''
+            x  y
+            1  %s
+        ''' % ('a' * 200))
+        self.assertEquals(test._inline_tables, {})
+        self.assertEquals(len(test.backend.list_tables()), 1)
+        actual = test.query('select x from src.data.a')
+        test.assert_tables_equal(actual, '''
+            x
+            1
+        ''')
+        test.doCleanups()
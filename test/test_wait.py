@@ -0,0 +1,68 @@
+import unittest
+from bigquerytest.wait import Waiter, WaitTimeoutError
+from fake_bigquery import FakeClock
+
+
+class TestWaiter(unittest.TestCase):
+
+    def test_exponential_backoff(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(initial_delay=0.01, multiplier=2, jitter=0, clock=clock)
+        results = iter([False, False, False, True])
+        waiter.wait(lambda: next(results), 'create')
+        self.assertEquals(clock.sleeps, [0.01, 0.02, 0.04])
+
+    def test_max_delay(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(initial_delay=1, max_delay=3, jitter=0, clock=clock)
+        results = iter([False] * 4 + [True])
+        waiter.wait(lambda: next(results))
+        self.assertEquals(clock.sleeps, [1, 2, 3, 3])
+
+    def test_jitter(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(initial_delay=1, jitter=0.5, clock=clock, random=lambda: 1.0)
+        results = iter([False, True])
+        waiter.wait(lambda: next(results))
+        self.assertEquals(clock.sleeps, [1.5])
+
+    def test_no_wait_when_done(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(clock=clock)
+        waiter.wait(lambda: True, 'delete')
+        self.assertEquals(clock.sleeps, [])
+        self.assertEquals(waiter.stats.histograms['delete'].count, 1)
+
+    def test_deadline(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(initial_delay=1, jitter=0, timeout=10, clock=clock)
+        with self.assertRaises(WaitTimeoutError):
+            waiter.wait(lambda: False)
+        self.assertEquals(clock.now, 10)
+
+    def test_histogram(self):
+        clock = FakeClock(0.0)
+        waiter = Waiter(initial_delay=0.1, jitter=0, clock=clock)
+        results = iter([False, True])
+        waiter.wait(lambda: next(results), 'upload')
+        histogram = waiter.stats.histograms['upload']
+        self.assertEquals(histogram.count, 1)
+        self.assertAlmostEqual(histogram.total, 0.1)
+        # 100ms falls in the [64ms, 128ms) bucket
+        self.assertEquals(histogram.buckets[7], 1)
+        self.assertIn('upload', waiter.stats.report())
+
+    def test_wait_async(self):
+        waiter = Waiter(jitter=0, clock=FakeClock(0.0))
+        results = iter([False, True])
+        future = waiter.wait_async(lambda: next(results), 'upload')
+        future.get(5)
+        self.assertTrue(future.successful())
+        waiter.close()
+
+    def test_wait_async_error(self):
+        waiter = Waiter(initial_delay=1, timeout=1, clock=FakeClock(0.0))
+        future = waiter.wait_async(lambda: False)
+        with self.assertRaises(WaitTimeoutError):
+            future.get(5)
+        waiter.close()